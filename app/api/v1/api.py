@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends
 
 from app.api.v1.endpoints import ai, auth, notes, users, scheduler
-from app.core.deps import get_current_user
+from app.core.deps import get_current_user, bind_ai_user
 
 api_router = APIRouter()
 api_router.include_router(
-    ai.router, prefix="/ai", tags=["ai"], dependencies=[Depends(get_current_user)]
+    ai.router, prefix="/ai", tags=["ai"], dependencies=[Depends(bind_ai_user)]
 )
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(
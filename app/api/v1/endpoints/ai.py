@@ -1,163 +1,134 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Body, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session
-from typing import List, Any
+from typing import Any, AsyncIterator, Callable, Optional
 import asyncio
+import json
+import time
 
+from app.core.config import settings
 from app.core.deps import get_current_user
 from app.crud import v1
 from app.db import session
-from app.models import user as UserModel, note as NoteModel, task as TaskModel
-from app.schemas import note as NoteSchema, task as TaskSchema, common as CommonSchema
-from app.services import ai_service
+from app.models import user as UserModel, note as NoteModel
+from app.schemas import (
+    note as NoteSchema,
+    common as CommonSchema,
+    ai_job as AiJobSchema,
+    ai_usage as AiUsageSchema,
+    ai_pipeline as AiPipelineSchema,
+)
+from app.services import ai_service, ai_actions, ai_jobs
+from app.services.ai_precompute import precomputer
+from app.services.digest_service import digest_pipeline
+from app.services.ai_usage import usage_ledger
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Documents the 202 returned when an action is queued with ?async_job=true
+_ASYNC_JOB_RESPONSES = {202: {"model": AiJobSchema.AiJobRead}}
 
-# --- Helper Functions (Keep as previously defined) ---
-# _generate_and_create_tasks
-# _apply_ai_to_existing_tasks
-# (Include the code for these helpers from the previous responses here)
-async def _generate_and_create_tasks(
-    note: NoteModel.Note,
-    current_user: UserModel.User,
-    session: Session,
-) -> bool:
-    """Generates tasks via AI and saves them. Returns True if tasks were created."""
-    logger.info(
-        f"Note {note.id} is task-based but has no tasks. Attempting generation."
-    )
-    language_hint = None  # Add language detection if possible
-    generated_titles = await ai_service.generate_tasks_from_title(
-        note.title, language_hint
-    )
 
-    if not generated_titles:
-        logger.warning(
-            f"AI did not generate any tasks for note {note.id} (Title: {note.title})."
-        )
-        return False
+# --- Unified API Endpoints (Including Save for Summarize) ---
 
-    logger.info(f"Generated {len(generated_titles)} task titles for note {note.id}.")
-    try:
-        created_count = 0
-        for task_title in generated_titles:
-            if task_title:
-                task_create_data = TaskSchema.TaskCreate(title=task_title)
-                # Assuming create_task handles adding task to note and commits/adds to session
-                created_task = v1.note.create_task(
-                    note.id, task_create_data, current_user, session
-                )
-                if created_task:
-                    created_count += 1
-                else:
-                    logger.error(
-                        f"Failed to create task '{task_title}' for note {note.id}"
-                    )
-        logger.info(f"Successfully created {created_count} tasks for note {note.id}.")
-        # Ensure changes are flushed to session before refresh if create_task doesn't commit
-        session.flush()
-        return created_count > 0
-    except Exception as e:
-        logger.error(
-            f"Error saving generated tasks for note {note.id}: {e}", exc_info=True
-        )
-        raise HTTPException(status_code=500, detail="Failed to save generated tasks.")
 
+@router.get("/metrics")
+async def get_ai_metrics() -> dict[str, Any]:
+    """Returns runtime counters of the AI layer (model pool, caches, ...)."""
+    metrics = await ai_service.get_ai_metrics()
+    metrics["precompute"] = precomputer.stats()
+    metrics["digest"] = digest_pipeline.stats()
+    return metrics
 
-async def _apply_ai_to_existing_tasks(
-    ai_function: callable,
-    note: NoteModel.Note,
-    session: Session,
-    is_sub_task_structure: bool = False,
-    **kwargs,  # Pass extra args like style
+
+@router.get("/usage", response_model=AiUsageSchema.AiUsageRollup)
+def get_ai_usage(
+    days: Optional[int] = Query(
+        None, ge=1, description="Look-back window in days (all time if omitted)"
+    ),
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
 ):
-    """Applies an AI function to the titles of existing tasks/subtasks concurrently."""
-    tasks_to_process = []
-    # Ensure tasks are loaded before processing
-    if not hasattr(note, "tasks") or note.tasks is None:
-        logger.debug(
-            f"Explicitly refreshing tasks for note {note.id} before AI application."
-        )
-        session.refresh(note, attribute_names=["tasks"])
-
-    if is_sub_task_structure:
-        # Also ensure sub-tasks are loaded if needed (might require deeper refresh or careful loading)
-        for parent_task in note.tasks:
-            # Explicitly refresh sub-tasks for the parent task if necessary
-            if not hasattr(parent_task, "tasks") or parent_task.tasks is None:
-                logger.debug(
-                    f"Explicitly refreshing sub-tasks for parent task {parent_task.id}."
-                )
-                session.refresh(parent_task, attribute_names=["tasks"])
-            if parent_task.tasks:
-                tasks_to_process.extend(
-                    [(sub_task, parent_task.title) for sub_task in parent_task.tasks]
-                )
-    else:
-        # Ensure tasks relationship is loaded for the note
-        if not hasattr(note, "tasks") or note.tasks is None:
-            session.refresh(note, attribute_names=["tasks"])
-        if note.tasks:  # Check if tasks exist after refresh
-            tasks_to_process.extend([(task, note.title) for task in note.tasks])
-
-    if not tasks_to_process:
-        logger.info(f"No existing tasks found to apply AI for note {note.id}.")
-        return  # Nothing to do
-
-    logger.info(
-        f"Applying AI function '{ai_function.__name__}' to {len(tasks_to_process)} tasks/subtasks for note {note.id}."
-    )
+    """
+    Returns the current user's AI usage (calls, cache hits, tokens, latency),
+    totalled and per operation. Records reach the ledger in batches, so the last
+    few seconds of calls may not be included yet.
+    """
+    return usage_ledger.rollup(current_user.id, days, session)
 
-    update_coroutines = []
-    for task, context_title in tasks_to_process:
 
-        async def update_single_task(task_to_update: TaskModel.Task, context: str):
-            try:
-                # Pass kwargs (like style) to the AI function
-                modified_title = await ai_function(
-                    task_to_update.title, context, **kwargs
-                )
-                if modified_title != task_to_update.title:
-                    task_update_data = TaskSchema.TaskUpdate(title=modified_title)
-                    # Assuming update_task handles session/commit logic correctly
-                    updated = v1.note.update_task(
-                        task_to_update.id, task_update_data, session
-                    )
-                    if not updated:
-                        logger.warning(
-                            f"CRUD function failed to update task {task_to_update.id} after AI processing."
-                        )
-            except Exception as e:
-                logger.error(
-                    f"Error applying AI or updating task {task_to_update.id}: {e}",
-                    exc_info=True,
-                )
+async def _enqueue_ai_job(
+    action: str,
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    options: CommonSchema.AiActionRequest,
+    bypass_cache: bool = False,
+) -> JSONResponse:
+    job = await ai_jobs.enqueue_job(
+        action, note.id, current_user.id, options, use_cache=not bypass_cache
+    )
+    job_read = AiJobSchema.AiJobRead.model_validate(job)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED, content=job_read.model_dump(mode="json")
+    )
 
-        update_coroutines.append(update_single_task(task, context_title))
 
-    results = await asyncio.gather(*update_coroutines, return_exceptions=True)
-    # Log any exceptions gathered
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            task_id = tasks_to_process[i][0].id  # Safely get task id
-            logger.error(f"Exception processing task {task_id} during gather: {result}")
-    # Ensure changes within the loop are flushed before the final note refresh
-    session.flush()
+@router.get("/jobs/{job_id}", response_model=AiJobSchema.AiJobRead)
+async def get_ai_job(
+    job_id: str,
+    current_user: UserModel.User = Depends(get_current_user),
+):
+    job = await asyncio.to_thread(ai_jobs.get_job, job_id)
+    if not job or job.get("user_id") != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    return job
 
 
-# --- Unified API Endpoints (Including Save for Summarize) ---
+@router.post("/bulk")
+async def bulk_ai_action(
+    request: CommonSchema.AiBulkRequest,
+    current_user: UserModel.User = Depends(get_current_user),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+):
+    """
+    Applies one action to many content notes and streams a Server-Sent `result`
+    event per note as it finishes, then a `done` event once all new contents are
+    saved in a single transaction.
+    """
+    if len(set(request.note_ids)) > settings.AI_BULK_MAX_NOTES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.AI_BULK_MAX_NOTES} notes per bulk request.",
+        )
+    return _sse_response(
+        _run_bulk_action(request, current_user, use_cache=not bypass_cache)
+    )
 
 
 # Keep /format, /cleanup, /refine, /polish, /continue as in the previous response
 # (Include their code here)
-@router.post("/{note_id}/format", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/format",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def format_note(
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -165,25 +136,26 @@ async def format_note(
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
-    try:
-        if note.type in [1, 4]:  # Content-based note
-            if note.content is not None:  # Check if content exists
-                modified_content = await ai_service.format_content(
-                    note.content, note.title
-                )
-                if modified_content != note.content:
-                    note_update_data = NoteSchema.NoteUpdate(content=modified_content)
-                    v1.note.update_note(
-                        note.id, note_update_data, current_user, session
-                    )
-                    session.flush()  # Ensure change is flushed before refresh
-            else:
-                logger.info(f"Note {note.id} has no content to format.")
-        else:  # Task-based note
-            logger.info(
-                f"Format requested for task-based note {note.id}. No action taken on tasks for 'format'."
-            )
+    if async_job:
+        return await _enqueue_ai_job(
+            "format",
+            note,
+            current_user,
+            CommonSchema.AiActionRequest(),
+            bypass_cache=bypass_cache,
+        )
 
+    try:
+        await ai_actions.run_note_action(
+            "format",
+            note,
+            current_user,
+            session,
+            CommonSchema.AiActionRequest(),
+            use_cache=not bypass_cache,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             f"Error during format processing for note {note.id}: {e}", exc_info=True
@@ -195,11 +167,21 @@ async def format_note(
     return note
 
 
-@router.post("/{note_id}/cleanup", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/cleanup",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def cleanup_note_or_tasks(
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -207,32 +189,26 @@ async def cleanup_note_or_tasks(
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
-    try:
-        if note.type in [1, 4]:  # Content-based
-            if note.content is not None:
-                modified_content = await ai_service.cleanup_content(
-                    note.content, note.title
-                )
-                if modified_content != note.content:
-                    note_update_data = NoteSchema.NoteUpdate(content=modified_content)
-                    v1.note.update_note(
-                        note.id, note_update_data, current_user, session
-                    )
-                    session.flush()
-            else:
-                logger.info(f"Note {note.id} has no content to clean up.")
-        else:  # Task-based
-            if not hasattr(note, "tasks") or note.tasks is None:
-                session.refresh(note, attribute_names=["tasks"])
-            tasks_exist = bool(note.tasks)
-            if not tasks_exist:
-                await _generate_and_create_tasks(note, current_user, session)
-            else:
-                is_sub_task = note.type == 3
-                await _apply_ai_to_existing_tasks(
-                    ai_service.cleanup_content, note, session, is_sub_task
-                )
+    if async_job:
+        return await _enqueue_ai_job(
+            "cleanup",
+            note,
+            current_user,
+            CommonSchema.AiActionRequest(),
+            bypass_cache=bypass_cache,
+        )
 
+    try:
+        await ai_actions.run_note_action(
+            "cleanup",
+            note,
+            current_user,
+            session,
+            CommonSchema.AiActionRequest(),
+            use_cache=not bypass_cache,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during cleanup for note {note.id}: {e}", exc_info=True)
         raise HTTPException(
@@ -244,14 +220,24 @@ async def cleanup_note_or_tasks(
     return note
 
 
-@router.post("/{note_id}/refine", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/refine",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def refine_note_or_tasks(
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
     options: CommonSchema.AiActionRequest = Body(
         default=CommonSchema.AiActionRequest()
     ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -259,35 +245,22 @@ async def refine_note_or_tasks(
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
+    if async_job:
+        return await _enqueue_ai_job(
+            "refine", note, current_user, options, bypass_cache=bypass_cache
+        )
+
     try:
-        if note.type in [1, 4]:
-            if note.content is not None:
-                modified_content = await ai_service.refine_content(
-                    note.content, note.title, style=options.style
-                )
-                if modified_content != note.content:
-                    note_update_data = NoteSchema.NoteUpdate(content=modified_content)
-                    v1.note.update_note(
-                        note.id, note_update_data, current_user, session
-                    )
-                    session.flush()
-            else:
-                logger.info(f"Note {note.id} has no content to refine.")
-        else:
-            if not hasattr(note, "tasks") or note.tasks is None:
-                session.refresh(note, attribute_names=["tasks"])
-            tasks_exist = bool(note.tasks)
-            if not tasks_exist:
-                await _generate_and_create_tasks(note, current_user, session)
-            else:
-                is_sub_task = note.type == 3
-                await _apply_ai_to_existing_tasks(
-                    ai_service.refine_content,
-                    note,
-                    session,
-                    is_sub_task,
-                    style=options.style,
-                )
+        await ai_actions.run_note_action(
+            "refine",
+            note,
+            current_user,
+            session,
+            options,
+            use_cache=not bypass_cache,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during refine for note {note.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to process refine request.")
@@ -297,11 +270,21 @@ async def refine_note_or_tasks(
     return note
 
 
-@router.post("/{note_id}/polish", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/polish",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def polish_note_or_tasks(
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -309,31 +292,26 @@ async def polish_note_or_tasks(
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
+    if async_job:
+        return await _enqueue_ai_job(
+            "polish",
+            note,
+            current_user,
+            CommonSchema.AiActionRequest(),
+            bypass_cache=bypass_cache,
+        )
+
     try:
-        if note.type in [1, 4]:
-            if note.content is not None:
-                modified_content = await ai_service.polish_content(
-                    note.content, note.title
-                )
-                if modified_content != note.content:
-                    note_update_data = NoteSchema.NoteUpdate(content=modified_content)
-                    v1.note.update_note(
-                        note.id, note_update_data, current_user, session
-                    )
-                    session.flush()
-            else:
-                logger.info(f"Note {note.id} has no content to polish.")
-        else:
-            if not hasattr(note, "tasks") or note.tasks is None:
-                session.refresh(note, attribute_names=["tasks"])
-            tasks_exist = bool(note.tasks)
-            if not tasks_exist:
-                await _generate_and_create_tasks(note, current_user, session)
-            else:
-                is_sub_task = note.type == 3
-                await _apply_ai_to_existing_tasks(
-                    ai_service.polish_content, note, session, is_sub_task
-                )
+        await ai_actions.run_note_action(
+            "polish",
+            note,
+            current_user,
+            session,
+            CommonSchema.AiActionRequest(),
+            use_cache=not bypass_cache,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during polish for note {note.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to process polish request.")
@@ -343,7 +321,11 @@ async def polish_note_or_tasks(
     return note
 
 
-@router.post("/{note_id}/continue", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/continue",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def continue_note_or_tasks(
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
@@ -351,6 +333,9 @@ async def continue_note_or_tasks(
     options: CommonSchema.AiActionRequest = Body(
         default=CommonSchema.AiActionRequest()
     ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -358,70 +343,22 @@ async def continue_note_or_tasks(
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
-    try:
-        if note.type in [1, 4]:  # Content-based
-            # --- Handle None or empty content ---
-            # Pass note.content directly (which might be None) to the service function
-            # The service function is now designed to handle None/empty content
-            generated_text = await ai_service.continue_writing(
-                note.content,  # Pass potentially None content
-                note.title
-            )
-
-            if generated_text:  # Only proceed if AI generated something
-                original_content = (
-                    note.content if note.content else ""
-                )  # Treat None as empty string for appending
-                # Determine separator: Add if original content existed, otherwise no separator needed.
-                separator = "\n\n" if original_content else ""
-                new_content = original_content + separator + generated_text
-
-                # Update the note
-                note_update_data = NoteSchema.NoteUpdate(content=new_content)
-                v1.note.update_note(note.id, note_update_data, current_user, session)
-                session.flush()
-                logger.info(
-                    f"Successfully updated content for note {note.id} via continue writing."
-                )
-            else:
-                logger.info(
-                    f"AI did not generate text for continue writing on note {note.id}."
-                )
-
-        else:  # Task-based: Generate *more* tasks (Logic remains the same)
-            if not hasattr(note, "tasks") or note.tasks is None:
-                session.refresh(note, attribute_names=["tasks"])
-            existing_task_titles = [task.title for task in note.tasks if task.title]
-            language_hint = None
-            logger.info(
-                f"Continue writing requested for task note {note.id}. Generating more tasks."
-            )
-            new_task_titles = await ai_service.generate_more_tasks(
-                note.title, existing_task_titles, language_hint
-            )
-
-            if new_task_titles:
-                logger.info(
-                    f"Generated {len(new_task_titles)} additional tasks for note {note.id}."
-                )
-                created_count = 0
-                for task_title in new_task_titles:
-                    if task_title:
-                        task_create_data = TaskSchema.TaskCreate(title=task_title)
-                        created = v1.note.create_task(
-                            note.id, task_create_data, current_user, session
-                        )
-                        if created:
-                            created_count += 1
-                logger.info(
-                    f"Successfully added {created_count} tasks for note {note.id}."
-                )
-                session.flush()
-            else:
-                logger.info(
-                    f"AI did not generate any additional tasks for note {note.id}."
-                )
+    if async_job:
+        return await _enqueue_ai_job(
+            "continue", note, current_user, options, bypass_cache=False
+        )
 
+    try:
+        await ai_actions.run_note_action(
+            "continue",
+            note,
+            current_user,
+            session,
+            options,
+            use_cache=True,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             f"Error during continue writing for note {note.id}: {e}", exc_info=True
@@ -435,14 +372,24 @@ async def continue_note_or_tasks(
     return note
 
 
-@router.post("/{note_id}/summarize", response_model=NoteSchema.NoteRead)
+@router.post(
+    "/{note_id}/summarize",
+    response_model=NoteSchema.NoteRead,
+    responses=_ASYNC_JOB_RESPONSES,
+)
 async def summarize_and_replace_or_create_task(  # Renamed for clarity
     note_id: int,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
     options: CommonSchema.AiActionRequest = Body(
         default=CommonSchema.AiActionRequest()
     ),
+    async_job: bool = Query(
+        False, description="Queue the action and return 202 with a job id"
+    ),
 ):
     note = v1.note.get_note_by_id(note_id, current_user, session)
     if not note:
@@ -450,86 +397,22 @@ async def summarize_and_replace_or_create_task(  # Renamed for clarity
             status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
         )
 
-    try:
-        if note.type in [1, 4]:  # Content-based: REPLACE content with summary
-            if (
-                note.content and note.content.strip()
-            ):  # Check if content exists and is not just whitespace
-                logger.info(
-                    f"Generating summary to replace content for note {note.id}."
-                )
-                generated_summary = await ai_service.summarize_content(
-                    note.content, note.title, max_length=options.max_length
-                )
-
-                if generated_summary:
-                    # --- REPLACE content ---
-                    note_update_data = NoteSchema.NoteUpdate(content=generated_summary)
-                    v1.note.update_note(
-                        note.id, note_update_data, current_user, session
-                    )
-                    session.flush()  # Flush update
-                    logger.info(f"Replaced content with summary for note {note.id}.")
-                    # --- End of REPLACE content ---
-                else:
-                    logger.warning(
-                        f"AI did not generate a summary for note {note.id}. Content not replaced."
-                    )
-            else:
-                logger.info("Note has no content to summarize or replace.")
-
-        else:  # Task-based: Create a new task with the summary as its title (Logic remains the same)
-            logger.info(f"Generating summary task for task-based note {note.id}.")
-            if not hasattr(note, "tasks") or note.tasks is None:
-                session.refresh(note, attribute_names=["tasks"])
-
-            task_titles = []
-            is_sub_task = note.type == 3
-            if is_sub_task:
-                for parent_task in note.tasks:
-                    if not hasattr(parent_task, "tasks") or parent_task.tasks is None:
-                        session.refresh(parent_task, attribute_names=["tasks"])
-                    if parent_task.tasks:
-                        task_titles.extend(
-                            [
-                                f"{parent_task.title}: {sub.title}"
-                                for sub in parent_task.tasks
-                                if sub.title
-                            ]
-                        )
-            else:
-                task_titles = [task.title for task in note.tasks if task.title]
-
-            if task_titles:
-                summary_task_title = await ai_service.summarize_task_list(
-                    task_titles, note.title
-                )
-                if summary_task_title and not summary_task_title.lower().startswith(
-                    "summary: no tasks"
-                ):
-                    task_create_data = TaskSchema.TaskCreate(
-                        title=summary_task_title,
-                        is_finished=True,  # Optional: mark as finished
-                    )
-                    created = v1.note.create_task(
-                        note.id, task_create_data, current_user, session
-                    )
-                    if created:
-                        logger.info(
-                            f"Created summary task for note {note.id} with title: '{summary_task_title}'"
-                        )
-                        session.flush()
-                    else:
-                        logger.error(
-                            f"Failed to create summary task for note {note.id}"
-                        )
-                else:
-                    logger.info(
-                        f"AI did not generate a valid summary task title for note {note.id}."
-                    )
-            else:
-                logger.info("Note has no tasks to summarize into a new task.")
+    if async_job:
+        return await _enqueue_ai_job(
+            "summarize", note, current_user, options, bypass_cache=bypass_cache
+        )
 
+    try:
+        await ai_actions.run_note_action(
+            "summarize",
+            note,
+            current_user,
+            session,
+            options,
+            use_cache=not bypass_cache,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             f"Error during summarize processing for note {note.id}: {e}", exc_info=True
@@ -543,3 +426,288 @@ async def summarize_and_replace_or_create_task(  # Renamed for clarity
     logger.debug(f"Refreshing note {note.id} before returning after summarize.")
     session.refresh(note)
     return note
+
+
+@router.post("/{note_id}/pipeline", response_model=AiPipelineSchema.AiPipelineRead)
+async def run_note_pipeline(
+    note_id: int,
+    request: AiPipelineSchema.AiPipelineRequest,
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+):
+    """
+    Applies an ordered list of operations (e.g. cleanup, format, polish) to a
+    content note in a single model call and saves the note once.
+    """
+    note = v1.note.get_note_by_id(note_id, current_user, session)
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
+        )
+    if note.type not in [1, 4] or note.content is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Pipelines are only available for content notes with content.",
+        )
+
+    started = time.perf_counter()
+    try:
+        await ai_actions.run_pipeline(
+            note, current_user, session, request, use_cache=not bypass_cache
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during pipeline for note {note.id}: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500, detail="Failed to process pipeline request."
+        )
+
+    session.refresh(note)
+    return AiPipelineSchema.AiPipelineRead(
+        note=NoteSchema.NoteRead.model_validate(note, from_attributes=True),
+        total_ms=round((time.perf_counter() - started) * 1000, 3),
+    )
+
+
+# --- Streaming (Server-Sent Events) Variants ---
+
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Formats one Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_and_persist(
+    note_id: int,
+    current_user: UserModel.User,
+    chunks: AsyncIterator[str],
+    build_content: Callable[[Optional[str], str], Optional[str]],
+) -> AsyncIterator[str]:
+    """
+    Forwards generated chunks as `delta` events, then writes the final text to the
+    note once and emits a `done` event carrying the updated NoteRead.
+    """
+    parts = []
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield _sse_event({"delta": chunk})
+
+        generated_text = "".join(parts).strip()
+        # The request-scoped session is already closed once the body streams
+        with next(session.get_session()) as db:
+            note = v1.note.get_note_by_id(note_id, current_user, db)
+            if not note:
+                yield _sse_event({"detail": "Note not found"}, event="error")
+                return
+            new_content = build_content(note.content, generated_text)
+            if new_content is not None and new_content != note.content:
+                note_update_data = NoteSchema.NoteUpdate(content=new_content)
+                note = v1.note.update_note(note.id, note_update_data, current_user, db)
+            note_read = NoteSchema.NoteRead.model_validate(note, from_attributes=True)
+            yield _sse_event(note_read.model_dump(mode="json"), event="done")
+    except HTTPException as e:
+        yield _sse_event({"detail": e.detail}, event="error")
+    except Exception as e:
+        logger.error(
+            f"Error while streaming AI result for note {note_id}: {e}", exc_info=True
+        )
+        yield _sse_event(
+            {"detail": "Failed to process streaming request."}, event="error"
+        )
+
+
+def _sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Bulk Actions ---
+
+
+async def _run_bulk_action(
+    request: CommonSchema.AiBulkRequest,
+    current_user: UserModel.User,
+    use_cache: bool,
+) -> AsyncIterator[str]:
+    """
+    Loads the requested notes in one query, runs the action on them with at most
+    AI_BULK_CONCURRENCY notes in flight and emits a `result` event per note as it
+    finishes. New contents are saved together in one commit, reported by a final
+    `done` event.
+    """
+    note_ids = list(dict.fromkeys(request.note_ids))
+    semaphore = asyncio.Semaphore(settings.AI_BULK_CONCURRENCY)
+
+    async def process(note: NoteModel.Note) -> tuple[int, Optional[str], Optional[str]]:
+        """Returns (note id, new content, error detail) for one note."""
+        async with semaphore:
+            try:
+                new_content = await ai_actions.generate_note_content(
+                    request.action, note, request.options, use_cache=use_cache
+                )
+            except HTTPException as e:
+                return note.id, None, e.detail
+            except Exception as e:
+                logger.error(
+                    f"Error during bulk '{request.action}' for note {note.id}: {e}",
+                    exc_info=True,
+                )
+                return note.id, None, "Failed to process AI request."
+            return note.id, new_content, None
+
+    # The request-scoped session is already closed once the body streams
+    with next(session.get_session()) as db:
+        notes = {n.id: n for n in v1.note.get_notes_by_ids(note_ids, current_user, db)}
+        for note_id in note_ids:
+            if note_id not in notes:
+                yield _sse_event(
+                    {
+                        "note_id": note_id,
+                        "status": "failed",
+                        "detail": "Note not found",
+                    },
+                    event="result",
+                )
+            elif notes[note_id].type not in [1, 4]:
+                yield _sse_event(
+                    {
+                        "note_id": note_id,
+                        "status": "skipped",
+                        "detail": "Bulk actions only apply to content notes.",
+                    },
+                    event="result",
+                )
+
+        pending = [
+            asyncio.ensure_future(process(note))
+            for note in notes.values()
+            if note.type in [1, 4]
+        ]
+        new_contents: dict[int, str] = {}
+        try:
+            for finished in asyncio.as_completed(pending):
+                note_id, new_content, error = await finished
+                if error is not None:
+                    yield _sse_event(
+                        {"note_id": note_id, "status": "failed", "detail": error},
+                        event="result",
+                    )
+                    continue
+                if new_content is None or new_content == notes[note_id].content:
+                    yield _sse_event(
+                        {"note_id": note_id, "status": "unchanged"}, event="result"
+                    )
+                    continue
+                new_contents[note_id] = new_content
+                yield _sse_event({"note_id": note_id, "status": "done"}, event="result")
+        finally:
+            # Stop outstanding AI calls if the client went away
+            for task in pending:
+                task.cancel()
+
+        try:
+            v1.note.update_note_contents(new_contents, current_user, db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to save bulk '{request.action}': {e}", exc_info=True)
+            yield _sse_event({"detail": "Failed to save bulk results."}, event="error")
+            return
+        yield _sse_event({"updated_note_ids": sorted(new_contents)}, event="done")
+
+
+def _get_content_note_or_error(
+    note_id: int, current_user: UserModel.User, session: Session
+) -> NoteModel.Note:
+    note = v1.note.get_note_by_id(note_id, current_user, session)
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
+        )
+    if note.type not in [1, 4]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Streaming is only available for content notes.",
+        )
+    return note
+
+
+@router.post("/{note_id}/format/stream")
+async def stream_format_note(
+    note_id: int,
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+):
+    note = _get_content_note_or_error(note_id, current_user, session)
+    if note.content is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Note has no content to format.",
+        )
+    chunks = ai_service.stream_format_content(
+        note.content, note.title, use_cache=not bypass_cache
+    )
+    return _sse_response(
+        _stream_and_persist(note.id, current_user, chunks, lambda _, text: text or None)
+    )
+
+
+@router.post("/{note_id}/continue/stream")
+async def stream_continue_note(
+    note_id: int,
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+):
+    note = _get_content_note_or_error(note_id, current_user, session)
+
+    def append_continuation(original: Optional[str], text: str) -> Optional[str]:
+        if not text:
+            return None
+        original = original if original else ""
+        separator = "\n\n" if original else ""
+        return original + separator + text
+
+    chunks = ai_service.stream_continue_writing(note.content, note.title)
+    return _sse_response(
+        _stream_and_persist(note.id, current_user, chunks, append_continuation)
+    )
+
+
+@router.post("/{note_id}/summarize/stream")
+async def stream_summarize_note(
+    note_id: int,
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+    bypass_cache: bool = Query(
+        False, description="Skip the AI result cache and always call the model"
+    ),
+    options: CommonSchema.AiActionRequest = Body(
+        default=CommonSchema.AiActionRequest()
+    ),
+):
+    note = _get_content_note_or_error(note_id, current_user, session)
+    if not (note.content and note.content.strip()):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Note has no content to summarize.",
+        )
+    chunks = ai_service.stream_summarize_content(
+        note.content,
+        note.title,
+        max_length=options.max_length,
+        use_cache=not bypass_cache,
+    )
+    return _sse_response(
+        _stream_and_persist(note.id, current_user, chunks, lambda _, text: text or None)
+    )
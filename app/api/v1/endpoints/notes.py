@@ -1,7 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Path, Query
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    status,
+    Path,
+    Query,
+)
 from sqlmodel import Session
 from typing import Optional, Literal
 
+from app.core.config import settings
 from app.core.deps import get_current_user
 from app.crud import v1
 from app.db import session
@@ -11,10 +20,16 @@ from app.schemas import (
     common as CommonSchema,
     task as TaskSchema,
 )
+from app.services.ai_precompute import precomputer
 
 router = APIRouter()
 
 
+async def _schedule_precompute(note_id: int, user_id: int) -> None:
+    # Async so it runs on the event loop, where the debounce task is created
+    precomputer.schedule(note_id, user_id)
+
+
 @router.get("/", response_model=list[NoteSchema.NoteRead])
 def list_notes(
     current_user: UserModel.User = Depends(get_current_user),
@@ -42,15 +57,37 @@ def list_notes(
     )
 
 
+@router.get("/search/semantic", response_model=list[NoteSchema.NoteSearchResult])
+def semantic_search_notes(
+    q: str = Query(..., min_length=1, description="What the notes are about"),
+    k: int = Query(10, ge=1, le=settings.SEMANTIC_SEARCH_MAX_K),
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+):
+    """Notes ranked by similarity of meaning to q (not only exact words)."""
+    results = v1.note.search_notes_semantic(q, k, current_user, session)
+    return [{"note": note, "score": score} for note, score in results]
+
+
 @router.post(
-    "/", response_model=NoteSchema.NoteRead, status_code=status.HTTP_201_CREATED
+    "/", response_model=NoteSchema.NoteCreated, status_code=status.HTTP_201_CREATED
 )
 def create_note(
     note_create: NoteSchema.NoteCreate,
+    background_tasks: BackgroundTasks,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
 ):
-    return v1.note.create_note(note_create, current_user, session)
+    note = v1.note.create_note(note_create, current_user, session)
+    background_tasks.add_task(_schedule_precompute, note.id, current_user.id)
+    duplicates = v1.note.get_similar_notes(
+        note, settings.NOTE_DUPLICATE_MIN_SIMILARITY, 5, session
+    )
+    return {
+        **note.model_dump(),
+        "tasks": note.tasks,
+        "possible_duplicates": [duplicate.id for duplicate, _ in duplicates],
+    }
 
 
 @router.get("/{note_id}", response_model=NoteSchema.NoteRead)
@@ -65,16 +102,36 @@ def get_note(
     return note
 
 
+@router.get("/{note_id}/related", response_model=list[NoteSchema.RelatedNote])
+def get_related_notes(
+    note_id: int,
+    k: int = Query(10, ge=1, le=50),
+    current_user: UserModel.User = Depends(get_current_user),
+    session: Session = Depends(session.get_session),
+):
+    """The user's notes with the most similar text (including near-duplicates)."""
+    note = v1.note.get_note_by_id(note_id, current_user, session)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    related = v1.note.get_similar_notes(
+        note, settings.NOTE_RELATED_MIN_SIMILARITY, k, session
+    )
+    return [{"note": other, "similarity": score} for other, score in related]
+
+
 @router.put("/{note_id}", response_model=NoteSchema.NoteRead)
 def update_note(
     note_id: int,
     note_update: NoteSchema.NoteUpdate,
+    background_tasks: BackgroundTasks,
     current_user: UserModel.User = Depends(get_current_user),
     session: Session = Depends(session.get_session),
 ):
     note = v1.note.update_note(note_id, note_update, current_user, session)
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
+    if note_update.model_fields_set & {"title", "content"}:
+        background_tasks.add_task(_schedule_precompute, note.id, current_user.id)
     return note
 
 
@@ -3,6 +3,7 @@ import os
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 from functools import lru_cache
+from typing import List, Optional
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,6 +22,12 @@ class Settings(BaseSettings):
     # Redis settings
     REDIS_URL: str
 
+    # Idempotency-Key support for mutating endpoints
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_LOCK_SECONDS: int = 120  # Released early once the request finishes
+    IDEMPOTENCY_WAIT_SECONDS: float = 60
+    IDEMPOTENCY_POLL_MS: int = 200
+
     # Email settings
     SMTP_HOST: str = "smtp.gmail.com"
     SMTP_PORT: int = 587
@@ -32,6 +39,146 @@ class Settings(BaseSettings):
     # AI service settings
     GEMINI_API_KEY: str
     GEMINI_MODEL_NAME: str = "gemini-2.0-flash"
+    GEMINI_MODEL_POOL_SIZE: int = 32
+    # "gemini", or "fake" for a local deterministic stand-in (load/capacity tests)
+    AI_PROVIDER: str = "gemini"
+
+    # Token budgets (estimated locally, see app/services/ai_budget.py)
+    AI_MAX_INPUT_TOKENS: int = 200000  # Larger requests are rejected with a 413
+    AI_MAX_OUTPUT_TOKENS: int = 8192
+    AI_OUTPUT_TOKEN_RATIO: float = 1.5  # Output cap of rewrites, relative to input
+    AI_CONTINUE_CONTEXT_TOKENS: int = 8000
+    AI_CONTINUE_MAX_OUTPUT_TOKENS: int = 512
+
+    # Model routing between the primary model and a lite model
+    AI_ROUTING_ENABLED: bool = False
+    AI_ROUTING_LITE_MODEL: Optional[str] = "gemini-2.0-flash-lite"
+    AI_ROUTING_LITE_OPERATIONS: List[str] = [
+        "tasks",
+        "tasks_summary",
+        "tasks_cleanup",
+        "tasks_refine",
+        "tasks_polish",
+    ]
+    AI_ROUTING_LITE_MAX_TOKENS: int = 300
+    AI_ROUTING_WINDOW_SECONDS: int = 300
+    AI_ROUTING_MIN_SAMPLES: int = 20
+    AI_ROUTING_MAX_P95_MS: float = 10000
+    AI_ROUTING_MAX_ERROR_RATE: float = 0.2
+
+    # Fake provider behaviour (AI_PROVIDER="fake")
+    AI_FAKE_LATENCY_DISTRIBUTION: str = "lognormal"  # fixed|uniform|normal|lognormal
+    AI_FAKE_LATENCY_MS: float = 800
+    AI_FAKE_LATENCY_JITTER_MS: float = 300
+    AI_FAKE_LATENCY_MAX_MS: float = 30000
+    AI_FAKE_ERROR_RATE: float = 0.0
+    AI_FAKE_ERROR_KIND: str = "unavailable"  # unavailable|rate_limited|internal|timeout|invalid
+    AI_FAKE_OUTPUT_WORDS: int = 120
+    AI_FAKE_SEED: Optional[int] = None
+
+    # AI result cache settings
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_TTL_SECONDS: int = 86400
+    AI_CACHE_LOCAL_MAX_ENTRIES: int = 512
+
+    # Gemini context caching of long note texts shared across actions
+    AI_CONTEXT_CACHE_ENABLED: bool = False
+    AI_CONTEXT_CACHE_MIN_TOKENS: int = 4096  # Gemini's minimum cacheable size
+    AI_CONTEXT_CACHE_TTL_SECONDS: int = 600
+    AI_CONTEXT_CACHE_MAX_ENTRIES: int = 64
+    AI_CONTEXT_CACHE_FAILURE_TTL_SECONDS: int = 300  # Send inline, don't re-upload
+
+    # Local rule-based /format pass that can skip the model entirely
+    AI_FORMAT_FAST_PATH_ENABLED: bool = True
+
+    # Incremental format/cleanup: only changed paragraphs of long notes are resent
+    AI_INCREMENTAL_ENABLED: bool = True
+    AI_INCREMENTAL_MIN_TOKENS: int = 1000
+    AI_INCREMENTAL_CONTEXT_PARAGRAPHS: int = 1
+
+    # Patch mode: cleanup/polish of long notes return span edits, applied locally
+    AI_PATCH_MODE_ENABLED: bool = False
+    AI_PATCH_MIN_TOKENS: int = 800
+
+    # Batched task title transformation
+    AI_TASK_BATCH_ENABLED: bool = True
+    AI_TASK_BATCH_MAX_TOKENS: int = 2000
+
+    # Global Gemini concurrency limiter (shared by all workers through Redis)
+    AI_MAX_IN_FLIGHT: int = 16
+    AI_LIMITER_QUEUE_TIMEOUT_SECONDS: float = 30
+    AI_LIMITER_POLL_INTERVAL_MS: int = 50
+    AI_LIMITER_LEASE_SECONDS: int = 120
+    AI_LIMITER_STALE_WAITER_MS: int = 2000
+
+    # Map-reduce summarization of long notes (sizes in approximate tokens)
+    AI_SUMMARY_CHUNK_THRESHOLD_TOKENS: int = 6000
+    AI_SUMMARY_CHUNK_TOKENS: int = 3000
+    AI_SUMMARY_CHUNK_SUMMARY_WORDS: int = 120
+    AI_SUMMARY_MAP_CONCURRENCY: int = 4
+
+    # Single-flight coalescing of identical in-flight Gemini calls
+    AI_SINGLEFLIGHT_ENABLED: bool = True
+    AI_SINGLEFLIGHT_LOCK_MS: int = 60000
+    AI_SINGLEFLIGHT_RESULT_MS: int = 10000
+    AI_SINGLEFLIGHT_POLL_MS: int = 100
+
+    # Asynchronous AI jobs (run by `python -m app.worker`)
+    AI_JOB_TTL_SECONDS: int = 86400
+    AI_JOB_WORKER_CONCURRENCY: int = 4
+    AI_JOB_HEARTBEAT_SECONDS: int = 10  # A worker is dead after 3 missed beats
+    AI_JOB_MAX_ATTEMPTS: int = 3
+
+    # Idle-time precompute of summaries / task suggestions after note writes
+    AI_PRECOMPUTE_ENABLED: bool = False
+    AI_PRECOMPUTE_DEBOUNCE_SECONDS: float = 15
+    AI_PRECOMPUTE_CONCURRENCY: int = 2
+    AI_PRECOMPUTE_MAX_LOAD: float = 0.5  # Skip when the limiter is busier than this
+
+    # Local semantic search over notes (GET /notes/search/semantic)
+    SEMANTIC_SEARCH_DIM: int = 512
+    SEMANTIC_SEARCH_MAX_K: int = 50
+    SEMANTIC_SEARCH_MIN_SCORE: float = 0.05
+    SEMANTIC_SEARCH_CACHED_USERS: int = 256  # Stacked per-user matrices in memory
+
+    # Near-duplicate / related notes (MinHash + LSH, computed on note write)
+    NOTE_MINHASH_PERMUTATIONS: int = 64
+    NOTE_LSH_BANDS: int = 32  # 2 rows per band: candidates from ~0.2 similarity
+    NOTE_RELATED_MIN_SIMILARITY: float = 0.3
+    NOTE_DUPLICATE_MIN_SIMILARITY: float = 0.8
+
+    # Emailed digests of recently changed notes
+    AI_DIGEST_ENABLED: bool = False
+    AI_DIGEST_PERIOD_HOURS: int = 24  # 24 for daily, 168 for weekly digests
+    AI_DIGEST_CHECK_INTERVAL_SECONDS: int = 600
+    AI_DIGEST_USERS_PER_CALL: int = 8
+    AI_DIGEST_BATCH_MAX_TOKENS: int = 6000
+    AI_DIGEST_CONCURRENCY: int = 2
+    AI_DIGEST_MAX_NOTES_PER_USER: int = 20
+    AI_DIGEST_NOTE_EXCERPT_TOKENS: int = 150
+    AI_DIGEST_LOCK_SECONDS: int = 900  # Extended after every batch of users
+
+    # Bulk AI actions (POST /ai/bulk)
+    AI_BULK_MAX_NOTES: int = 100
+    AI_BULK_CONCURRENCY: int = 4
+
+    # Gemini retries, hedging and circuit breaker
+    AI_RETRY_MAX_ATTEMPTS: int = 3
+    AI_RETRY_BASE_DELAY_MS: int = 200
+    AI_RETRY_MAX_DELAY_MS: int = 2000
+    AI_HEDGE_ENABLED: bool = False
+    AI_HEDGE_PERCENTILE: float = 0.95
+    AI_HEDGE_MIN_SAMPLES: int = 20
+    AI_BREAKER_WINDOW_SECONDS: int = 60
+    AI_BREAKER_MIN_CALLS: int = 10
+    AI_BREAKER_ERROR_RATE: float = 0.5
+    AI_BREAKER_OPEN_SECONDS: int = 30
+
+    # Per-user AI usage ledger (buffered, written in batches)
+    AI_USAGE_LEDGER_ENABLED: bool = True
+    AI_USAGE_FLUSH_INTERVAL_SECONDS: float = 5
+    AI_USAGE_FLUSH_BATCH_SIZE: int = 500
+    AI_USAGE_BUFFER_MAX: int = 10000
 
 
 @lru_cache()  # Cache the settings object
@@ -6,6 +6,7 @@ from app.core import security
 from app.db import session
 from app.schemas import token
 from app.crud import v1
+from app.services.ai_limiter import current_ai_user_id
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
@@ -24,3 +25,9 @@ def get_current_user(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
     return user
+
+
+async def bind_ai_user(current_user=Depends(get_current_user)):
+    """Tags Gemini calls made while handling this request with the caller's id."""
+    current_ai_user_id.set(current_user.id)
+    return current_user
@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+_MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Transient refusals (timeout, conflict, too early, rate limited): a retry should run
+_RETRYABLE_STATUSES = {408, 409, 425, 429}
+_STORED_HEADERS = (b"content-type", b"location", b"retry-after")
+
+
+class IdempotencyMiddleware:
+    """
+    Makes mutating requests that carry an `Idempotency-Key` header safe to retry.
+
+    The first request with a key (per caller, i.e. per Authorization header)
+    runs normally and its status and body are stored in Redis for
+    IDEMPOTENCY_TTL_SECONDS. Retries with the same key get that stored response
+    back (marked with `Idempotent-Replayed: true`) without reaching the endpoint,
+    so no second Gemini call or DB write happens. A duplicate arriving while the
+    first one still runs waits for it, up to IDEMPOTENCY_WAIT_SECONDS.
+
+    Reusing a key for a different request is rejected with 422. Server errors
+    (5xx), transient refusals (408/409/425/429 or anything with Retry-After)
+    and streamed (SSE) responses are not stored, so those can be retried.
+    If Redis is unavailable requests run without idempotency.
+    """
+
+    def __init__(self, app, prefixes: Tuple[str, ...] = ("/api/v1/",)):
+        self.app = app
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in _MUTATING_METHODS
+            or not scope["path"].startswith(self.prefixes)
+        ):
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        body_sent = False
+
+        async def replay_receive():
+            # Hand the buffered body over once, then wait on the client as usual so
+            # a streaming response still sees http.disconnect
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        caller = hashlib.sha256(headers.get(b"authorization", b"")).hexdigest()[:32]
+        key = f"idem:{caller}:{idempotency_key.decode(errors='replace')}"
+        fingerprint = hashlib.sha256(
+            b"\n".join(
+                [
+                    scope["method"].encode(),
+                    scope["path"].encode(),
+                    scope["query_string"],
+                    body,
+                ]
+            )
+        ).hexdigest()
+
+        try:
+            stored = await self._claim_or_wait(key, fingerprint)
+        except Exception as e:
+            logger.warning(f"Idempotency store unavailable, running request: {e}")
+            return await self.app(scope, replay_receive, send)
+
+        if stored is not None:
+            if stored.get("fingerprint") != fingerprint:
+                return await self._send_error(
+                    send, 422, "Idempotency-Key was already used for another request."
+                )
+            if stored.get("state") != "done":
+                return await self._send_error(
+                    send, 409, "A request with this Idempotency-Key is still running."
+                )
+            return await self._replay(send, stored)
+
+        response = {"status": 500, "headers": [], "body": b"", "cacheable": True}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                    if name.lower() in _STORED_HEADERS
+                ]
+                start_headers = {
+                    name.lower(): value for name, value in message.get("headers", [])
+                }
+                content_type = start_headers.get(b"content-type", b"")
+                if (
+                    content_type.startswith(b"text/event-stream")
+                    or message["status"] in _RETRYABLE_STATUSES
+                    or b"retry-after" in start_headers
+                ):
+                    response["cacheable"] = False
+            elif message["type"] == "http.response.body" and response["cacheable"]:
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except Exception:
+            await self._forget(key)
+            raise
+        if response["status"] >= 500 or not response["cacheable"]:
+            await self._forget(key)
+            return
+        record = {
+            "state": "done",
+            "fingerprint": fingerprint,
+            "status": response["status"],
+            "headers": response["headers"],
+            "body": base64.b64encode(response["body"]).decode(),
+        }
+        try:
+            await asyncio.to_thread(
+                redis_client.redis_client.set,
+                key,
+                json.dumps(record),
+                ex=settings.IDEMPOTENCY_TTL_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store idempotent response: {e}")
+
+    async def _claim_or_wait(self, key: str, fingerprint: str) -> Optional[dict]:
+        """
+        Claims the key for this request (returns None), or returns the stored
+        record of an earlier request, waiting while that one is still running.
+        """
+        claim = json.dumps({"state": "running", "fingerprint": fingerprint})
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            claimed = await asyncio.to_thread(
+                redis_client.redis_client.set,
+                key,
+                claim,
+                nx=True,
+                ex=settings.IDEMPOTENCY_LOCK_SECONDS,
+            )
+            if claimed:
+                return None
+            raw = await asyncio.to_thread(redis_client.redis_client.get, key)
+            if raw is None:
+                continue  # The first request failed and released the key
+            stored = json.loads(raw)
+            if (
+                stored.get("state") == "done"
+                or stored.get("fingerprint") != fingerprint
+                or time.monotonic() >= deadline
+            ):
+                return stored
+            await asyncio.sleep(settings.IDEMPOTENCY_POLL_MS / 1000)
+
+    async def _forget(self, key: str) -> None:
+        try:
+            await asyncio.to_thread(redis_client.redis_client.delete, key)
+        except Exception as e:
+            logger.warning(f"Failed to release idempotency key: {e}")
+
+    async def _replay(self, send, stored: dict) -> None:
+        headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in stored["headers"]
+        ]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": stored["status"],
+                "headers": headers,
+            }
+        )
+        await send(
+            {"type": "http.response.body", "body": base64.b64decode(stored["body"])}
+        )
+
+    async def _send_error(self, send, status_code: int, detail: str) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import case, func, insert
+from sqlmodel import Session, select
+from app.models.ai_usage import AiUsage
+
+
+def create_usage_records(rows: List[dict], session: Session):
+    # One multi-row INSERT instead of an ORM object per call
+    session.execute(insert(AiUsage), rows)
+    session.commit()
+
+
+def get_usage_rollup(user_id: int, since: Optional[datetime], session: Session):
+    statement = select(
+        AiUsage.operation,
+        func.count(AiUsage.id).label("calls"),
+        func.sum(case((AiUsage.cache_status == "hit", 1), else_=0)).label("cache_hits"),
+        func.sum(case((AiUsage.cache_status == "coalesced", 1), else_=0)).label(
+            "coalesced"
+        ),
+        func.sum(case((AiUsage.success == False, 1), else_=0)).label("errors"),
+        func.coalesce(func.sum(AiUsage.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(AiUsage.output_tokens), 0).label("output_tokens"),
+        func.coalesce(func.avg(AiUsage.latency_ms), 0).label("avg_latency_ms"),
+    ).where(AiUsage.user_id == user_id)
+    if since is not None:
+        statement = statement.where(AiUsage.created_at >= since)
+    statement = statement.group_by(AiUsage.operation).order_by(AiUsage.operation)
+    return session.exec(statement).all()
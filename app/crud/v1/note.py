@@ -1,14 +1,58 @@
 from sqlmodel import Session, select
 from sqlalchemy.orm import selectinload
-from typing import Optional
-from sqlalchemy import desc, asc, or_, and_
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, desc, asc, or_, and_
 
 from app.models import (
     note as NoteModel,
     user as UserModel,
     task as TaskModel,
+    setting as SettingModel,
+    note_minhash as NoteMinHashModel,
 )
+from app.core.config import settings
 from app.schemas import note as NoteSchema, task as TaskSchema
+from app.services import note_minhash
+from app.services.semantic_index import semantic_index
+
+
+def _delete_minhash(note_id: int, session: Session):
+    session.execute(
+        delete(NoteMinHashModel.NoteLshBucket).where(
+            NoteMinHashModel.NoteLshBucket.note_id == note_id
+        )
+    )
+    session.execute(
+        delete(NoteMinHashModel.NoteMinHash).where(
+            NoteMinHashModel.NoteMinHash.note_id == note_id
+        )
+    )
+
+
+def _index_minhash(note: NoteModel.Note, session: Session):
+    """
+    Replaces the note's MinHash signature and LSH buckets; the caller commits.
+    A note without words gets an empty signature and no buckets, so it is
+    known to be indexed but never matches.
+    """
+    _delete_minhash(note.id, session)
+    signature = note_minhash.signature(note.title, note.content)
+    stored = b"" if signature is None else note_minhash.to_bytes(signature)
+    session.add(
+        NoteMinHashModel.NoteMinHash(
+            note_id=note.id, user_id=note.user_id, signature=stored
+        )
+    )
+    if signature is None:
+        return None
+    session.add_all(
+        NoteMinHashModel.NoteLshBucket(
+            note_id=note.id, user_id=note.user_id, bucket=bucket
+        )
+        for bucket in set(note_minhash.lsh_buckets(signature))
+    )
+    return signature
 
 
 def create_note(
@@ -17,8 +61,11 @@ def create_note(
     data = note_create.model_dump()
     new_note = NoteModel.Note(**data, user_id=user.id)
     session.add(new_note)
+    session.flush()  # Assigns the id the signature rows refer to
+    _index_minhash(new_note, session)
     session.commit()
     session.refresh(new_note)
+    semantic_index.upsert([new_note])
     return new_note
 
 
@@ -30,6 +77,14 @@ def get_note_by_id(note_id: int, user: UserModel.User, session: Session):
     return session.exec(statement).first()
 
 
+def get_notes_by_ids(note_ids: List[int], user: UserModel.User, session: Session):
+    statement = select(NoteModel.Note).where(
+        NoteModel.Note.id.in_(note_ids),
+        NoteModel.Note.user_id == user.id,
+    )
+    return session.exec(statement).all()
+
+
 def get_notes(
     user: UserModel.User,
     session: Session,
@@ -88,17 +143,180 @@ def update_note(
     for key, value in data.items():
         setattr(note, key, value)
     session.add(note)
+    text_changed = bool(data.keys() & {"title", "content"})
+    if text_changed:
+        _index_minhash(note, session)
     session.commit()
     session.refresh(note)
+    if text_changed:
+        semantic_index.upsert([note])
     return note
 
 
+def update_note_contents(
+    contents: Dict[int, str], user: UserModel.User, session: Session
+):
+    """Sets the content of several of the user's notes in a single commit."""
+    if not contents:
+        return []
+    notes = get_notes_by_ids(list(contents), user, session)
+    for note in notes:
+        note.content = contents[note.id]
+        session.add(note)
+        _index_minhash(note, session)
+    session.commit()
+    semantic_index.upsert(notes)
+    return notes
+
+
+def get_changed_notes_for_digest(
+    since: datetime, until: datetime, after_user_id: int, session: Session
+):
+    """
+    Notes changed in [since, until) of users with email notifications on, for user
+    ids above after_user_id, ordered by user. One range scan over the
+    (updated_at, user_id) index instead of a query per user.
+    """
+    statement = (
+        select(
+            NoteModel.Note.user_id,
+            UserModel.User.email,
+            UserModel.User.full_name,
+            NoteModel.Note.id,
+            NoteModel.Note.title,
+            NoteModel.Note.content,
+            NoteModel.Note.updated_at,
+        )
+        .join(UserModel.User, UserModel.User.id == NoteModel.Note.user_id)
+        .join(SettingModel.Setting, SettingModel.Setting.user_id == UserModel.User.id)
+        .where(
+            NoteModel.Note.updated_at >= since,
+            NoteModel.Note.updated_at < until,
+            NoteModel.Note.user_id > after_user_id,
+            SettingModel.Setting.email_notifications == True,
+        )
+        .order_by(asc(NoteModel.Note.user_id), desc(NoteModel.Note.updated_at))
+    )
+    return session.exec(statement).all()
+
+
+def search_notes_semantic(
+    query: str, k: int, user: UserModel.User, session: Session
+):
+    """Top-k notes by semantic similarity to the query, as (note, score) pairs."""
+    hits = semantic_index.search_notes(
+        user.id,
+        query,
+        k,
+        settings.SEMANTIC_SEARCH_MIN_SCORE,
+        load_notes=lambda: get_notes(user, session),
+    )
+    note_ids = [note_id for note_id, _ in hits]
+    notes = {note.id: note for note in get_notes_by_ids(note_ids, user, session)}
+    return [(notes[note_id], score) for note_id, score in hits if note_id in notes]
+
+
+def get_similar_notes(
+    note: NoteModel.Note, min_similarity: float, k: int, session: Session
+) -> List[Tuple[NoteModel.Note, float]]:
+    """
+    The user's other notes whose estimated Jaccard similarity to note is at
+    least min_similarity, best first. Only notes sharing an LSH bucket with it
+    are compared, so the cost follows the number of candidates, not of notes.
+    """
+    statement = select(NoteMinHashModel.NoteMinHash.signature).where(
+        NoteMinHashModel.NoteMinHash.note_id == note.id
+    )
+    stored = session.exec(statement).first()
+    if stored is not None:
+        if not stored:
+            return []  # No words to compare
+        signature = note_minhash.from_bytes([stored])[0]
+    else:
+        # Written before signatures existed
+        signature = _index_minhash(note, session)
+        session.commit()
+        if signature is None:
+            return []
+
+    bucket = NoteMinHashModel.NoteLshBucket
+    statement = (
+        select(bucket.note_id)
+        .where(
+            bucket.user_id == note.user_id,
+            bucket.bucket.in_(note_minhash.lsh_buckets(signature)),
+            bucket.note_id != note.id,
+        )
+        .distinct()
+    )
+    candidate_ids = session.exec(statement).all()
+    if not candidate_ids:
+        return []
+    statement = select(
+        NoteMinHashModel.NoteMinHash.note_id, NoteMinHashModel.NoteMinHash.signature
+    ).where(NoteMinHashModel.NoteMinHash.note_id.in_(candidate_ids))
+    rows = session.exec(statement).all()
+    scores = note_minhash.similarities(
+        signature, note_minhash.from_bytes([row.signature for row in rows])
+    )
+    ranked = sorted(
+        (
+            (row.note_id, round(float(score), 4))
+            for row, score in zip(rows, scores)
+            if score >= min_similarity
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:k]
+    if not ranked:
+        return []
+    statement = select(NoteModel.Note).where(
+        NoteModel.Note.id.in_([note_id for note_id, _ in ranked])
+    )
+    notes = {similar.id: similar for similar in session.exec(statement).all()}
+    return [(notes[note_id], score) for note_id, score in ranked if note_id in notes]
+
+
+def backfill_note_minhashes(session: Session, batch_size: int = 500):
+    """
+    Indexes notes written before MinHash signatures existed, batch_size notes
+    per query and commit, so a large table is never loaded at once.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        statement = (
+            select(NoteModel.Note)
+            .outerjoin(
+                NoteMinHashModel.NoteMinHash,
+                NoteMinHashModel.NoteMinHash.note_id == NoteModel.Note.id,
+            )
+            .where(
+                NoteMinHashModel.NoteMinHash.id == None,
+                NoteModel.Note.id > last_id,
+            )
+            .order_by(NoteModel.Note.id)
+            .limit(batch_size)
+        )
+        notes = session.exec(statement).all()
+        if not notes:
+            return indexed
+        for note in notes:
+            _index_minhash(note, session)
+        last_id = notes[-1].id
+        indexed += len(notes)
+        session.commit()
+        session.expunge_all()  # Keep memory flat across batches
+
+
 def delete_note(note_id: int, user: UserModel.User, session: Session):
     note = get_note_by_id(note_id, user, session)
     if not note:
         return False
+    _delete_minhash(note_id, session)
     session.delete(note)
     session.commit()
+    semantic_index.remove(user.id, note_id)
     return True
 
 
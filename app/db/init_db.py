@@ -75,9 +75,33 @@ def setup_pg_trgm_and_indexes(session: Session):
     else:
         print("✅ GIN index on note.content already exists.")
 
+    # 4. Check index on note (updated_at, user_id), used by the digest query
+    result = session.exec(
+        text(
+            """
+            SELECT 1 FROM pg_indexes 
+            WHERE tablename = 'note' AND indexname = 'ix_note_updated_at_user_id';
+            """
+        )
+    ).first()
+    if not result:
+        session.exec(
+            text(
+                """
+                CREATE INDEX ix_note_updated_at_user_id 
+                ON note (updated_at, user_id);
+                """
+            )
+        )
+        print("✅ Created index on note (updated_at, user_id)")
+    else:
+        print("✅ Index on note (updated_at, user_id) already exists.")
+
 
 def init_db():
-    from app.models import user, note, setting, task, scheduler
+    from app.models import user, note, setting, task, scheduler, ai_usage
+    from app.models import note_minhash
+    from app.crud.v1.note import backfill_note_minhashes
 
     SQLModel.metadata.create_all(engine)
 
@@ -85,3 +109,8 @@ def init_db():
     with Session(engine) as session:
         setup_pg_trgm_and_indexes(session)
         session.commit()
+
+        # MinHash signatures of notes written before related-notes detection
+        indexed = backfill_note_minhashes(session)
+        if indexed:
+            print(f"✅ Indexed {indexed} notes for related-notes detection")
@@ -11,6 +11,10 @@ from app.models.note import Note
 from app.models.user import User
 from sqlmodel import Session, select
 from app.api.v1.api import api_router
+from app.core.idempotency import IdempotencyMiddleware
+from app.services import ai_service
+from app.services.ai_usage import usage_ledger
+from app.services.digest_service import digest_pipeline
 
 async def scheduler_worker():
     while True:
@@ -40,15 +44,28 @@ async def scheduler_worker():
 async def lifespan(app: FastAPI):
     print("🚀 App is starting up...")
     init_db()
+    ai_service.warm_up_model_pool()
     # Start background scheduler worker
     loop = asyncio.get_event_loop()
     task = loop.create_task(scheduler_worker())
+    usage_task = loop.create_task(usage_ledger.run_flusher())
+    digest_task = loop.create_task(digest_pipeline.run_forever())
     yield
     task.cancel()
+    digest_task.cancel()  # An interrupted run resumes from its checkpoint
+    usage_task.cancel()
+    try:
+        await usage_task  # Writes the remaining usage records
+    except asyncio.CancelledError:
+        pass
     print("💥 App is shutting down...")
 
 app = FastAPI(lifespan=lifespan, title="AI Note-Taking App API")
 
+# Replays stored responses for retried requests carrying an Idempotency-Key
+# (added first so CORS still wraps the replayed responses)
+app.add_middleware(IdempotencyMiddleware)
+
 # Set all CORS enabled origins
 app.add_middleware(
     CORSMiddleware,
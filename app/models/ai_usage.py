@@ -0,0 +1,22 @@
+from app.models.base import BaseModel
+from sqlmodel import Field
+from sqlalchemy import Index
+from typing import Optional
+
+
+class AiUsageBase(BaseModel):
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    operation: str
+    model: str
+    cache_status: str  # miss | hit | coalesced
+    success: bool = True
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    latency_ms: float = 0.0
+
+
+class AiUsage(AiUsageBase, table=True):
+    # One row per AI call, written in batches by ai_usage.usage_ledger
+    __table_args__ = (
+        Index("ix_aiusage_user_id_created_at", "user_id", "created_at"),
+    )
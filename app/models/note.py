@@ -21,6 +21,9 @@ class NoteBase(BaseModel):
 
 
 class Note(NoteBase, table=True):
+    # The (updated_at, user_id) index for digests is created in init_db, since
+    # create_all does not add indexes to an existing table
+
     # Many notes belong to one user
     user_id: int = Field(foreign_key="user.id", nullable=False)
     user: Optional["User"] = Relationship(back_populates="notes")
@@ -0,0 +1,22 @@
+from app.models.base import BaseModel
+from sqlmodel import Field
+from sqlalchemy import Index
+
+
+class NoteMinHash(BaseModel, table=True):
+    # MinHash signature of a note's text (uint32 values), written with the note;
+    # empty for a note without words
+    note_id: int = Field(foreign_key="note.id", unique=True, nullable=False)
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    signature: bytes
+
+
+class NoteLshBucket(BaseModel, table=True):
+    # One row per LSH band of a note's signature; notes sharing a bucket are candidates
+    __table_args__ = (
+        Index("ix_notelshbucket_user_id_bucket", "user_id", "bucket"),
+    )
+
+    note_id: int = Field(foreign_key="note.id", nullable=False, index=True)
+    user_id: int = Field(foreign_key="user.id", nullable=False)
+    bucket: int
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Optional, Literal
+from datetime import datetime
+
+from app.schemas.note import NoteRead
+
+
+class AiJobRead(BaseModel):
+    id: str
+    action: str
+    note_id: int
+    status: Literal["queued", "running", "succeeded", "failed"]
+    error: Optional[str] = None
+    note: Optional[NoteRead] = None  # Set once the job has succeeded
+    created_at: datetime
+    updated_at: datetime
@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+from app.schemas.note import NoteRead
+
+PipelineOperation = Literal["cleanup", "format", "refine", "polish"]
+
+
+class AiPipelineRequest(BaseModel):
+    operations: List[PipelineOperation] = Field(..., min_length=1)
+    style: Optional[str] = None  # Used by a "refine" step
+
+
+class AiPipelineRead(BaseModel):
+    note: NoteRead
+    total_ms: float  # All steps run in one model call, so only the total is timed
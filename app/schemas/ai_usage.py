@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+
+class AiUsageTotals(BaseModel):
+    calls: int = 0
+    cache_hits: int = 0
+    coalesced: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    avg_latency_ms: float = 0.0
+
+
+class AiUsageOperation(AiUsageTotals):
+    operation: str
+
+
+class AiUsageRollup(BaseModel):
+    user_id: int
+    since: Optional[datetime] = None
+    totals: AiUsageTotals
+    by_operation: List[AiUsageOperation]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
 
 class Message(BaseModel):
@@ -14,3 +14,13 @@ class AiActionRequest(BaseModel):
     style: Optional[str] = None  # e.g., "professional", "casual" for /refine
     max_tokens: Optional[int] = None  # Approx word count for /continue
     max_length: Optional[int] = None  # Approx word count for /summarize
+
+
+class AiBulkRequest(BaseModel):
+    """
+    Request body for POST /ai/bulk: one action applied to many notes.
+    """
+
+    note_ids: List[int] = Field(..., min_length=1)
+    action: Literal["format", "cleanup", "refine", "polish", "continue", "summarize"]
+    options: AiActionRequest = AiActionRequest()
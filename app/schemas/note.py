@@ -25,6 +25,21 @@ class NoteRead(NoteBase, BaseSchema):
     tasks: Optional[List[TaskRead]] = None
 
 
+class NoteCreated(NoteRead):
+    # Ids of existing notes that look like near-duplicates of the new one
+    possible_duplicates: List[int] = []
+
+
+class NoteSearchResult(BaseModel):
+    note: NoteRead
+    score: float
+
+
+class RelatedNote(BaseModel):
+    note: NoteRead
+    similarity: float  # Estimated Jaccard similarity of the notes' texts
+
+
 class NoteUpdate(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
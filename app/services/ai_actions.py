@@ -0,0 +1,569 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.crud import v1
+from app.models import user as UserModel, note as NoteModel, task as TaskModel
+from app.schemas import (
+    note as NoteSchema,
+    task as TaskSchema,
+    common as CommonSchema,
+    ai_pipeline as AiPipelineSchema,
+)
+from app.services import ai_service
+
+logger = logging.getLogger(__name__)
+
+
+# --- Helper Functions ---
+async def _generate_and_create_tasks(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+) -> bool:
+    """Generates tasks via AI and saves them. Returns True if tasks were created."""
+    logger.info(
+        f"Note {note.id} is task-based but has no tasks. Attempting generation."
+    )
+    language_hint = None  # Add language detection if possible
+    generated_titles = await ai_service.generate_tasks_from_title(
+        note.title, language_hint
+    )
+
+    if not generated_titles:
+        logger.warning(
+            f"AI did not generate any tasks for note {note.id} (Title: {note.title})."
+        )
+        return False
+
+    logger.info(f"Generated {len(generated_titles)} task titles for note {note.id}.")
+    try:
+        created_count = 0
+        for task_title in generated_titles:
+            if task_title:
+                task_create_data = TaskSchema.TaskCreate(title=task_title)
+                # Assuming create_task handles adding task to note and commits/adds to session
+                created_task = v1.note.create_task(
+                    note.id, task_create_data, current_user, session
+                )
+                if created_task:
+                    created_count += 1
+                else:
+                    logger.error(
+                        f"Failed to create task '{task_title}' for note {note.id}"
+                    )
+        logger.info(f"Successfully created {created_count} tasks for note {note.id}.")
+        # Ensure changes are flushed to session before refresh if create_task doesn't commit
+        session.flush()
+        return created_count > 0
+    except Exception as e:
+        logger.error(
+            f"Error saving generated tasks for note {note.id}: {e}", exc_info=True
+        )
+        raise HTTPException(status_code=500, detail="Failed to save generated tasks.")
+
+
+async def _apply_ai_to_existing_tasks(
+    operation: str,
+    note: NoteModel.Note,
+    session: Session,
+    is_sub_task_structure: bool = False,
+    **kwargs,  # Pass extra args like style
+):
+    """
+    Applies an AI operation ('cleanup', 'refine', 'polish') to the titles of
+    existing tasks/subtasks, batched into as few Gemini calls as possible.
+    """
+    tasks_to_process = []
+    # Ensure tasks are loaded before processing
+    if not hasattr(note, "tasks") or note.tasks is None:
+        logger.debug(
+            f"Explicitly refreshing tasks for note {note.id} before AI application."
+        )
+        session.refresh(note, attribute_names=["tasks"])
+
+    if is_sub_task_structure:
+        # Also ensure sub-tasks are loaded if needed (might require deeper refresh or careful loading)
+        for parent_task in note.tasks:
+            # Explicitly refresh sub-tasks for the parent task if necessary
+            if not hasattr(parent_task, "tasks") or parent_task.tasks is None:
+                logger.debug(
+                    f"Explicitly refreshing sub-tasks for parent task {parent_task.id}."
+                )
+                session.refresh(parent_task, attribute_names=["tasks"])
+            if parent_task.tasks:
+                tasks_to_process.extend(
+                    [(sub_task, parent_task.title) for sub_task in parent_task.tasks]
+                )
+    else:
+        # Ensure tasks relationship is loaded for the note
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+        if note.tasks:  # Check if tasks exist after refresh
+            tasks_to_process.extend([(task, note.title) for task in note.tasks])
+
+    if not tasks_to_process:
+        logger.info(f"No existing tasks found to apply AI for note {note.id}.")
+        return  # Nothing to do
+
+    logger.info(
+        f"Applying AI operation '{operation}' to {len(tasks_to_process)} tasks/subtasks for note {note.id}."
+    )
+
+    if settings.AI_TASK_BATCH_ENABLED:
+        new_titles = await ai_service.transform_task_titles(
+            operation,
+            [(task.id, task.title, context) for task, context in tasks_to_process],
+            **kwargs,
+        )
+        for task, _ in tasks_to_process:
+            modified_title = new_titles.get(task.id)
+            if modified_title and modified_title != task.title:
+                task_update_data = TaskSchema.TaskUpdate(title=modified_title)
+                if not v1.note.update_task(task.id, task_update_data, session):
+                    logger.warning(
+                        f"CRUD function failed to update task {task.id} after AI processing."
+                    )
+        session.flush()
+        return
+
+    ai_function = ai_service.TASK_TITLE_FUNCTIONS[operation]
+    update_coroutines = []
+    for task, context_title in tasks_to_process:
+
+        async def update_single_task(task_to_update: TaskModel.Task, context: str):
+            try:
+                # Pass kwargs (like style) to the AI function
+                modified_title = await ai_function(
+                    task_to_update.title, context, **kwargs
+                )
+                if modified_title != task_to_update.title:
+                    task_update_data = TaskSchema.TaskUpdate(title=modified_title)
+                    # Assuming update_task handles session/commit logic correctly
+                    updated = v1.note.update_task(
+                        task_to_update.id, task_update_data, session
+                    )
+                    if not updated:
+                        logger.warning(
+                            f"CRUD function failed to update task {task_to_update.id} after AI processing."
+                        )
+            except Exception as e:
+                logger.error(
+                    f"Error applying AI or updating task {task_to_update.id}: {e}",
+                    exc_info=True,
+                )
+
+        update_coroutines.append(update_single_task(task, context_title))
+
+    results = await asyncio.gather(*update_coroutines, return_exceptions=True)
+    # Log any exceptions gathered
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            task_id = tasks_to_process[i][0].id  # Safely get task id
+            logger.error(f"Exception processing task {task_id} during gather: {result}")
+    # Ensure changes within the loop are flushed before the final note refresh
+    session.flush()
+
+
+def _write_content(
+    note: NoteModel.Note,
+    new_content: str,
+    current_user: UserModel.User,
+    session: Session,
+) -> bool:
+    """
+    Saves AI-generated content, skipping the write when the stored content already
+    equals it (a coalesced duplicate request got there first).
+    """
+    session.refresh(note, attribute_names=["content"])
+    if note.content == new_content:
+        logger.info(f"Note {note.id} already has this AI result; skipping update.")
+        return False
+    note_update_data = NoteSchema.NoteUpdate(content=new_content)
+    v1.note.update_note(note.id, note_update_data, current_user, session)
+    return True
+
+
+# --- Note Actions ---
+# Each action mutates the note (or its tasks) through the CRUD layer; callers
+# refresh the note afterwards.
+
+
+async def format_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Reformats the content of content notes; task notes are left untouched."""
+    if note.type in [1, 4]:  # Content-based note
+        if note.content is not None:  # Check if content exists
+            modified_content = await ai_service.format_content(
+                note.content, note.title, use_cache=use_cache
+            )
+            if modified_content != note.content:
+                _write_content(note, modified_content, current_user, session)
+                session.flush()  # Ensure change is flushed before refresh
+        else:
+            logger.info(f"Note {note.id} has no content to format.")
+    else:  # Task-based note
+        logger.info(
+            f"Format requested for task-based note {note.id}. No action taken on tasks for 'format'."
+        )
+
+
+async def cleanup_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Cleans up note content, or the note's tasks (generating them if none exist)."""
+    if note.type in [1, 4]:  # Content-based
+        if note.content is not None:
+            modified_content = await ai_service.cleanup_content(
+                note.content, note.title, use_cache=use_cache
+            )
+            if modified_content != note.content:
+                _write_content(note, modified_content, current_user, session)
+                session.flush()
+        else:
+            logger.info(f"Note {note.id} has no content to clean up.")
+    else:  # Task-based
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+        tasks_exist = bool(note.tasks)
+        if not tasks_exist:
+            await _generate_and_create_tasks(note, current_user, session)
+        else:
+            is_sub_task = note.type == 3
+            await _apply_ai_to_existing_tasks(
+                "cleanup",
+                note,
+                session,
+                is_sub_task,
+                use_cache=use_cache,
+            )
+
+
+async def refine_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Refines note content or task titles, optionally towards options.style."""
+    if note.type in [1, 4]:
+        if note.content is not None:
+            modified_content = await ai_service.refine_content(
+                note.content,
+                note.title,
+                style=options.style,
+                use_cache=use_cache,
+            )
+            if modified_content != note.content:
+                _write_content(note, modified_content, current_user, session)
+                session.flush()
+        else:
+            logger.info(f"Note {note.id} has no content to refine.")
+    else:
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+        tasks_exist = bool(note.tasks)
+        if not tasks_exist:
+            await _generate_and_create_tasks(note, current_user, session)
+        else:
+            is_sub_task = note.type == 3
+            await _apply_ai_to_existing_tasks(
+                "refine",
+                note,
+                session,
+                is_sub_task,
+                style=options.style,
+                use_cache=use_cache,
+            )
+
+
+async def polish_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Polishes note content or task titles."""
+    if note.type in [1, 4]:
+        if note.content is not None:
+            modified_content = await ai_service.polish_content(
+                note.content, note.title, use_cache=use_cache
+            )
+            if modified_content != note.content:
+                _write_content(note, modified_content, current_user, session)
+                session.flush()
+        else:
+            logger.info(f"Note {note.id} has no content to polish.")
+    else:
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+        tasks_exist = bool(note.tasks)
+        if not tasks_exist:
+            await _generate_and_create_tasks(note, current_user, session)
+        else:
+            is_sub_task = note.type == 3
+            await _apply_ai_to_existing_tasks(
+                "polish",
+                note,
+                session,
+                is_sub_task,
+                use_cache=use_cache,
+            )
+
+
+async def continue_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Appends a continuation to content notes, or generates more tasks."""
+    if note.type in [1, 4]:  # Content-based
+        # --- Handle None or empty content ---
+        # Pass note.content directly (which might be None) to the service function
+        # The service function is now designed to handle None/empty content
+        generated_text = await ai_service.continue_writing(
+            note.content, note.title  # Pass potentially None content
+        )
+
+        if generated_text:  # Only proceed if AI generated something
+            original_content = (
+                note.content if note.content else ""
+            )  # Treat None as empty string for appending
+            # Determine separator: Add if original content existed, otherwise no separator needed.
+            separator = "\n\n" if original_content else ""
+            new_content = original_content + separator + generated_text
+
+            # Update the note
+            _write_content(note, new_content, current_user, session)
+            session.flush()
+            logger.info(
+                f"Successfully updated content for note {note.id} via continue writing."
+            )
+        else:
+            logger.info(
+                f"AI did not generate text for continue writing on note {note.id}."
+            )
+
+    else:  # Task-based: Generate *more* tasks (Logic remains the same)
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+        existing_task_titles = [task.title for task in note.tasks if task.title]
+        language_hint = None
+        logger.info(
+            f"Continue writing requested for task note {note.id}. Generating more tasks."
+        )
+        new_task_titles = await ai_service.generate_more_tasks(
+            note.title, existing_task_titles, language_hint
+        )
+
+        if new_task_titles:
+            logger.info(
+                f"Generated {len(new_task_titles)} additional tasks for note {note.id}."
+            )
+            created_count = 0
+            for task_title in new_task_titles:
+                if task_title:
+                    task_create_data = TaskSchema.TaskCreate(title=task_title)
+                    created = v1.note.create_task(
+                        note.id, task_create_data, current_user, session
+                    )
+                    if created:
+                        created_count += 1
+            logger.info(f"Successfully added {created_count} tasks for note {note.id}.")
+            session.flush()
+        else:
+            logger.info(f"AI did not generate any additional tasks for note {note.id}.")
+
+
+async def summarize_note(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Replaces content with its summary, or adds a summary task to task notes."""
+    if note.type in [1, 4]:  # Content-based: REPLACE content with summary
+        if (
+            note.content and note.content.strip()
+        ):  # Check if content exists and is not just whitespace
+            logger.info(f"Generating summary to replace content for note {note.id}.")
+            generated_summary = await ai_service.summarize_content(
+                note.content,
+                note.title,
+                max_length=options.max_length,
+                use_cache=use_cache,
+            )
+
+            if generated_summary:
+                # --- REPLACE content ---
+                _write_content(note, generated_summary, current_user, session)
+                session.flush()  # Flush update
+                logger.info(f"Replaced content with summary for note {note.id}.")
+                # --- End of REPLACE content ---
+            else:
+                logger.warning(
+                    f"AI did not generate a summary for note {note.id}. Content not replaced."
+                )
+        else:
+            logger.info("Note has no content to summarize or replace.")
+
+    else:  # Task-based: Create a new task with the summary as its title (Logic remains the same)
+        logger.info(f"Generating summary task for task-based note {note.id}.")
+        if not hasattr(note, "tasks") or note.tasks is None:
+            session.refresh(note, attribute_names=["tasks"])
+
+        task_titles = []
+        is_sub_task = note.type == 3
+        if is_sub_task:
+            for parent_task in note.tasks:
+                if not hasattr(parent_task, "tasks") or parent_task.tasks is None:
+                    session.refresh(parent_task, attribute_names=["tasks"])
+                if parent_task.tasks:
+                    task_titles.extend(
+                        [
+                            f"{parent_task.title}: {sub.title}"
+                            for sub in parent_task.tasks
+                            if sub.title
+                        ]
+                    )
+        else:
+            task_titles = [task.title for task in note.tasks if task.title]
+
+        if task_titles:
+            summary_task_title = await ai_service.summarize_task_list(
+                task_titles, note.title
+            )
+            if summary_task_title and not summary_task_title.lower().startswith(
+                "summary: no tasks"
+            ):
+                task_create_data = TaskSchema.TaskCreate(
+                    title=summary_task_title,
+                    is_finished=True,  # Optional: mark as finished
+                )
+                created = v1.note.create_task(
+                    note.id, task_create_data, current_user, session
+                )
+                if created:
+                    logger.info(
+                        f"Created summary task for note {note.id} with title: '{summary_task_title}'"
+                    )
+                    session.flush()
+                else:
+                    logger.error(f"Failed to create summary task for note {note.id}")
+            else:
+                logger.info(
+                    f"AI did not generate a valid summary task title for note {note.id}."
+                )
+        else:
+            logger.info("Note has no tasks to summarize into a new task.")
+
+
+NoteAction = Callable[..., Awaitable[None]]
+
+ACTIONS: Dict[str, NoteAction] = {
+    "format": format_note,
+    "cleanup": cleanup_note,
+    "refine": refine_note,
+    "polish": polish_note,
+    "continue": continue_note,
+    "summarize": summarize_note,
+}
+
+
+async def run_note_action(
+    action: str,
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> None:
+    """Runs one of ACTIONS against a note loaded in `session`."""
+    await ACTIONS[action](note, current_user, session, options, use_cache=use_cache)
+
+
+async def run_pipeline(
+    note: NoteModel.Note,
+    current_user: UserModel.User,
+    session: Session,
+    request: AiPipelineSchema.AiPipelineRequest,
+    use_cache: bool = True,
+) -> None:
+    """
+    Runs an ordered list of content operations on a content note in one model
+    call and writes the note once.
+    """
+    modified_content = await ai_service.run_pipeline(
+        note.content,
+        request.operations,
+        note.title,
+        style=request.style,
+        use_cache=use_cache,
+    )
+    if modified_content != note.content:
+        _write_content(note, modified_content, current_user, session)
+        session.flush()
+
+
+async def generate_note_content(
+    action: str,
+    note: NoteModel.Note,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> Optional[str]:
+    """
+    Computes the new content an action would give a content note, without
+    touching the database, so callers can save many results in one commit.
+
+    Returns None when the action has nothing to do (no content, empty result).
+    """
+    content = note.content
+    if action == "continue":
+        generated_text = await ai_service.continue_writing(content, note.title)
+        if not generated_text:
+            return None
+        return f"{content}\n\n{generated_text}" if content else generated_text
+
+    if action == "summarize":
+        if not (content and content.strip()):
+            return None
+        return (
+            await ai_service.summarize_content(
+                content, note.title, max_length=options.max_length, use_cache=use_cache
+            )
+            or None
+        )
+
+    if content is None:
+        return None
+    if action == "format":
+        return await ai_service.format_content(content, note.title, use_cache=use_cache)
+    if action == "cleanup":
+        return await ai_service.cleanup_content(
+            content, note.title, use_cache=use_cache
+        )
+    if action == "refine":
+        return await ai_service.refine_content(
+            content, note.title, style=options.style, use_cache=use_cache
+        )
+    if action == "polish":
+        return await ai_service.polish_content(content, note.title, use_cache=use_cache)
+    raise ValueError(f"Unknown AI action '{action}'")
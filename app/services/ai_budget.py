@@ -0,0 +1,122 @@
+import dataclasses
+import logging
+import re
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from google.generativeai.types import GenerationConfig
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Words and single punctuation marks, the units a BPE tokenizer rarely merges across
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Fixed output caps for operations whose output does not grow with the input
+_FIXED_OUTPUT_TOKENS = {
+    "tasks": 512,
+    "tasks_summary": 128,
+}
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Fast local token estimate. Short ASCII words are one token and longer ones
+    about one per six characters; other scripts split about every three
+    characters. Close enough to Gemini's counts for budgeting without an API call.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group(0)
+        per_token = 6 if piece.isascii() else 3
+        tokens += 1 + (len(piece) - 1) // per_token
+    return tokens
+
+
+def _rewrite_tokens(input_tokens: int) -> int:
+    """Output tokens to allow for rewriting an input of input_tokens."""
+    return int(input_tokens * settings.AI_OUTPUT_TOKEN_RATIO) + 64
+
+
+def rewrite_input_limit() -> int:
+    """
+    Largest input whose full rewrite fits in AI_MAX_OUTPUT_TOKENS. Longer notes
+    are rewritten in sections, since a cut-off answer would replace the note.
+    """
+    return int((settings.AI_MAX_OUTPUT_TOKENS - 64) / settings.AI_OUTPUT_TOKEN_RATIO)
+
+
+def _bucket(tokens: int) -> int:
+    """Rounds a cap up to a power of two, so pooled models are shared across calls."""
+    bucket = 256
+    while bucket < tokens:
+        bucket *= 2
+    return min(bucket, settings.AI_MAX_OUTPUT_TOKENS)
+
+
+def output_cap(operation: str, input_tokens: int) -> int:
+    """Output token cap for an operation, derived from its input size."""
+    if operation in _FIXED_OUTPUT_TOKENS:
+        return _FIXED_OUTPUT_TOKENS[operation]
+    if operation == "continue":
+        return settings.AI_CONTINUE_MAX_OUTPUT_TOKENS
+    # Rewrites (format, cleanup, polish, patches, ...) scale with their input
+    return _bucket(_rewrite_tokens(input_tokens))
+
+
+def budget_request(
+    operation: str,
+    input_tokens: int,
+    generation_config: Optional[GenerationConfig],
+) -> GenerationConfig:
+    """
+    Checks a request of input_tokens (prompt plus any cached context, see
+    count_tokens) against the input budget and fills in max_output_tokens when
+    the caller did not set one.
+
+    Raises:
+        HTTPException: 413 if the input exceeds AI_MAX_INPUT_TOKENS, so the call
+            is not sent only to fail (or crawl) upstream.
+    """
+    if input_tokens > settings.AI_MAX_INPUT_TOKENS:
+        logger.warning(
+            f"Rejecting '{operation}' request of ~{input_tokens} input tokens"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail="The note is too long for this AI action.",
+        )
+    if generation_config is None:
+        generation_config = GenerationConfig()
+    if generation_config.max_output_tokens:
+        return generation_config
+    return dataclasses.replace(
+        generation_config, max_output_tokens=output_cap(operation, input_tokens)
+    )
+
+
+def window_tail(content: str, max_tokens: int) -> str:
+    """
+    Deterministically keeps the last paragraphs of content that fit in
+    max_tokens (cutting the oldest one on a word boundary if a single paragraph
+    is too long). Used where only the end of a note matters, e.g. continuing it.
+    """
+    if count_tokens(content) <= max_tokens:
+        return content
+    kept: List[str] = []
+    used = 0
+    for paragraph in reversed(re.split(r"\n\s*\n", content)):
+        paragraph_tokens = count_tokens(paragraph)
+        if used + paragraph_tokens > max_tokens:
+            if not kept:
+                words = paragraph.split(" ")
+                while words and count_tokens(" ".join(words)) > max_tokens:
+                    words = words[len(words) // 10 or 1 :]
+                kept.append(" ".join(words))
+            break
+        kept.append(paragraph)
+        used += paragraph_tokens
+    return "\n\n".join(reversed(kept))
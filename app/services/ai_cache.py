@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a prompt template in ai_service changes so stale results are ignored
+PROMPT_TEMPLATE_VERSION = "2"
+
+
+def content_hash(text: Optional[str]) -> str:
+    """Stable sha256 hex digest of a (possibly empty) text."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class AiResultCache:
+    """
+    Two-tier cache for AI transform results.
+
+    Tier 1 is a per-process LRU with TTL, tier 2 is the shared Redis instance.
+    Keys are content addressed: they hash the operation, prompt template version,
+    model and generation parameters together with the input text.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, prefix: str = "ai:result:"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self._local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def make_key(self, operation: str, **params: Any) -> str:
+        payload = json.dumps(
+            {"op": operation, "v": PROMPT_TEMPLATE_VERSION, **params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return self.prefix + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_local(self, key: str) -> Optional[str]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: str) -> None:
+        self._local[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        try:
+            record = await asyncio.to_thread(redis_client.get, key)
+        except Exception as e:
+            logger.warning(f"AI cache Redis read failed: {e}")
+            record = None
+        if isinstance(record, dict) and isinstance(record.get("text"), str):
+            self.redis_hits += 1
+            self._set_local(key, record["text"])
+            return record["text"]
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        self._set_local(key, value)
+        try:
+            # Wrapped in a dict so RedisClient.get never json-decodes the text itself
+            await asyncio.to_thread(
+                redis_client.set, key, {"text": value}, self.ttl_seconds
+            )
+        except Exception as e:
+            logger.warning(f"AI cache Redis write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "enabled": settings.AI_CACHE_ENABLED,
+            "local_size": len(self._local),
+            "local_max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_ratio": (
+                round((lookups - self.misses) / lookups, 4) if lookups else 0.0
+            ),
+        }
+
+
+class ProcessedParagraphIndex:
+    """
+    Remembers which paragraphs are already the output of an AI transform.
+
+    Only content hashes are stored (per operation and model, with a TTL), so an
+    unchanged paragraph of a previously formatted note is recognised on the next
+    run without keeping the note itself. Lookups and writes are one pipelined
+    Redis round trip per note.
+    """
+
+    def __init__(self, ttl_seconds: int, prefix: str = "ai:para:"):
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.known_paragraphs = 0
+        self.changed_paragraphs = 0
+
+    def _key(self, operation: str, model: str, paragraph: str) -> str:
+        digest = content_hash(f"{PROMPT_TEMPLATE_VERSION}\n{model}\n{paragraph}")
+        return f"{self.prefix}{operation}:{digest}"
+
+    def _mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        return redis_client.redis_client.mget(keys)
+
+    def _mset(self, keys: List[str]) -> None:
+        pipe = redis_client.redis_client.pipeline()
+        for key in keys:
+            pipe.set(key, 1, ex=self.ttl_seconds)
+        pipe.execute()
+
+    async def known(
+        self, operation: str, model: str, paragraphs: List[str]
+    ) -> List[bool]:
+        """Flags, per paragraph, whether it is a remembered AI output."""
+        if not paragraphs:
+            return []
+        keys = [self._key(operation, model, p) for p in paragraphs]
+        try:
+            values = await asyncio.to_thread(self._mget, keys)
+        except Exception as e:
+            logger.warning(f"Paragraph index Redis read failed: {e}")
+            values = [None] * len(keys)
+        flags = [value is not None for value in values]
+        self.known_paragraphs += sum(flags)
+        self.changed_paragraphs += len(flags) - sum(flags)
+        return flags
+
+    async def remember(self, operation: str, model: str, paragraphs: List[str]) -> None:
+        if not paragraphs:
+            return
+        keys = [self._key(operation, model, p) for p in paragraphs]
+        try:
+            await asyncio.to_thread(self._mset, keys)
+        except Exception as e:
+            logger.warning(f"Paragraph index Redis write failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "known_paragraphs": self.known_paragraphs,
+            "changed_paragraphs": self.changed_paragraphs,
+        }
+
+
+# Create a singleton instance
+result_cache = AiResultCache(
+    max_entries=settings.AI_CACHE_LOCAL_MAX_ENTRIES,
+    ttl_seconds=settings.AI_CACHE_TTL_SECONDS,
+)
+
+paragraph_index = ProcessedParagraphIndex(ttl_seconds=settings.AI_CACHE_TTL_SECONDS)
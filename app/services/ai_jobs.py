@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.crud import v1
+from app.db import session
+from app.schemas import common as CommonSchema, note as NoteSchema
+from app.services import ai_actions
+from app.services.ai_limiter import current_ai_user_id
+from app.services.ai_usage import usage_ledger
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_KEY = "ai:jobs:queue"
+# Workers move each job id into their own processing list while it runs, so a
+# crashed worker's jobs can be put back on the queue (see _recover_orphaned_jobs)
+WORKERS_KEY = "ai:jobs:workers"
+
+
+def _processing_key(worker_id: str) -> str:
+    return f"ai:jobs:processing:{worker_id}"
+
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"ai:jobs:worker:{worker_id}"
+
+
+def _job_key(job_id: str) -> str:
+    return f"ai:job:{job_id}"
+
+
+def _save_job(job: dict) -> None:
+    job["updated_at"] = datetime.now(timezone.utc).isoformat()
+    redis_client.set(
+        _job_key(job["id"]), job, expire_seconds=settings.AI_JOB_TTL_SECONDS
+    )
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    job = redis_client.get(_job_key(job_id))
+    return job if isinstance(job, dict) else None
+
+
+async def enqueue_job(
+    action: str,
+    note_id: int,
+    user_id: int,
+    options: CommonSchema.AiActionRequest,
+    use_cache: bool = True,
+) -> dict:
+    """Stores a queued job record and pushes its id onto the shared job queue."""
+    job = {
+        "id": uuid.uuid4().hex,
+        "action": action,
+        "note_id": note_id,
+        "user_id": user_id,
+        "options": options.model_dump(),
+        "use_cache": use_cache,
+        "status": "queued",
+        "error": None,
+        "note": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await asyncio.to_thread(_save_job, job)
+    await asyncio.to_thread(redis_client.redis_client.lpush, JOB_QUEUE_KEY, job["id"])
+    logger.info(f"Queued AI job {job['id']} ({action}) for note {note_id}")
+    return job
+
+
+async def run_job(job_id: str) -> None:
+    """Executes one queued job with the same action code as the HTTP endpoints."""
+    job = await asyncio.to_thread(get_job, job_id)
+    if job is None:
+        logger.warning(f"AI job {job_id} expired before it could run")
+        return
+    if job["status"] in ("succeeded", "failed"):
+        return  # Finished, but its worker died before acknowledging it
+    job["attempts"] = job.get("attempts", 0) + 1
+    if job["attempts"] > settings.AI_JOB_MAX_ATTEMPTS:
+        logger.error(f"AI job {job_id} abandoned after {job['attempts'] - 1} attempts")
+        job["status"], job["error"] = (
+            "failed",
+            f"Failed to process {job['action']} request.",
+        )
+        await asyncio.to_thread(_save_job, job)
+        return
+    job["status"] = "running"
+    await asyncio.to_thread(_save_job, job)
+
+    try:
+        with next(session.get_session()) as db:
+            user = v1.user.get_user_by_id(job["user_id"], db)
+            note = v1.note.get_note_by_id(job["note_id"], user, db) if user else None
+            if not note:
+                raise HTTPException(status_code=404, detail="Note not found")
+            current_ai_user_id.set(user.id)
+            await ai_actions.run_note_action(
+                job["action"],
+                note,
+                user,
+                db,
+                CommonSchema.AiActionRequest(**job["options"]),
+                use_cache=job["use_cache"],
+            )
+            db.refresh(note)
+            note_read = NoteSchema.NoteRead.model_validate(note, from_attributes=True)
+            job["note"] = note_read.model_dump(mode="json")
+            job["status"] = "succeeded"
+    except HTTPException as e:
+        job["status"], job["error"] = "failed", str(e.detail)
+    except Exception as e:
+        logger.error(f"AI job {job_id} failed: {e}", exc_info=True)
+        job["status"], job["error"] = (
+            "failed",
+            f"Failed to process {job['action']} request.",
+        )
+    await asyncio.to_thread(_save_job, job)
+
+
+def _heartbeat(worker_id: str) -> None:
+    pipe = redis_client.redis_client.pipeline()
+    pipe.sadd(WORKERS_KEY, worker_id)
+    pipe.set(_heartbeat_key(worker_id), 1, ex=settings.AI_JOB_HEARTBEAT_SECONDS * 3)
+    pipe.execute()
+
+
+def _requeue(worker_id: str) -> int:
+    """
+    Moves a worker's unfinished jobs back to the consuming end of the queue,
+    newest first, so they run again before newer jobs and in their old order.
+    """
+    moved = 0
+    while redis_client.redis_client.lmove(
+        _processing_key(worker_id), JOB_QUEUE_KEY, "LEFT", "RIGHT"
+    ):
+        moved += 1
+    return moved
+
+
+def _recover_orphaned_jobs() -> int:
+    """Requeues the jobs of workers whose heartbeat expired (crashed or killed)."""
+    recovered = 0
+    for member in redis_client.redis_client.smembers(WORKERS_KEY):
+        worker_id = member.decode()
+        if redis_client.redis_client.exists(_heartbeat_key(worker_id)):
+            continue
+        moved = _requeue(worker_id)
+        redis_client.redis_client.srem(WORKERS_KEY, worker_id)
+        if moved:
+            logger.warning(f"Requeued {moved} AI jobs of dead worker {worker_id}")
+        recovered += moved
+    return recovered
+
+
+def _acknowledge(worker_id: str, job_id: str) -> None:
+    redis_client.redis_client.lrem(_processing_key(worker_id), 1, job_id)
+
+
+def _shut_down(worker_id: str) -> None:
+    _requeue(worker_id)
+    pipe = redis_client.redis_client.pipeline()
+    pipe.srem(WORKERS_KEY, worker_id)
+    pipe.delete(_heartbeat_key(worker_id))
+    pipe.execute()
+
+
+async def _keep_alive(worker_id: str) -> None:
+    """Refreshes this worker's heartbeat and sweeps up jobs of dead workers."""
+    while True:
+        try:
+            await asyncio.to_thread(_heartbeat, worker_id)
+            await asyncio.to_thread(_recover_orphaned_jobs)
+        except Exception as e:
+            logger.error(f"AI job worker heartbeat failed: {e}")
+        await asyncio.sleep(settings.AI_JOB_HEARTBEAT_SECONDS)
+
+
+async def _run_and_acknowledge(worker_id: str, job_id: str) -> None:
+    await run_job(job_id)
+    try:
+        await asyncio.to_thread(_acknowledge, worker_id, job_id)
+    except Exception as e:
+        # Left in the processing list; a rerun sees the finished status and skips
+        logger.error(f"Failed to acknowledge AI job {job_id}: {e}")
+
+
+async def run_worker(concurrency: int) -> None:
+    """
+    Moves job ids from the Redis queue into this worker's processing list
+    (BLMOVE) and runs up to `concurrency` of them at a time; a job id leaves
+    the processing list only once the job has finished.
+
+    Each worker refreshes a heartbeat key. Jobs in the processing list of a
+    worker whose heartbeat expired go back on the queue, both at startup and
+    periodically, so a crash or restart does not lose them. A job is given up
+    after AI_JOB_MAX_ATTEMPTS runs.
+
+    Workers are separate processes (see app/worker.py), so their number scales
+    independently of the web tier.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    logger.info(
+        f"AI job worker {worker_id} started with concurrency {concurrency}"
+    )
+    await asyncio.to_thread(_heartbeat, worker_id)
+    await asyncio.to_thread(_recover_orphaned_jobs)
+    keep_alive = asyncio.create_task(_keep_alive(worker_id))
+    usage_flusher = asyncio.create_task(usage_ledger.run_flusher())
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+
+    def finished(task: asyncio.Task) -> None:
+        running.discard(task)
+        slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                job_id = await asyncio.to_thread(
+                    redis_client.redis_client.blmove,
+                    JOB_QUEUE_KEY,
+                    _processing_key(worker_id),
+                    5,
+                    "RIGHT",
+                    "LEFT",
+                )
+            except Exception as e:
+                logger.error(f"Failed to read AI job queue: {e}")
+                slots.release()
+                await asyncio.sleep(1)
+                continue
+            if not job_id:
+                slots.release()
+                continue
+            task = asyncio.create_task(
+                _run_and_acknowledge(worker_id, job_id.decode())
+            )
+            running.add(task)
+            task.add_done_callback(finished)
+    finally:
+        # Shutting down: interrupted jobs go back on the queue right away, and
+        # the flusher writes the remaining usage records on cancel
+        keep_alive.cancel()
+        for task in list(running):
+            task.cancel()
+        await asyncio.gather(keep_alive, *running, return_exceptions=True)
+        try:
+            await asyncio.to_thread(_shut_down, worker_id)
+        except Exception as e:
+            logger.error(f"Failed to requeue jobs of worker {worker_id}: {e}")
+        usage_flusher.cancel()
+        await asyncio.gather(usage_flusher, return_exceptions=True)
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+# User on whose behalf the current request calls Gemini (set by deps.bind_ai_user)
+current_ai_user_id: ContextVar[Optional[int]] = ContextVar(
+    "current_ai_user_id", default=None
+)
+
+# Atomically decides whether `member` may take a slot.
+# KEYS: inflight zset (member -> lease expiry), waiting zset (member -> enqueue
+# time), heartbeat hash (member -> last poll time).
+# ARGV: member, now_ms, cap, lease_ms, stale_ms.
+# Members are "<user>|<ticket>". Free slots are handed out one at a time to the
+# live waiter whose user has the fewest calls in flight (counting slots handed
+# out earlier in the same pass), ties going to the oldest ticket, so a single
+# user can never hold the queue while others wait. The caller is admitted if it
+# is among the winners, so N freed slots admit N waiters on their next poll.
+_ACQUIRE_SCRIPT = """
+local inflight, waiting, heartbeat = KEYS[1], KEYS[2], KEYS[3]
+local member = ARGV[1]
+local now = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+local lease_ms = tonumber(ARGV[4])
+local stale_ms = tonumber(ARGV[5])
+
+redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now)
+if redis.call('ZSCORE', waiting, member) == false then
+  redis.call('ZADD', waiting, now, member)
+end
+redis.call('HSET', heartbeat, member, now)
+
+local free = cap - redis.call('ZCARD', inflight)
+if free <= 0 then
+  return 0
+end
+
+local per_user = {}
+for _, lease in ipairs(redis.call('ZRANGE', inflight, 0, -1)) do
+  local user = string.match(lease, '^(.-)|')
+  per_user[user] = (per_user[user] or 0) + 1
+end
+
+local live = {}
+for _, waiter in ipairs(redis.call('ZRANGE', waiting, 0, -1)) do
+  local seen = tonumber(redis.call('HGET', heartbeat, waiter) or '0')
+  if now - seen > stale_ms then
+    redis.call('ZREM', waiting, waiter)
+    redis.call('HDEL', heartbeat, waiter)
+  else
+    table.insert(live, waiter)
+  end
+end
+
+local admitted = false
+for _ = 1, math.min(free, #live) do
+  local winner, winner_user, winner_load = nil, nil, nil
+  for index, waiter in ipairs(live) do
+    if waiter then
+      local user = string.match(waiter, '^(.-)|')
+      local load = per_user[user] or 0
+      if winner == nil or load < winner_load then
+        winner, winner_user, winner_load = index, user, load
+      end
+    end
+  end
+  if live[winner] == member then
+    admitted = true
+    break
+  end
+  per_user[winner_user] = winner_load + 1
+  live[winner] = false
+end
+
+if not admitted then
+  return 0
+end
+redis.call('ZREM', waiting, member)
+redis.call('HDEL', heartbeat, member)
+redis.call('ZADD', inflight, now + lease_ms, member)
+return 1
+"""
+
+
+class GeminiConcurrencyLimiter:
+    """
+    Caps the number of in-flight Gemini calls across all workers.
+
+    State lives in Redis so every uvicorn worker shares one budget. Waiting calls
+    poll an atomic Lua script that hands free slots to the least-served user first
+    and give up after AI_LIMITER_QUEUE_TIMEOUT_SECONDS with a 429. If Redis is
+    unreachable the limiter degrades to a per-process semaphore.
+    """
+
+    def __init__(self, max_in_flight: int, prefix: str = "ai:limiter:"):
+        self.max_in_flight = max_in_flight
+        self.inflight_key = f"{prefix}inflight"
+        self.waiting_key = f"{prefix}waiting"
+        self.heartbeat_key = f"{prefix}heartbeat"
+        self._script = redis_client.redis_client.register_script(_ACQUIRE_SCRIPT)
+        self._local_semaphore = asyncio.Semaphore(max_in_flight)
+        self.local_waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.redis_fallbacks = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _try_acquire(self, member: str) -> bool:
+        return bool(
+            self._script(
+                keys=[self.inflight_key, self.waiting_key, self.heartbeat_key],
+                args=[
+                    member,
+                    int(time.time() * 1000),
+                    self.max_in_flight,
+                    settings.AI_LIMITER_LEASE_SECONDS * 1000,
+                    settings.AI_LIMITER_STALE_WAITER_MS,
+                ],
+            )
+        )
+
+    def _forget(self, member: str) -> None:
+        pipe = redis_client.redis_client.pipeline()
+        pipe.zrem(self.waiting_key, member)
+        pipe.hdel(self.heartbeat_key, member)
+        pipe.zrem(self.inflight_key, member)
+        pipe.execute()
+
+    def _record_wait(self, started: float) -> None:
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _timeout_error(self) -> HTTPException:
+        self.timeouts += 1
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="AI service is busy. Please try again shortly.",
+            headers={"Retry-After": "5"},
+        )
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[int] = None) -> AsyncIterator[None]:
+        """Holds one global Gemini slot for the duration of the block."""
+        if user_id is None:
+            user_id = current_ai_user_id.get()
+        member = f"{user_id if user_id is not None else 'anon'}|{uuid.uuid4().hex}"
+        started = time.monotonic()
+        deadline = started + settings.AI_LIMITER_QUEUE_TIMEOUT_SECONDS
+        poll_seconds = settings.AI_LIMITER_POLL_INTERVAL_MS / 1000
+
+        use_local = False
+        self.local_waiting += 1
+        try:
+            while not await asyncio.to_thread(self._try_acquire, member):
+                if time.monotonic() >= deadline:
+                    await asyncio.to_thread(self._forget, member)
+                    raise self._timeout_error()
+                await asyncio.sleep(poll_seconds * random.uniform(0.5, 1.5))
+        except HTTPException:
+            raise
+        except Exception as e:
+            self.redis_fallbacks += 1
+            logger.warning(f"AI limiter Redis unavailable, using local limit: {e}")
+            use_local = True
+        finally:
+            self.local_waiting -= 1
+
+        if use_local:
+            remaining = max(deadline - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self._local_semaphore.acquire(), remaining)
+            except asyncio.TimeoutError:
+                raise self._timeout_error()
+            self._record_wait(started)
+            try:
+                yield
+            finally:
+                self._local_semaphore.release()
+            return
+
+        self._record_wait(started)
+        try:
+            yield
+        finally:
+            try:
+                await asyncio.to_thread(self._forget, member)
+            except Exception as e:
+                # The lease expires on its own after AI_LIMITER_LEASE_SECONDS
+                logger.warning(f"Failed to release AI limiter slot: {e}")
+
+    def _in_flight(self) -> int:
+        return redis_client.redis_client.zcount(
+            self.inflight_key, int(time.time() * 1000), "+inf"
+        )
+
+    async def load(self) -> float:
+        """Share of the global budget currently in use, from 0.0 to 1.0."""
+        try:
+            in_flight = await asyncio.to_thread(self._in_flight)
+        except Exception as e:
+            logger.warning(f"Failed to read AI limiter state from Redis: {e}")
+            in_flight = self.max_in_flight - self._local_semaphore._value
+        return min(in_flight / self.max_in_flight, 1.0) if self.max_in_flight else 1.0
+
+    def _redis_snapshot(self) -> dict:
+        now_ms = int(time.time() * 1000)
+        pipe = redis_client.redis_client.pipeline()
+        pipe.zcount(self.inflight_key, now_ms, "+inf")
+        pipe.zrange(self.waiting_key, 0, -1)
+        in_flight, waiters = pipe.execute()
+        per_user: dict = {}
+        for waiter in waiters:
+            user = waiter.decode().split("|", 1)[0]
+            per_user[user] = per_user.get(user, 0) + 1
+        return {
+            "in_flight": in_flight,
+            "queue_depth": len(waiters),
+            "queue_depth_by_user": per_user,
+        }
+
+    async def stats(self) -> dict:
+        stats = {
+            "max_in_flight": self.max_in_flight,
+            "local_waiting": self.local_waiting,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "redis_fallbacks": self.redis_fallbacks,
+            "avg_wait_ms": (
+                round(self.total_wait_seconds * 1000 / self.acquired, 3)
+                if self.acquired
+                else 0.0
+            ),
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+        }
+        try:
+            stats.update(await asyncio.to_thread(self._redis_snapshot))
+        except Exception as e:
+            logger.warning(f"Failed to read AI limiter state from Redis: {e}")
+        return stats
+
+
+# Create a singleton instance
+gemini_limiter = GeminiConcurrencyLimiter(max_in_flight=settings.AI_MAX_IN_FLIGHT)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import uuid
+from typing import Set
+
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.crud import v1
+from app.db import session
+from app.services import ai_service
+from app.services.ai_limiter import current_ai_user_id, gemini_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AiPrecomputer:
+    """
+    Speculatively runs the likely next AI action after a note is written.
+
+    Each write stores a fresh token under the note's Redis key and sleeps for the
+    debounce window; only the task still holding the latest token then runs, so a
+    burst of edits (on any worker) costs one precompute. Content notes get their
+    summary, task notes without tasks get task suggestions. Results land in the
+    regular AI result cache, keyed by content, so the matching endpoint serves
+    them instantly as long as the note has not changed since.
+
+    Precompute is low priority: it has its own small concurrency cap and is
+    skipped while the Gemini limiter is above AI_PRECOMPUTE_MAX_LOAD.
+    """
+
+    def __init__(self, debounce_seconds: float, concurrency: int, max_load: float):
+        self.debounce_seconds = debounce_seconds
+        self.max_load = max_load
+        self.prefix = "ai:precompute:"
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self.scheduled = 0
+        self.superseded = 0
+        self.skipped_busy = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _claim(self, note_id: int, token: str) -> None:
+        redis_client.redis_client.set(
+            f"{self.prefix}{note_id}", token, ex=int(self.debounce_seconds) + 60
+        )
+
+    def _is_latest(self, note_id: int, token: str) -> bool:
+        value = redis_client.redis_client.get(f"{self.prefix}{note_id}")
+        return value is not None and value.decode() == token
+
+    def schedule(self, note_id: int, user_id: int) -> None:
+        """Starts the debounced precompute for a note; must run on the event loop."""
+        if not settings.AI_PRECOMPUTE_ENABLED:
+            return
+        self.scheduled += 1
+        task = asyncio.create_task(self._run(note_id, user_id))
+        # Keep a reference so the task is not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, note_id: int, user_id: int) -> None:
+        token = uuid.uuid4().hex
+        try:
+            await asyncio.to_thread(self._claim, note_id, token)
+            await asyncio.sleep(self.debounce_seconds)
+            if not await asyncio.to_thread(self._is_latest, note_id, token):
+                self.superseded += 1
+                return
+        except Exception as e:
+            logger.warning(f"AI precompute Redis error for note {note_id}: {e}")
+            return
+
+        async with self._semaphore:
+            if await gemini_limiter.load() >= self.max_load:
+                self.skipped_busy += 1
+                logger.info(f"Skipping AI precompute for note {note_id}: limiter busy")
+                return
+            try:
+                await self._precompute(note_id, user_id)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"AI precompute failed for note {note_id}: {e}")
+
+    async def _precompute(self, note_id: int, user_id: int) -> None:
+        with next(session.get_session()) as db:
+            user = v1.user.get_user_by_id(user_id, db)
+            note = v1.note.get_note_by_id(note_id, user, db) if user else None
+            if not note:
+                return
+            current_ai_user_id.set(user.id)
+            if note.type in [1, 4]:
+                if note.content and note.content.strip():
+                    logger.info(f"Precomputing summary for note {note.id}")
+                    # Same arguments as /summarize without options, so the
+                    # precomputed result is the one the endpoint looks up
+                    await ai_service.summarize_content(
+                        note.content, note.title, max_length=None
+                    )
+            elif not note.tasks:
+                logger.info(f"Precomputing task suggestions for note {note.id}")
+                await ai_service.generate_tasks_from_title(note.title)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.AI_PRECOMPUTE_ENABLED,
+            "pending": len(self._tasks),
+            "scheduled": self.scheduled,
+            "superseded": self.superseded,
+            "skipped_busy": self.skipped_busy,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+# Create a singleton instance
+precomputer = AiPrecomputer(
+    debounce_seconds=settings.AI_PRECOMPUTE_DEBOUNCE_SECONDS,
+    concurrency=settings.AI_PRECOMPUTE_CONCURRENCY,
+    max_load=settings.AI_PRECOMPUTE_MAX_LOAD,
+)
@@ -0,0 +1,405 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import google.generativeai as genai
+from fastapi import HTTPException, status
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import (
+    GenerationConfig,
+    HarmCategory,
+    HarmBlockThreshold,
+)
+
+from app.core.config import settings
+from app.services.gemini_pool import model_pool
+from app.services.gemini_context_cache import context_cache
+from app.services.ai_usage import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+class LLMProvider(ABC):
+    """
+    Backend that turns a prompt into text.
+
+    Providers only talk to the model: caching, coalescing, concurrency limits,
+    retries and error wrapping are applied around them by ai_service.
+    """
+
+    name: str
+    # Identifies the model in cache and single-flight keys
+    model_id: str
+
+    @abstractmethod
+    async def generate(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        safety_settings: Optional[Dict[HarmCategory, HarmBlockThreshold]] = None,
+        usage: Optional[TokenUsage] = None,
+        context: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        """
+        Returns the full generated text for the prompt, adding its token counts to
+        usage. context is long source text the prompt refers to; it is sent ahead
+        of the prompt and may be cached model-side. model overrides model_id for
+        this call (providers with a single model ignore it).
+        """
+
+    @abstractmethod
+    def stream(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        usage: Optional[TokenUsage] = None,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """Yields text chunks as they are generated, adding token counts to usage."""
+
+    def warm_up(self, configs: list) -> None:
+        """Prepares the provider for the given configs ahead of traffic."""
+
+    def stats(self) -> dict:
+        return {"name": self.name, "model": self.model_id}
+
+
+def _add_usage(usage: TokenUsage, response: Any) -> None:
+    metadata = getattr(response, "usage_metadata", None)
+    usage.add(
+        getattr(metadata, "prompt_token_count", 0),
+        getattr(metadata, "candidates_token_count", 0),
+    )
+
+
+def raise_if_blocked(response: Any) -> None:
+    """Raises a 400 if Gemini blocked the prompt (full or streamed response)."""
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        block_reason = response.prompt_feedback.block_reason.name
+        logger.warning(f"Gemini request blocked due to: {block_reason}")
+        # Provide a more user-friendly message if possible
+        detail_msg = f"Request blocked by safety filter: {block_reason}. Please revise your input."
+        if block_reason == "SAFETY":
+            detail_msg = "Request blocked due to safety concerns in the prompt or potential output. Please revise your input."
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail_msg)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through pooled `GenerativeModel` instances."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str):
+        self.model_id = model_name
+        # Configure the Gemini client
+        try:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+        except Exception as e:
+            logger.error(f"Failed to configure Gemini API: {e}")
+
+    async def generate(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        safety_settings: Optional[Dict[HarmCategory, HarmBlockThreshold]] = None,
+        usage: Optional[TokenUsage] = None,
+        context: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        model_name = model or self.model_id
+        cached_content = None
+        if context is not None:
+            cached_content = await context_cache.get_or_create(model_name, context)
+        # Pooled model already carries the generation config and default safety
+        # settings; explicit safety_settings still override per call.
+        pooled = model_pool.get(model_name, generation_config, cached_content)
+        contents = prompt if context is None or cached_content else [context, prompt]
+
+        logger.info(f"Calling Gemini model {model_name}")
+        # Use the SDK's native async path so a slow generation only suspends
+        # this coroutine instead of blocking the whole event loop.
+        response = await pooled.generate_content_async(
+            contents, safety_settings=safety_settings
+        )
+        logger.info(prompt)
+        logger.info("Gemini response received")
+        if usage is not None:
+            _add_usage(usage, response)
+
+        # --- Crucial Error and Safety Handling ---
+        # 1. Check for blocking reasons first
+        raise_if_blocked(response)
+
+        # 2. Check if candidates exist and have content
+        if not response.candidates:
+            logger.error("Gemini response missing candidates.")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="AI service returned no response candidates.",
+            )
+
+        # 3. Access the text, handling potential finish reasons and missing parts
+        try:
+            # Check finish reason if needed - e.g., 'MAX_TOKENS' might mean incomplete output
+            finish_reason = (
+                response.candidates[0].finish_reason.name
+                if response.candidates[0].finish_reason
+                else "UNKNOWN"
+            )
+            if finish_reason not in ["STOP", "UNKNOWN"]:  # Allow UNKNOWN for now
+                logger.warning(f"Gemini generation finished due to: {finish_reason}")
+                # Decide if this is an error - MAX_TOKENS might be acceptable but truncated
+
+            # Get text, ensuring parts exist
+            if (
+                not response.candidates[0].content
+                or not response.candidates[0].content.parts
+            ):
+                logger.error("Gemini response candidate missing content or parts.")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="AI service returned empty content.",
+                )
+
+            generated_text = response.text  # response.text is a convenience accessor
+
+            if not generated_text:
+                logger.error("Gemini response.text is empty.")
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="AI service returned empty text.",
+                )
+
+            return generated_text.strip()
+
+        except (AttributeError, IndexError, ValueError) as e:
+            logger.error(
+                f"Error parsing Gemini response: {e}\nResponse: {response}",
+                exc_info=True,
+            )
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to parse AI service response.",
+            )
+
+    async def stream(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        usage: Optional[TokenUsage] = None,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        model_name = model or self.model_id
+        pooled = model_pool.get(model_name, generation_config)
+        logger.info(f"Streaming from Gemini model {model_name}")
+        response = await pooled.generate_content_async(prompt, stream=True)
+        last_chunk = None
+        try:
+            async for chunk in response:
+                last_chunk = chunk
+                raise_if_blocked(chunk)
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks carrying only a finish reason or safety ratings have no parts
+                    continue
+                if text:
+                    yield text
+        finally:
+            # Every chunk carries the running totals, so the last one counts
+            if usage is not None and last_chunk is not None:
+                _add_usage(usage, last_chunk)
+
+    def warm_up(self, configs: list) -> None:
+        model_pool.warm_up(self.model_id, configs)
+
+
+# Errors the fake provider injects, matching what the Gemini SDK raises
+FAKE_ERRORS = {
+    "unavailable": google_exceptions.ServiceUnavailable,
+    "rate_limited": google_exceptions.ResourceExhausted,
+    "internal": google_exceptions.InternalServerError,
+    "timeout": google_exceptions.DeadlineExceeded,
+    "invalid": google_exceptions.InvalidArgument,
+}
+
+_FAKE_WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima "
+    "mike november oscar papa quebec romeo sierra tango uniform victor whiskey "
+    "xray yankee zulu"
+).split()
+
+
+def _fake_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in for load and capacity tests: no network, no quota.
+
+    Latency is drawn from a configurable distribution, errors are injected at a
+    configurable rate, and the output is a pure function of the prompt and config,
+    so repeated runs produce the same text (and the same cache behaviour).
+    """
+
+    name = "fake"
+    model_id = "fake"
+
+    def __init__(
+        self,
+        latency_distribution: str = "lognormal",
+        latency_ms: float = 800,
+        latency_jitter_ms: float = 300,
+        latency_max_ms: float = 30000,
+        error_rate: float = 0.0,
+        error_kind: str = "unavailable",
+        output_words: int = 120,
+        stream_chunk_words: int = 8,
+        seed: Optional[int] = None,
+    ):
+        if latency_distribution not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        if error_kind not in FAKE_ERRORS:
+            raise ValueError(f"Unknown fake error kind: {error_kind}")
+        self.latency_distribution = latency_distribution
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_max_ms = latency_max_ms
+        self.error_rate = error_rate
+        self.error_kind = error_kind
+        self.output_words = output_words
+        self.stream_chunk_words = stream_chunk_words
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.injected_errors = 0
+
+    def _latency_seconds(self) -> float:
+        mean, jitter = self.latency_ms, self.latency_jitter_ms
+        if self.latency_distribution == "fixed":
+            value = mean
+        elif self.latency_distribution == "uniform":
+            value = self._random.uniform(mean - jitter, mean + jitter)
+        elif self.latency_distribution == "normal":
+            value = self._random.gauss(mean, jitter)
+        else:
+            # Long right tail, like real model latencies; `mean` is the median
+            sigma = math.log1p(jitter / mean) if mean > 0 else 0.0
+            value = mean * self._random.lognormvariate(0.0, sigma)
+        return min(max(value, 0.0), self.latency_max_ms) / 1000
+
+    async def _simulate_call(self) -> None:
+        self.calls += 1
+        await asyncio.sleep(self._latency_seconds())
+        if self._random.random() < self.error_rate:
+            self.injected_errors += 1
+            raise FAKE_ERRORS[self.error_kind](f"Injected fake {self.error_kind} error")
+
+    def _render(
+        self, prompt: str, generation_config: Optional[GenerationConfig]
+    ) -> str:
+        if (
+            generation_config is not None
+            and generation_config.response_mime_type == "application/json"
+        ):
+            return self._render_json(prompt)
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        words_count = self.output_words
+        if generation_config is not None and generation_config.max_output_tokens:
+            words_count = min(words_count, generation_config.max_output_tokens)
+        words = [
+            _FAKE_WORDS[digest[i % len(digest)] % len(_FAKE_WORDS)]
+            for i in range(words_count)
+        ]
+        # Short lines so list-style parsers (e.g. generated tasks) get several items
+        lines = [" ".join(words[i : i + 8]) for i in range(0, len(words), 8)]
+        return "\n".join(lines)
+
+    def _render_json(self, prompt: str) -> str:
+        """Echoes the last JSON array of {"id", "title"} objects in the prompt."""
+        items: List[dict] = []
+        for match in re.finditer(r"\[\s*\{.*\}\s*\]", prompt, re.DOTALL):
+            try:
+                items = json.loads(match.group(0))
+            except ValueError:
+                continue
+        return json.dumps(
+            [
+                {"id": item.get("id"), "title": f"{item.get('title', '')} (fake)"}
+                for item in items
+                if isinstance(item, dict)
+            ]
+        )
+
+    async def generate(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        safety_settings: Optional[Dict[HarmCategory, HarmBlockThreshold]] = None,
+        usage: Optional[TokenUsage] = None,
+        context: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        if context is not None:
+            prompt = f"{context}\n\n{prompt}"
+        await self._simulate_call()
+        text = self._render(prompt, generation_config)
+        if usage is not None:
+            usage.add(_fake_tokens(prompt), _fake_tokens(text))
+        return text
+
+    async def stream(
+        self,
+        prompt: str,
+        generation_config: Optional[GenerationConfig] = None,
+        usage: Optional[TokenUsage] = None,
+        model: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        await self._simulate_call()
+        text = self._render(prompt, generation_config)
+        if usage is not None:
+            usage.add(_fake_tokens(prompt), _fake_tokens(text))
+        words = text.split(" ")
+        step = max(self.stream_chunk_words, 1)
+        for i in range(0, len(words), step):
+            if i:
+                # Spread a little extra latency over the chunks
+                await asyncio.sleep(self._latency_seconds() / 20)
+            yield " ".join(words[i : i + step]) + (" " if i + step < len(words) else "")
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "latency_distribution": self.latency_distribution,
+            "calls": self.calls,
+            "injected_errors": self.injected_errors,
+        }
+
+
+def build_provider(name: str) -> LLMProvider:
+    """Creates the provider selected by AI_PROVIDER."""
+    if name == "gemini":
+        return GeminiProvider(settings.GEMINI_MODEL_NAME)
+    if name == "fake":
+        return FakeProvider(
+            latency_distribution=settings.AI_FAKE_LATENCY_DISTRIBUTION,
+            latency_ms=settings.AI_FAKE_LATENCY_MS,
+            latency_jitter_ms=settings.AI_FAKE_LATENCY_JITTER_MS,
+            latency_max_ms=settings.AI_FAKE_LATENCY_MAX_MS,
+            error_rate=settings.AI_FAKE_ERROR_RATE,
+            error_kind=settings.AI_FAKE_ERROR_KIND,
+            output_words=settings.AI_FAKE_OUTPUT_WORDS,
+            seed=settings.AI_FAKE_SEED,
+        )
+    raise ValueError(f"Unknown AI provider: {name}")
+
+
+# Create a singleton instance
+llm_provider = build_provider(settings.AI_PROVIDER)
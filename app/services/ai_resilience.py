@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException, status
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upstream failures worth retrying; anything else (bad request, blocked prompt,
+# parse failure, limiter timeout) is returned to the caller immediately.
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Checks the error (or the upstream error an HTTPException wraps)."""
+    if isinstance(error, HTTPException):
+        error = error.__cause__
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the upstream error rate is above a limit.
+
+    Outcomes are kept for a rolling window. Once at least `min_calls` were seen
+    and the error rate reaches `error_rate`, the breaker opens for `open_seconds`,
+    then lets a single probe through (half-open) that closes or re-opens it.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float,
+        min_calls: int,
+        error_rate: float,
+        open_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at < self.open_seconds:
+            return "open"
+        return "half_open"
+
+    def _trim(self) -> None:
+        horizon = self._clock() - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+
+    def current_error_rate(self) -> float:
+        self._trim()
+        if not self._outcomes:
+            return 0.0
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return failures / len(self._outcomes)
+
+    def before_call(self) -> bool:
+        """
+        Raises a 503 instead of calling upstream while the breaker is open.
+
+        Returns True if the caller is the half-open probe, which must then report
+        back through record() or release().
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.short_circuited += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is temporarily unavailable. Please try again later.",
+            headers={"Retry-After": str(int(self.open_seconds))},
+        )
+
+    def release(self, probe: bool) -> None:
+        """
+        Ends a call without recording an outcome (cancelled, or failed for a reason
+        that says nothing about upstream health), freeing the half-open probe.
+        """
+        if probe:
+            self._probe_in_flight = False
+
+    def record(self, success: bool, probe: bool = False) -> None:
+        now = self._clock()
+        if probe:
+            # Outcome of the half-open probe decides the next state
+            self._probe_in_flight = False
+            if success:
+                self._opened_at = None
+                self._outcomes.clear()
+            else:
+                self._opened_at = now
+            return
+        self._outcomes.append((now, success))
+        self._trim()
+        if (
+            self._opened_at is None
+            and len(self._outcomes) >= self.min_calls
+            and self.current_error_rate() >= self.error_rate
+        ):
+            logger.warning("Gemini circuit breaker opened")
+            self._opened_at = now
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error_rate": round(self.current_error_rate(), 4),
+            "window_calls": len(self._outcomes),
+            "short_circuited": self.short_circuited,
+        }
+
+
+class ResilientCaller:
+    """
+    Wraps an upstream call with capped exponential backoff (full jitter),
+    optional hedging after the observed latency percentile, and a circuit breaker.
+
+    Every dependency (sleep, clock, randomness) is injectable so the policy can be
+    exercised against a fake provider without real waits.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._sleep = sleep
+        self._rng = rng
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter delay before retry number `attempt` (0-based)."""
+        return min(self.max_delay, self.base_delay * (2**attempt)) * self._rng()
+
+    def hedge_threshold(self) -> Optional[float]:
+        if not self.hedge_enabled or len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+        return ordered[index]
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        result = await fn()
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        threshold = self.hedge_threshold()
+        if threshold is None:
+            return await self._timed(fn)
+
+        primary = asyncio.create_task(self._timed(fn))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                self.hedges += 1
+                tasks.add(asyncio.create_task(self._timed(fn)))
+            error: Optional[BaseException] = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        for attempt in range(self.max_attempts):
+            probe = self.breaker.before_call()
+            try:
+                result = await self._hedged(fn)
+            except Exception as e:
+                # Only upstream failures count against the breaker
+                if not is_retryable(e):
+                    self.breaker.release(probe)
+                    raise
+                self.breaker.record(False, probe)
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.retries += 1
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Retrying Gemini call in {delay:.2f}s after error: {e}")
+                await self._sleep(delay)
+            except BaseException:
+                self.breaker.release(probe)
+                raise
+            else:
+                self.breaker.record(True, probe)
+                return result
+
+    def stats(self) -> dict:
+        threshold = self.hedge_threshold()
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_threshold_ms": (
+                round(threshold * 1000, 3) if threshold is not None else None
+            ),
+            "circuit_breaker": self.breaker.stats(),
+        }
+
+
+# Create a singleton instance
+gemini_resilience = ResilientCaller(
+    breaker=CircuitBreaker(
+        window_seconds=settings.AI_BREAKER_WINDOW_SECONDS,
+        min_calls=settings.AI_BREAKER_MIN_CALLS,
+        error_rate=settings.AI_BREAKER_ERROR_RATE,
+        open_seconds=settings.AI_BREAKER_OPEN_SECONDS,
+    ),
+    max_attempts=settings.AI_RETRY_MAX_ATTEMPTS,
+    base_delay=settings.AI_RETRY_BASE_DELAY_MS / 1000,
+    max_delay=settings.AI_RETRY_MAX_DELAY_MS / 1000,
+    hedge_enabled=settings.AI_HEDGE_ENABLED,
+    hedge_percentile=settings.AI_HEDGE_PERCENTILE,
+    hedge_min_samples=settings.AI_HEDGE_MIN_SAMPLES,
+)
@@ -0,0 +1,155 @@
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.ai_provider import llm_provider
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHealth:
+    """Rolling window of call latencies and outcomes for one model."""
+
+    def __init__(
+        self, window_seconds: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.window_seconds = window_seconds
+        self._clock = clock
+        self._calls: Deque[Tuple[float, float, bool]] = deque()
+
+    def _trim(self) -> None:
+        horizon = self._clock() - self.window_seconds
+        while self._calls and self._calls[0][0] < horizon:
+            self._calls.popleft()
+
+    def record(self, latency_seconds: float, success: bool) -> None:
+        self._calls.append((self._clock(), latency_seconds, success))
+        self._trim()
+
+    def samples(self) -> int:
+        self._trim()
+        return len(self._calls)
+
+    def p95_ms(self) -> Optional[float]:
+        self._trim()
+        latencies = sorted(latency for _, latency, ok in self._calls if ok)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000
+
+    def error_rate(self) -> float:
+        self._trim()
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, _, ok in self._calls if not ok) / len(self._calls)
+
+
+class ModelRouter:
+    """
+    Picks the model for each call among the primary and a lite model.
+
+    Operations listed in AI_ROUTING_LITE_OPERATIONS and inputs up to
+    AI_ROUTING_LITE_MAX_TOKENS prefer the lite model, everything else the
+    primary one. If the preferred model's rolling p95 latency or error rate is
+    over its limit (with enough samples) and the other model is healthy, the
+    call goes to the other model instead. Every decision is counted per
+    operation, model and reason, and each call's model is also written to the
+    usage ledger.
+    """
+
+    def __init__(
+        self,
+        primary: str,
+        lite: Optional[str],
+        lite_operations: List[str],
+        lite_max_tokens: int,
+        window_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.primary = primary
+        self.lite = lite
+        self.lite_operations = set(lite_operations)
+        self.lite_max_tokens = lite_max_tokens
+        self._health: Dict[str, ModelHealth] = {
+            model: ModelHealth(window_seconds, clock)
+            for model in (primary, lite)
+            if model
+        }
+        self.decisions: Dict[str, int] = {}
+
+    def _healthy(self, model: str) -> bool:
+        health = self._health[model]
+        if health.samples() < settings.AI_ROUTING_MIN_SAMPLES:
+            return True
+        p95 = health.p95_ms()
+        return (
+            health.error_rate() <= settings.AI_ROUTING_MAX_ERROR_RATE
+            and (p95 is None or p95 <= settings.AI_ROUTING_MAX_P95_MS)
+        )
+
+    def choose(self, operation: str, input_tokens: int) -> str:
+        """Returns the model name to use for this call and records the decision."""
+        if not settings.AI_ROUTING_ENABLED or not self.lite:
+            return self.primary
+
+        if operation in self.lite_operations:
+            preferred, reason = self.lite, "operation"
+        elif input_tokens <= self.lite_max_tokens:
+            preferred, reason = self.lite, "short_input"
+        else:
+            preferred, reason = self.primary, "long_input"
+
+        model = preferred
+        if not self._healthy(preferred):
+            other = self.primary if preferred == self.lite else self.lite
+            if self._healthy(other):
+                model, reason = other, "unhealthy_fallback"
+
+        decision = f"{operation}|{model}|{reason}"
+        self.decisions[decision] = self.decisions.get(decision, 0) + 1
+        logger.debug(
+            f"Routed '{operation}' (~{input_tokens} tokens) to {model}: {reason}"
+        )
+        return model
+
+    def models_key(self) -> str:
+        """The models calls can currently be routed to, for keying stored results."""
+        if not settings.AI_ROUTING_ENABLED or not self.lite:
+            return self.primary
+        return f"{self.primary}+{self.lite}"
+
+    def observe(self, model: str, latency_seconds: float, success: bool) -> None:
+        health = self._health.get(model)
+        if health is not None:
+            health.record(latency_seconds, success)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.AI_ROUTING_ENABLED,
+            "models": {
+                model: {
+                    "samples": health.samples(),
+                    "p95_ms": (
+                        round(health.p95_ms(), 3)
+                        if health.p95_ms() is not None
+                        else None
+                    ),
+                    "error_rate": round(health.error_rate(), 4),
+                    "healthy": self._healthy(model),
+                }
+                for model, health in self._health.items()
+            },
+            "decisions": dict(self.decisions),
+        }
+
+
+# Create a singleton instance
+model_router = ModelRouter(
+    primary=llm_provider.model_id,
+    lite=settings.AI_ROUTING_LITE_MODEL,
+    lite_operations=settings.AI_ROUTING_LITE_OPERATIONS,
+    lite_max_tokens=settings.AI_ROUTING_LITE_MAX_TOKENS,
+    window_seconds=settings.AI_ROUTING_WINDOW_SECONDS,
+)
@@ -1,4 +1,3 @@
-import google.generativeai as genai
 from google.generativeai.types import (
     GenerationConfig,
     HarmCategory,
@@ -6,20 +5,78 @@ from google.generativeai.types import (
 )  # For safety settings and config
 from fastapi import HTTPException, status
 from app.core.config import settings
-from typing import Optional, Dict, Any, List
+from app.services.gemini_pool import model_pool, config_key
+from app.services.gemini_context_cache import context_cache
+from app.services.ai_provider import llm_provider
+from app.services.ai_cache import result_cache, paragraph_index
+from app.services.ai_limiter import gemini_limiter
+from app.services.ai_singleflight import single_flight
+from app.services.ai_resilience import gemini_resilience, is_retryable
+from app.services.ai_usage import TokenUsage, usage_ledger
+from app.services.ai_budget import (
+    budget_request,
+    count_tokens,
+    rewrite_input_limit,
+    window_tail,
+)
+from app.services.ai_router import model_router
+from app.services.local_format import local_formatter
+from typing import (
+    Optional,
+    Dict,
+    Any,
+    List,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Tuple,
+    Union,
+)
+import functools
+import hashlib
+import re
+import time
+import asyncio
+import json
 import logging  # Import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure the Gemini client
-try:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-except Exception as e:
-    logger.error(f"Failed to configure Gemini API: {e}")
-    # Decide if you want the app to fail startup or handle this later
-    # raise RuntimeError("Gemini API key configuration failed") from e
+# A prompt string, or an async factory producing it on a cache miss
+PromptSource = Union[str, Callable[[], Awaitable[str]]]
+
+# Generation configs used by the feature functions below, pre-built at startup
+WARM_UP_GENERATION_CONFIGS = [None] + [
+    GenerationConfig(temperature=t) for t in (0.3, 0.4, 0.5, 0.6, 0.7)
+]
+
+
+def warm_up_model_pool() -> None:
+    """Builds the pooled Gemini models for the common configs ahead of traffic."""
+    try:
+        llm_provider.warm_up(WARM_UP_GENERATION_CONFIGS)
+    except Exception as e:
+        logger.error(f"Failed to warm up Gemini model pool: {e}")
+
+
+async def get_ai_metrics() -> Dict[str, Any]:
+    """Runtime counters for the AI layer, exposed via GET /ai/metrics."""
+    return {
+        "provider": llm_provider.stats(),
+        "model_pool": model_pool.stats(),
+        "router": model_router.stats(),
+        "context_cache": context_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "paragraph_index": paragraph_index.stats(),
+        "format_fast_path": local_formatter.stats(),
+        "patch_mode": dict(patch_stats),
+        "limiter": await gemini_limiter.stats(),
+        "single_flight": single_flight.stats(),
+        "resilience": gemini_resilience.stats(),
+        "usage_ledger": usage_ledger.stats(),
+    }
 
 
 # --- Central Gemini API Call Helper ---
@@ -27,14 +84,101 @@ async def _call_gemini_api(
     prompt: str,
     generation_config: Optional[GenerationConfig] = None,
     safety_settings: Optional[Dict[HarmCategory, HarmBlockThreshold]] = None,
+    operation: str = "other",
+    context: Optional[str] = None,
+    model: Optional[str] = None,
 ) -> str:
     """
-    Helper function to call the Gemini API, handle errors, and extract text.
+    Calls Gemini once a slot of the global concurrency limiter is free.
+
+    Identical requests (same model, prompt and config) already in flight on this
+    or another worker are joined instead of sent again. Transient upstream errors
+    are retried with backoff, and calls fail fast while the circuit breaker is open
+    (see ai_resilience). See _request_gemini for arguments and error handling;
+    additionally raises a 429 HTTPException if no slot frees up within the queue
+    timeout.
+
+    Each invocation is recorded in the usage ledger under `operation`, with the
+    tokens of every upstream request it made (none when it joined another call).
+
+    The request is budgeted first (see ai_budget.budget_request): oversized
+    inputs are rejected with a 413 and an output cap is set when none is given.
+    Unless the caller already chose one (see _route), the model is then picked
+    by ai_router from the operation, the input size and the models' recent
+    latency and error rates.
+    """
+    input_tokens = count_tokens(prompt) + count_tokens(context)
+    generation_config = budget_request(operation, input_tokens, generation_config)
+    model = model or model_router.choose(operation, input_tokens)
+    usage = TokenUsage()
+
+    async def limited_request() -> str:
+        async with gemini_limiter.slot():
+            attempt_started = time.perf_counter()
+            try:
+                result = await _request_gemini(
+                    prompt, generation_config, safety_settings, usage, context, model
+                )
+            except asyncio.CancelledError:
+                raise  # E.g. a hedged call that lost; says nothing about the model
+            except Exception as e:
+                # Blocked prompts and bad responses are not the model's health
+                if is_retryable(e):
+                    model_router.observe(
+                        model, time.perf_counter() - attempt_started, False
+                    )
+                raise
+            model_router.observe(model, time.perf_counter() - attempt_started, True)
+            return result
+
+    async def resilient_request() -> str:
+        return await gemini_resilience.call(limited_request)
+
+    started = time.perf_counter()
+    success = False
+    try:
+        if not settings.AI_SINGLEFLIGHT_ENABLED:
+            result = await resilient_request()
+        else:
+            key = single_flight.make_key(
+                model=model,
+                prompt=prompt,
+                context=context,
+                generation_config=config_key(generation_config),
+                safety_settings=safety_settings,
+            )
+            result = await single_flight.do(key, resilient_request)
+        success = True
+        return result
+    finally:
+        usage_ledger.record(
+            operation,
+            model=model,
+            cache_status="coalesced" if success and not usage.requests else "miss",
+            latency_seconds=time.perf_counter() - started,
+            usage=usage,
+            success=success,
+        )
+
+
+async def _request_gemini(
+    prompt: str,
+    generation_config: Optional[GenerationConfig] = None,
+    safety_settings: Optional[Dict[HarmCategory, HarmBlockThreshold]] = None,
+    usage: Optional[TokenUsage] = None,
+    context: Optional[str] = None,
+    model: Optional[str] = None,
+) -> str:
+    """
+    Helper function to call the configured LLM provider and handle errors.
 
     Args:
         prompt: The complete prompt string for the Gemini model.
         generation_config: Optional GenerationConfig for temperature, max tokens etc.
         safety_settings: Optional safety settings dictionary.
+        usage: Optional accumulator for the response's token counts.
+        context: Optional note text sent ahead of the prompt (see _note_context).
+        model: Optional model overriding the provider's default (see ai_router).
 
     Returns:
         The generated text content from the model.
@@ -43,134 +187,633 @@ async def _call_gemini_api(
         HTTPException: If the API call fails, is blocked, or returns unexpected data.
     """
     try:
-        model = genai.GenerativeModel(settings.GEMINI_MODEL_NAME)
-
-        # Default safety settings (adjust as needed)
-        if safety_settings is None:
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            }
-
-        logger.info(f"Calling Gemini model {settings.GEMINI_MODEL_NAME}")
-        # Use generate_content_async for async operation if available and needed,
-        # otherwise, run the sync version in a threadpool if it blocks heavily.
-        # For simplicity here, using the sync version directly.
-        # Consider using asyncio.to_thread for long calls if needed.
-        response = model.generate_content(
-            prompt, generation_config=generation_config, safety_settings=safety_settings
+        return await llm_provider.generate(
+            prompt,
+            generation_config,
+            safety_settings,
+            usage,
+            context=context,
+            model=model,
         )
-        logger.info(prompt)
-        logger.info("Gemini response received")
-
-        # --- Crucial Error and Safety Handling ---
-        # 1. Check for blocking reasons first
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-            block_reason = response.prompt_feedback.block_reason.name
-            logger.warning(f"Gemini request blocked due to: {block_reason}")
-            # Provide a more user-friendly message if possible
-            detail_msg = f"Request blocked by safety filter: {block_reason}. Please revise your input."
-            if block_reason == "SAFETY":
-                detail_msg = "Request blocked due to safety concerns in the prompt or potential output. Please revise your input."
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail=detail_msg
-            )
-
-        # 2. Check if candidates exist and have content
-        if not response.candidates:
-            logger.error("Gemini response missing candidates.")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="AI service returned no response candidates.",
-            )
-
-        # 3. Access the text, handling potential finish reasons and missing parts
-        try:
-            # Check finish reason if needed - e.g., 'MAX_TOKENS' might mean incomplete output
-            finish_reason = (
-                response.candidates[0].finish_reason.name
-                if response.candidates[0].finish_reason
-                else "UNKNOWN"
-            )
-            if finish_reason not in ["STOP", "UNKNOWN"]:  # Allow UNKNOWN for now
-                logger.warning(f"Gemini generation finished due to: {finish_reason}")
-                # Decide if this is an error - MAX_TOKENS might be acceptable but truncated
-
-            # Get text, ensuring parts exist
-            if (
-                not response.candidates[0].content
-                or not response.candidates[0].content.parts
-            ):
-                logger.error("Gemini response candidate missing content or parts.")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="AI service returned empty content.",
-                )
-
-            generated_text = response.text  # response.text is a convenience accessor
+    except HTTPException:
+        # Blocked prompts and malformed responses keep their own status code
+        raise
+    except Exception as e:
+        # Catch other potential errors during API call
+        logger.error(f"Error calling {llm_provider.name} API: {e}", exc_info=True)
+        # The original error is kept as __cause__ so retries can classify it
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"AI service communication error: {e}",
+        ) from e
 
-            if not generated_text:
-                logger.error("Gemini response.text is empty.")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="AI service returned empty text.",
-                )
 
-            return generated_text.strip()
+async def _stream_gemini_api(
+    prompt: str,
+    generation_config: Optional[GenerationConfig] = None,
+    operation: str = "other",
+    model: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of _call_gemini_api: yields text chunks as Gemini
+    produces them.
 
-        except (AttributeError, IndexError, ValueError) as e:
-            logger.error(
-                f"Error parsing Gemini response: {e}\nResponse: {response}",
-                exc_info=True,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to parse AI service response.",
-            )
+    Streams are not retried (chunks may already have reached the client), but they
+    respect and feed the circuit breaker. Recorded in the usage ledger like
+    _call_gemini_api.
 
+    Raises:
+        HTTPException: If the prompt is blocked or too large, the breaker is open or
+            the stream fails.
+    """
+    input_tokens = count_tokens(prompt)
+    generation_config = budget_request(operation, input_tokens, generation_config)
+    model = model or model_router.choose(operation, input_tokens)
+    breaker = gemini_resilience.breaker
+    probe = breaker.before_call()
+    outcome: Optional[bool] = None
+    usage = TokenUsage()
+    started = time.perf_counter()
+    try:
+        async with gemini_limiter.slot():
+            async for text in llm_provider.stream(
+                prompt, generation_config, usage, model=model
+            ):
+                yield text
+        outcome = True
+    except HTTPException:
+        raise
     except Exception as e:
-        # Catch other potential errors during API call
-        logger.error(f"Error calling Gemini API: {e}", exc_info=True)
-        # Check for specific google api core exceptions if needed
+        if is_retryable(e):
+            outcome = False
+        logger.error(
+            f"Error streaming from {llm_provider.name} API: {e}", exc_info=True
+        )
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"AI service communication error: {e}",
+        ) from e
+    finally:
+        if outcome is None:
+            breaker.release(probe)
+        else:
+            breaker.record(outcome, probe)
+        if outcome is not None:
+            model_router.observe(model, time.perf_counter() - started, outcome)
+        usage_ledger.record(
+            operation,
+            model=model,
+            cache_status="miss",
+            latency_seconds=time.perf_counter() - started,
+            usage=usage,
+            success=bool(outcome),
         )
 
 
+def _approx_tokens(text: str) -> int:
+    """Local token estimate used for sizing prompts (see ai_budget.count_tokens)."""
+    return count_tokens(text) + 1
+
+
+async def _resolve_prompt(prompt: PromptSource) -> str:
+    """Builds a lazily constructed prompt (only needed on a cache miss)."""
+    return prompt if isinstance(prompt, str) else await prompt()
+
+
+def _route(
+    operation: str,
+    prompt: PromptSource,
+    context: Optional[str],
+    key_params: Dict[str, Any],
+) -> str:
+    """
+    Picks the model before the cache lookup, so a cached result is keyed by
+    the model that produced it. A lazily built prompt is sized from its inputs.
+    """
+    if isinstance(prompt, str):
+        input_tokens = count_tokens(prompt) + count_tokens(context)
+    else:
+        input_tokens = sum(
+            count_tokens(value)
+            for value in key_params.values()
+            if isinstance(value, str)
+        )
+    return model_router.choose(operation, input_tokens)
+
+
+async def _stream_cached(
+    operation: str,
+    prompt: PromptSource,
+    generation_config: GenerationConfig,
+    use_cache: bool = True,
+    **key_params: Any,
+) -> AsyncIterator[str]:
+    """Streams a generation, serving and filling the same cache as _generate_cached."""
+    if not settings.AI_CACHE_ENABLED or not use_cache:
+        result_cache.bypassed += 1
+        prompt = await _resolve_prompt(prompt)
+        async for chunk in _stream_gemini_api(prompt, generation_config, operation):
+            yield chunk
+        return
+
+    model = _route(operation, prompt, None, key_params)
+    key = result_cache.make_key(
+        operation,
+        model=model,
+        temperature=generation_config.temperature,
+        **key_params,
+    )
+    started = time.perf_counter()
+    cached = await result_cache.get(key)
+    if cached is not None:
+        usage_ledger.record(
+            operation,
+            model=model,
+            cache_status="hit",
+            latency_seconds=time.perf_counter() - started,
+        )
+        yield cached
+        return
+
+    parts = []
+    prompt = await _resolve_prompt(prompt)
+    async for chunk in _stream_gemini_api(
+        prompt, generation_config, operation, model=model
+    ):
+        parts.append(chunk)
+        yield chunk
+    result = "".join(parts).strip()
+    if result:
+        await result_cache.set(key, result)
+
+
+async def _generate_cached(
+    operation: str,
+    prompt: PromptSource,
+    generation_config: GenerationConfig,
+    use_cache: bool = True,
+    context: Optional[str] = None,
+    cache_if: Optional[Callable[[str], bool]] = None,
+    **key_params: Any,
+) -> str:
+    """
+    Calls Gemini through the two-tier result cache.
+
+    key_params must contain every input that shapes the prompt (content, title,
+    style, ...); the model name and temperature are added here. prompt may be an
+    async factory so expensive prompt preparation is skipped on a cache hit.
+    context is passed on to _call_gemini_api. Results for which cache_if returns
+    False are returned but not stored.
+    """
+    if not settings.AI_CACHE_ENABLED or not use_cache:
+        result_cache.bypassed += 1
+        prompt = await _resolve_prompt(prompt)
+        return await _call_gemini_api(
+            prompt,
+            generation_config=generation_config,
+            operation=operation,
+            context=context,
+        )
+
+    model = _route(operation, prompt, context, key_params)
+    key = result_cache.make_key(
+        operation,
+        model=model,
+        temperature=generation_config.temperature,
+        **key_params,
+    )
+    started = time.perf_counter()
+    cached = await result_cache.get(key)
+    if cached is not None:
+        logger.info(f"AI result cache hit for '{operation}'")
+        usage_ledger.record(
+            operation,
+            model=model,
+            cache_status="hit",
+            latency_seconds=time.perf_counter() - started,
+        )
+        return cached
+
+    prompt = await _resolve_prompt(prompt)
+    result = await _call_gemini_api(
+        prompt,
+        generation_config=generation_config,
+        operation=operation,
+        context=context,
+        model=model,
+    )
+    if cache_if is None or cache_if(result):
+        await result_cache.set(key, result)
+    return result
+
+
 # --- Specific AI Feature Implementations ---
 
+# Stands in for the note text in prompts whose text travels as cached context
+NOTE_CONTEXT_REFERENCE = "(The input text is the note provided above.)"
 
-async def format_content(content: str, title: Optional[str] = None) -> str:
-    """Formats note content using standard punctuation, using title for context."""
-    title_context = f"Note Title: {title}\n\n" if title else ""  # Add title if present
-    prompt = f"""You are an AI assistant. Your task is to reformat the following text for better readability and structure suitable for a *plain text editor*. Use the note title below for context if helpful. Use standard punctuation, symbols, and layout techniques like:
+
+def _note_context(prompt: str, content: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    For long notes, moves the note text out of the prompt into a separate context
+    that Gemini caches model-side and reuses across actions on the same content
+    (see gemini_context_cache). Returns the prompt and the context, if any.
+    """
+    if (
+        not settings.AI_CONTEXT_CACHE_ENABLED
+        or not content
+        or _approx_tokens(content) < settings.AI_CONTEXT_CACHE_MIN_TOKENS
+        or content not in prompt
+    ):
+        return prompt, None
+    return prompt.replace(content, NOTE_CONTEXT_REFERENCE, 1), content
+
+
+def _surrounding_context(before: str, after: str) -> str:
+    """Prompt block with the paragraphs around a section that is processed alone."""
+    if not before and not after:
+        return ""
+    return f"""**Surrounding Text (context only, do not include it in the output):**
+---
+{before}
+[... the input text goes here ...]
+{after}
+---
+
+"""
+
+
+# Shared by the /format prompt and the "format" step of run_pipeline
+_FORMAT_GOAL = "for better readability and structure suitable for a *plain text editor*"
+_FORMAT_LAYOUT = """Use standard punctuation, symbols, and layout techniques like:
 - Hyphens (-) or asterisks (*) for list items.
 - Indentation (using spaces) to show structure or hierarchy.
 - Blank lines to separate paragraphs or sections.
-- Consistent use of punctuation (periods, commas, etc.).
+- Consistent use of punctuation (periods, commas, etc.)."""
+_FORMAT_ORGANIZE = "Organize related ideas logically based on the title and content"
+
+
+def _build_format_prompt(
+    content: str, title: Optional[str] = None, context: str = ""
+) -> Tuple[str, GenerationConfig]:
+    """Builds the /format prompt and its generation config."""
+    title_context = f"Note Title: {title}\n\n" if title else ""  # Add title if present
+    prompt = f"""You are an AI assistant. Your task is to reformat the following text {_FORMAT_GOAL}. Use the note title below for context if helpful. {_FORMAT_LAYOUT}
 
 **Constraints:**
-- Organize related ideas logically based on the title and content.
+- {_FORMAT_ORGANIZE}.
 - Do *not* change the core meaning or add new information.
 - Respond *only* in the *same language* as the input text.
 - Output *only* the formatted text, without any preamble or explanation.
 - **Strictly avoid** Markdown formatting (like ##, **, _, ```).
 
-{title_context}**Input Text:**
+{title_context}{context}**Input Text:**
 ---
 {content}
 ---
 
 **Formatted Output:**"""
-    config = GenerationConfig(temperature=0.3)
-    return await _call_gemini_api(prompt, generation_config=config)
+    return prompt, GenerationConfig(temperature=0.3)
+
+
+async def _rewrite_changed_paragraphs(
+    operation: str, content: str, title: Optional[str]
+) -> Optional[str]:
+    """
+    Incremental pass for long notes: paragraphs that are remembered outputs of an
+    earlier run are kept verbatim, and each run of changed paragraphs is sent
+    alone (with its neighbours as context) and spliced back in place.
+
+    Returns None when no paragraph is known yet, so the caller does a full pass.
+    """
+    paragraphs = _split_paragraphs(content)
+    known = await paragraph_index.known(
+        operation, model_router.models_key(), paragraphs
+    )
+    if not any(known):
+        return None
+    if all(known):
+        return content.strip()
+
+    runs: List[Tuple[int, int]] = []
+    for i, is_known in enumerate(known):
+        if is_known:
+            continue
+        if runs and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i, i + 1))
+
+    logger.info(
+        f"Incremental '{operation}': {len(runs)} changed sections, "
+        f"{sum(known)}/{len(paragraphs)} paragraphs unchanged"
+    )
+    return await _run_sections(
+        operation,
+        paragraphs,
+        runs,
+        _INCREMENTAL_PROMPT_BUILDERS[operation],
+        title,
+        use_cache=True,
+    )
+
+
+async def _run_sections(
+    operation: str,
+    paragraphs: List[str],
+    runs: List[Tuple[int, int]],
+    build_prompt: Callable[..., Tuple[str, GenerationConfig]],
+    title: Optional[str],
+    use_cache: bool,
+    **key_params: Any,
+) -> str:
+    """
+    Sends each [start, end) run of paragraphs alone, with its neighbours as
+    context, and splices the outputs back in place between the other paragraphs.
+    build_prompt(section, title, context=...) builds a section's prompt;
+    key_params are any further inputs it depends on (style, ...).
+    """
+    neighbours = settings.AI_INCREMENTAL_CONTEXT_PARAGRAPHS
+
+    async def rewrite(start: int, end: int) -> str:
+        section = "\n\n".join(paragraphs[start:end])
+        before = "\n\n".join(paragraphs[max(start - neighbours, 0) : start])
+        after = "\n\n".join(paragraphs[end : end + neighbours])
+        prompt, config = build_prompt(
+            section, title, context=_surrounding_context(before, after)
+        )
+        return await _generate_cached(
+            f"{operation}_section",
+            prompt,
+            config,
+            use_cache=use_cache,
+            content=section,
+            before=before,
+            after=after,
+            title=title,
+            **key_params,
+        )
+
+    outputs = await asyncio.gather(*(rewrite(start, end) for start, end in runs))
+
+    pieces: List[str] = []
+    position = 0
+    for (start, end), output in zip(runs, outputs):
+        pieces.extend(paragraphs[position:start])
+        pieces.append(output.strip())
+        position = end
+    pieces.extend(paragraphs[position:])
+    return "\n\n".join(piece for piece in pieces if piece)
+
+
+def _fits_one_response(content: str) -> bool:
+    """Whether a full rewrite of content fits in AI_MAX_OUTPUT_TOKENS."""
+    return _approx_tokens(content) <= rewrite_input_limit()
+
+
+async def _rewrite_in_sections(
+    operation: str,
+    content: str,
+    build_prompt: Callable[..., Tuple[str, GenerationConfig]],
+    title: Optional[str],
+    use_cache: bool,
+    **key_params: Any,
+) -> str:
+    """
+    Rewrites a note too long for one response as consecutive sections of whole
+    paragraphs (see _run_sections), each well under the output cap. Sections
+    are cut deterministically, so unchanged ones hit the cache on the next run.
+    """
+    max_tokens = rewrite_input_limit() // 2
+    paragraphs = _paragraph_pieces(content, max_tokens)
+    runs: List[Tuple[int, int]] = []
+    section_tokens = 0
+    for i, paragraph in enumerate(paragraphs):
+        paragraph_tokens = _approx_tokens(paragraph)
+        if runs and section_tokens + paragraph_tokens <= max_tokens:
+            runs[-1] = (runs[-1][0], i + 1)
+            section_tokens += paragraph_tokens
+        else:
+            runs.append((i, i + 1))
+            section_tokens = paragraph_tokens
+    logger.info(f"Rewriting '{operation}' in {len(runs)} sections")
+    return await _run_sections(
+        operation, paragraphs, runs, build_prompt, title, use_cache, **key_params
+    )
+
+
+# Operations that can answer with span edits instead of the whole text
+_PATCH_OPERATIONS = ("cleanup", "polish")
+
+patch_stats = {"applied": 0, "fallbacks": 0, "edits": 0}
+
+
+def _build_patch_prompt(
+    operation: str, content: str, title: Optional[str] = None
+) -> Tuple[str, GenerationConfig]:
+    """Asks for an operation's changes as a JSON list of find/replace edits."""
+    instruction, temperature = _PIPELINE_STEPS[operation]
+    title_context = f"Note Title: {title}\n\n" if title else ""
+    prompt = f"""You are an AI assistant. {instruction} Use the note title for context.
+
+Do *not* rewrite the text. Instead, return *only* a JSON array of edits, one object per change, in the order they appear in the text:
+[{{"find": "<exact original passage>", "replace": "<new passage>"}}]
+
+**Constraints:**
+- "find" must be copied *exactly* from the input text and occur in it only once; include a few surrounding words if needed to make it unique.
+- Keep each edit as short as possible and never let two edits overlap.
+- Do *not* change the core meaning.
+- Respond in the *same language* as the input text.
+- Return an empty array if nothing needs to change.
+
+{title_context}**Input Text:**
+---
+{content}
+---"""
+    return prompt, GenerationConfig(
+        temperature=temperature, response_mime_type="application/json"
+    )
+
+
+def _apply_patch(content: str, patch: str) -> Optional[str]:
+    """
+    Applies a JSON list of find/replace edits to content. Returns None unless
+    every edit matches exactly one place and no two edits overlap.
+    """
+    try:
+        edits = json.loads(patch)
+    except ValueError:
+        return None
+    if isinstance(edits, dict):
+        edits = edits.get("edits")
+    if not isinstance(edits, list):
+        return None
+
+    spans: List[Tuple[int, int, str]] = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            return None
+        find, replace = edit.get("find"), edit.get("replace")
+        if not isinstance(find, str) or not find or not isinstance(replace, str):
+            return None
+        start = content.find(find)
+        if start < 0 or content.find(find, start + 1) >= 0:
+            return None
+        spans.append((start, start + len(find), replace))
+
+    spans.sort()
+    pieces: List[str] = []
+    position = 0
+    for start, end, replace in spans:
+        if start < position:
+            return None
+        pieces.append(content[position:start])
+        pieces.append(replace)
+        position = end
+    pieces.append(content[position:])
+    patch_stats["edits"] += len(spans)
+    return "".join(pieces)
+
+
+def _patch_mode_applies(operation: str, content: str) -> bool:
+    return (
+        settings.AI_PATCH_MODE_ENABLED
+        and operation in _PATCH_OPERATIONS
+        and _approx_tokens(content) >= settings.AI_PATCH_MIN_TOKENS
+    )
+
+
+async def _generate_patched(
+    operation: str, content: str, title: Optional[str], use_cache: bool
+) -> Optional[str]:
+    """
+    Patch mode: the model returns only span edits, which are applied locally.
+    Output tokens then scale with the number of changes instead of the note
+    length. Returns None when the edits do not apply cleanly, so the caller
+    falls back to a full rewrite.
+    """
+    prompt, config = _build_patch_prompt(operation, content, title)
+    prompt, context = _note_context(prompt, content)
+    applied: Dict[str, Optional[str]] = {}
+
+    def applies(patch: str) -> bool:
+        # Only edits that apply are cached; a bad answer is asked for again
+        applied[patch] = _apply_patch(content, patch)
+        return applied[patch] is not None
+
+    patch = await _generate_cached(
+        f"{operation}_patch",
+        prompt,
+        config,
+        use_cache=use_cache,
+        context=context,
+        cache_if=applies,
+        content=content,
+        title=title,
+    )
+    result = applied[patch] if patch in applied else _apply_patch(content, patch)
+    if result is None:
+        patch_stats["fallbacks"] += 1
+        logger.warning(f"'{operation}' patch did not apply; rewriting the full text")
+        return None
+    patch_stats["applied"] += 1
+    return result
+
+
+async def _generate_incremental(
+    operation: str, content: str, title: Optional[str], use_cache: bool
+) -> str:
+    """
+    Runs format/cleanup incrementally when possible, else on the whole note
+    (as span edits in patch mode, falling back to a full rewrite, in sections
+    if the note is too long for one response).
+    """
+    result = None
+    if (
+        settings.AI_INCREMENTAL_ENABLED
+        and settings.AI_CACHE_ENABLED
+        and use_cache
+        and _approx_tokens(content) >= settings.AI_INCREMENTAL_MIN_TOKENS
+    ):
+        result = await _rewrite_changed_paragraphs(operation, content, title)
+    if result is None and _patch_mode_applies(operation, content):
+        result = await _generate_patched(operation, content, title, use_cache)
+    if result is None and not _fits_one_response(content):
+        result = await _rewrite_in_sections(
+            operation,
+            content,
+            _INCREMENTAL_PROMPT_BUILDERS[operation],
+            title,
+            use_cache,
+        )
+    if result is None:
+        prompt, config = _INCREMENTAL_PROMPT_BUILDERS[operation](content, title)
+        prompt, context = _note_context(prompt, content)
+        result = await _generate_cached(
+            operation,
+            prompt,
+            config,
+            use_cache=use_cache,
+            context=context,
+            content=content,
+            title=title,
+        )
+    if (
+        settings.AI_INCREMENTAL_ENABLED
+        and _approx_tokens(content) >= settings.AI_INCREMENTAL_MIN_TOKENS
+    ):
+        # The output's paragraphs count as done for the next run on this note
+        await paragraph_index.remember(
+            operation, model_router.models_key(), _split_paragraphs(result)
+        )
+    return result
+
+
+async def format_content(
+    content: str, title: Optional[str] = None, use_cache: bool = True
+) -> str:
+    """
+    Formats note content using standard punctuation, using title for context.
+
+    The mechanical part runs locally first (see local_format); text that is
+    then already well-formed is returned without calling the model, otherwise
+    the normalized text is sent. Long notes that were formatted before only have
+    their changed paragraphs resent (see _rewrite_changed_paragraphs).
+    """
+    content, done = local_formatter.prepare(content)
+    if done:
+        return content
+    return await _generate_incremental("format", content, title, use_cache)
+
+
+async def _yield_text(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _yield_result(result: Awaitable[str]) -> AsyncIterator[str]:
+    yield await result
+
+
+def stream_format_content(
+    content: str, title: Optional[str] = None, use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Streaming variant of format_content (including its local fast path)."""
+    content, done = local_formatter.prepare(content)
+    if done:
+        return _yield_text(content)
+    if not _fits_one_response(content):
+        # Sections are rewritten concurrently, so the result arrives in one piece
+        return _yield_result(_generate_incremental("format", content, title, use_cache))
+    prompt, config = _build_format_prompt(content, title)
+    return _stream_cached(
+        "format", prompt, config, use_cache=use_cache, content=content, title=title
+    )
 
 
-async def cleanup_content(content: str, title: Optional[str] = None) -> str:
-    """Cleans up text (grammar, spelling, redundancy), using title for context."""
+def _build_cleanup_prompt(
+    content: str, title: Optional[str] = None, context: str = ""
+) -> Tuple[str, GenerationConfig]:
+    """Builds the /cleanup prompt and its generation config."""
     title_context = f"Note Title: {title}\n\n" if title else ""
     prompt = f"""You are an AI assistant. Your task is to clean up the following text. Use the note title for context.
 - Correct spelling and grammar errors.
@@ -184,20 +827,40 @@ async def cleanup_content(content: str, title: Optional[str] = None) -> str:
 - Output *only* the cleaned-up text, without any preamble or explanation.
 - **Strictly avoid** Markdown formatting (like ##, **, _, ```).
 
-{title_context}**Input Text:**
+{title_context}{context}**Input Text:**
 ---
 {content}
 ---
 
 **Cleaned Up Output:**"""
-    config = GenerationConfig(temperature=0.5)
-    return await _call_gemini_api(prompt, generation_config=config)
+    return prompt, GenerationConfig(temperature=0.5)
 
 
-async def refine_content(
-    content: str, title: Optional[str] = None, style: Optional[str] = None
+async def cleanup_content(
+    content: str, title: Optional[str] = None, use_cache: bool = True
 ) -> str:
-    """Refines writing style, using title for context."""
+    """
+    Cleans up text (grammar, spelling, redundancy), using title for context.
+
+    Incremental on long notes, like format_content.
+    """
+    return await _generate_incremental("cleanup", content, title, use_cache)
+
+
+# Operations that support paragraph-level incremental runs
+_INCREMENTAL_PROMPT_BUILDERS = {
+    "format": _build_format_prompt,
+    "cleanup": _build_cleanup_prompt,
+}
+
+
+def _build_refine_prompt(
+    content: str,
+    title: Optional[str] = None,
+    context: str = "",
+    style: Optional[str] = None,
+) -> Tuple[str, GenerationConfig]:
+    """Builds the /refine prompt and its generation config."""
     title_context = f"Note Title: {title}\n\n" if title else ""
     style_instruction = (
         f"aiming for a '{style}' style (e.g., professional, casual, formal, engaging)"
@@ -215,24 +878,59 @@ async def refine_content(
 - Output *only* the refined text, without any preamble or explanation.
 - **Strictly avoid** Markdown formatting (like ##, **, _, ```).
 
-{title_context}**Input Text:**
+{title_context}{context}**Input Text:**
 ---
 {content}
 ---
 
 **Refined Output:**"""
-    config = GenerationConfig(temperature=0.7)
-    return await _call_gemini_api(prompt, generation_config=config)
+    return prompt, GenerationConfig(temperature=0.7)
 
 
-async def continue_writing(content: Optional[str], title: Optional[str] = None) -> str:
+async def refine_content(
+    content: str,
+    title: Optional[str] = None,
+    style: Optional[str] = None,
+    use_cache: bool = True,
+) -> str:
     """
-    Continues writing the note based on existing content and title using a structured prompt.
-    If content is empty, starts writing based solely on the title.
-    Ensures non-conversational output.
+    Refines writing style, using title for context. Notes too long for one
+    response are refined in sections (see _rewrite_in_sections).
+    """
+    if not _fits_one_response(content):
+        return await _rewrite_in_sections(
+            "refine",
+            content,
+            functools.partial(_build_refine_prompt, style=style),
+            title,
+            use_cache,
+            style=style,
+        )
+    prompt, config = _build_refine_prompt(content, title, style=style)
+    prompt, context = _note_context(prompt, content)
+    return await _generate_cached(
+        "refine",
+        prompt,
+        config,
+        use_cache=use_cache,
+        context=context,
+        content=content,
+        title=title,
+        style=style,
+    )
+
+
+def _build_continue_prompt(content: Optional[str], title: Optional[str] = None) -> str:
+    """
+    Builds the non-conversational continue-writing prompt. Only the last
+    AI_CONTINUE_CONTEXT_TOKENS of the note are included.
     """
     title_for_prompt = title if title is not None else ""
-    content_for_prompt = content if content is not None else ""
+    content_for_prompt = (
+        window_tail(content, settings.AI_CONTINUE_CONTEXT_TOKENS)
+        if content is not None
+        else ""
+    )
 
     # Construct the prompt using the structure we designed
     # MODIFIED PROMPT TO PREVENT QUESTIONS/CONVERSATION
@@ -255,14 +953,65 @@ Instructions:
 
 Please generate the continuation text now based on the provided information.
 """
+    return prompt
 
-    generated_text = await _call_gemini_api(prompt)
+
+async def continue_writing(content: Optional[str], title: Optional[str] = None) -> str:
+    """
+    Continues writing the note based on existing content and title using a structured prompt.
+    If content is empty, starts writing based solely on the title.
+    Ensures non-conversational output.
+    """
+    prompt, context = _note_context(_build_continue_prompt(content, title), content)
+
+    generated_text = await _call_gemini_api(
+        prompt, operation="continue", context=context
+    )
 
     return generated_text
 
 
-async def polish_content(content: str, title: Optional[str] = None) -> str:
-    """Polishes text subtly, using title for context."""
+def stream_continue_writing(
+    content: Optional[str], title: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Streaming variant of continue_writing."""
+    return _stream_gemini_api(
+        _build_continue_prompt(content, title), operation="continue"
+    )
+
+
+async def polish_content(
+    content: str, title: Optional[str] = None, use_cache: bool = True
+) -> str:
+    """
+    Polishes text subtly, using title for context. Long notes use patch mode
+    when enabled (see _generate_patched), else sections if needed.
+    """
+    if _patch_mode_applies("polish", content):
+        patched = await _generate_patched("polish", content, title, use_cache)
+        if patched is not None:
+            return patched
+    if not _fits_one_response(content):
+        return await _rewrite_in_sections(
+            "polish", content, _build_polish_prompt, title, use_cache
+        )
+    prompt, config = _build_polish_prompt(content, title)
+    prompt, context = _note_context(prompt, content)
+    return await _generate_cached(
+        "polish",
+        prompt,
+        config,
+        use_cache=use_cache,
+        context=context,
+        content=content,
+        title=title,
+    )
+
+
+def _build_polish_prompt(
+    content: str, title: Optional[str] = None, context: str = ""
+) -> Tuple[str, GenerationConfig]:
+    """Builds the /polish prompt and its generation config."""
     title_context = f"Note Title: {title}\n\n" if title else ""
     prompt = f"""You are an AI assistant. Your task is to review and gently polish the following text, using the title for context.
 - Improve the flow and readability.
@@ -277,27 +1026,143 @@ async def polish_content(content: str, title: Optional[str] = None) -> str:
 - Output *only* the polished text, without any preamble or explanation.
 - **Strictly avoid** Markdown formatting (like ##, **, _, ```).
 
-{title_context}**Input Text:**
+{title_context}{context}**Input Text:**
 ---
 {content}
 ---
 
 **Polished Output:**"""
-    config = GenerationConfig(temperature=0.4)
-    return await _call_gemini_api(prompt, generation_config=config)
+    return prompt, GenerationConfig(temperature=0.4)
+
+
+# Instruction and temperature of each operation when combined by run_pipeline
+_PIPELINE_STEPS: Dict[str, Tuple[str, float]] = {
+    "cleanup": (
+        "Clean up the text: correct spelling and grammar errors, remove redundant "
+        "words or phrases and improve clarity and conciseness.",
+        0.5,
+    ),
+    "format": (
+        f"Reformat the text {_FORMAT_GOAL}. "
+        f"{_FORMAT_ORGANIZE}. "
+        + _FORMAT_LAYOUT.replace("\n", "\n   "),  # Keep the list inside the step
+        0.3,
+    ),
+    "refine": (
+        "Refine the writing style: improve word choice and sentence flow, {style}.",
+        0.7,
+    ),
+    "polish": (
+        "Polish the text gently: improve flow and readability with only subtle, "
+        "necessary changes.",
+        0.4,
+    ),
+}
+
+
+def _build_pipeline_prompt(
+    content: str,
+    operations: List[str],
+    title: Optional[str],
+    style: Optional[str],
+    context: str = "",
+) -> Tuple[str, GenerationConfig]:
+    """Compiles an ordered list of operations into one combined prompt."""
+    title_context = f"Note Title: {title}\n\n" if title else ""
+    style_instruction = (
+        f"aiming for a '{style}' style" if style else "making it more fluent"
+    )
+    steps = "\n".join(
+        f"{i}. {_PIPELINE_STEPS[op][0].format(style=style_instruction)}"
+        for i, op in enumerate(operations, start=1)
+    )
+    prompt = f"""You are an AI assistant. Apply the following steps to the text, in order, each step working on the result of the previous one. Use the note title for context.
+{steps}
 
+**Constraints:**
+- Do *not* change the core meaning.
+- Respond *only* in the *same language* as the input text.
+- Output *only* the final text after the last step, without any preamble or explanation.
+- **Strictly avoid** Markdown formatting (like ##, **, _, ```).
 
-async def summarize_content(
-    content: str, title: Optional[str] = None, max_length: Optional[int] = 100
+{title_context}{context}**Input Text:**
+---
+{content}
+---
+
+**Final Output:**"""
+    # The most conservative step decides how much the model may improvise
+    temperature = min(_PIPELINE_STEPS[op][1] for op in operations)
+    return prompt, GenerationConfig(temperature=temperature)
+
+
+async def run_pipeline(
+    content: str,
+    operations: List[str],
+    title: Optional[str] = None,
+    style: Optional[str] = None,
+    use_cache: bool = True,
 ) -> str:
-    """Summarizes text, using title for topic focus."""
+    """
+    Applies several content operations (cleanup, format, refine, polish) in a
+    single model call (one per section for very long notes). A single
+    operation uses its regular function instead.
+    """
+    # Repeating a step back to back does not change the instruction
+    operations = [
+        op for i, op in enumerate(operations) if i == 0 or op != operations[i - 1]
+    ]
+    if operations == ["refine"]:
+        return await refine_content(content, title, style=style, use_cache=use_cache)
+    if len(operations) == 1:
+        single = {
+            "cleanup": cleanup_content,
+            "format": format_content,
+            "polish": polish_content,
+        }[operations[0]]
+        return await single(content, title, use_cache=use_cache)
+    if not _fits_one_response(content):
+        return await _rewrite_in_sections(
+            "pipeline",
+            content,
+            functools.partial(
+                _build_pipeline_prompt, operations=operations, style=style
+            ),
+            title,
+            use_cache,
+            operations=operations,
+            style=style,
+        )
+    prompt, config = _build_pipeline_prompt(content, operations, title, style)
+    prompt, context = _note_context(prompt, content)
+    return await _generate_cached(
+        "pipeline",
+        prompt,
+        config,
+        use_cache=use_cache,
+        context=context,
+        content=content,
+        title=title,
+        operations=operations,
+        style=style,
+    )
+
+
+def _summary_generation_config(max_length: Optional[int]) -> GenerationConfig:
+    estimated_max_tokens = int(max_length * 1.8) if max_length else 250
+    return GenerationConfig(temperature=0.5, max_output_tokens=estimated_max_tokens)
+
+
+def _build_summarize_prompt(
+    content: str, title: Optional[str] = None, max_length: Optional[int] = 100
+) -> Tuple[str, GenerationConfig]:
+    """Builds the summary prompt; output tokens are capped from max_length."""
     title_context = f"Note Title: {title}\n\n" if title else ""
     length_instruction = (
         f"Aim for a concise summary, ideally around {max_length} words."
         if max_length
         else "Provide a concise summary of the main points."
     )
-    estimated_max_tokens = int(max_length * 1.8) if max_length else 250
     prompt = f"""You are an AI assistant. Your task is to summarize the main points of the following text, considering the note title for the main topic. {length_instruction}
 
 **Constraints:**
@@ -312,12 +1177,165 @@ async def summarize_content(
 ---
 
 **Summary:**"""
-    config = GenerationConfig(temperature=0.5, max_output_tokens=estimated_max_tokens)
-    return await _call_gemini_api(prompt, generation_config=config)
+    return prompt, _summary_generation_config(max_length)
+
+
+def _split_paragraphs(content: str) -> List[str]:
+    """Splits text on blank lines, dropping empty paragraphs."""
+    return [p.strip() for p in re.split(r"\n\s*\n", content) if p.strip()]
+
+
+def _paragraph_pieces(content: str, max_tokens: int) -> List[str]:
+    """Paragraphs of content, with any paragraph above max_tokens cut on line ends."""
+    max_chars = max_tokens * 4
+    pieces: List[str] = []
+    for paragraph in _split_paragraphs(content):
+        if _approx_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        current = ""
+        for line in paragraph.splitlines(keepends=True):
+            if current and len(current) + len(line) > max_chars:
+                pieces.append(current.strip())
+                current = ""
+            current += line
+            while len(current) > max_chars:
+                pieces.append(current[:max_chars].strip())
+                current = current[max_chars:]
+        if current.strip():
+            pieces.append(current.strip())
+    return pieces
+
+
+def _is_chunk_boundary(paragraph: str) -> bool:
+    """Content-defined boundary marker (about one paragraph in four)."""
+    digest = hashlib.sha1(paragraph.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % 4 == 0
+
+
+def _split_summary_chunks(content: str, max_tokens: int) -> List[str]:
+    """
+    Packs paragraphs into chunks of at most max_tokens.
+
+    Once a chunk is half full it also closes after any paragraph that hashes to a
+    boundary marker. Boundaries therefore depend on content rather than offsets,
+    so editing one paragraph only reshapes the chunk it lands in and the other
+    chunk summaries stay cached.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in _paragraph_pieces(content, max_tokens):
+        paragraph_tokens = _approx_tokens(paragraph)
+        if current and current_tokens + paragraph_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+        if current_tokens >= max_tokens // 2 and _is_chunk_boundary(paragraph):
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+async def _summarize_chunk(
+    chunk: str, title: Optional[str], use_cache: bool, semaphore: asyncio.Semaphore
+) -> str:
+    async with semaphore:
+        prompt, config = _build_summarize_prompt(
+            chunk, title, settings.AI_SUMMARY_CHUNK_SUMMARY_WORDS
+        )
+        return await _generate_cached(
+            "summarize_chunk",
+            prompt,
+            config,
+            use_cache=use_cache,
+            content=chunk,
+            title=title,
+        )
+
+
+async def _condense_for_summary(
+    content: str, title: Optional[str], use_cache: bool
+) -> str:
+    """
+    Map phase of long-note summarization: replaces the content by its per-chunk
+    summaries (concurrently, capped by AI_SUMMARY_MAP_CONCURRENCY) until it fits
+    into a single summary prompt.
+    """
+    semaphore = asyncio.Semaphore(settings.AI_SUMMARY_MAP_CONCURRENCY)
+    while _approx_tokens(content) > settings.AI_SUMMARY_CHUNK_THRESHOLD_TOKENS:
+        chunks = _split_summary_chunks(content, settings.AI_SUMMARY_CHUNK_TOKENS)
+        if len(chunks) <= 1:
+            break
+        logger.info(f"Summarizing long note in {len(chunks)} chunks")
+        summaries = await asyncio.gather(
+            *(_summarize_chunk(chunk, title, use_cache, semaphore) for chunk in chunks)
+        )
+        condensed = "\n\n".join(summaries)
+        if len(condensed) >= len(content):
+            break  # Chunk summaries stopped shrinking the text
+        content = condensed
+    return content
+
+
+def _summary_prompt_source(
+    content: str, title: Optional[str], max_length: Optional[int], use_cache: bool
+) -> PromptSource:
+    """Direct prompt for normal notes, map-reduce prompt factory for long ones."""
+    if _approx_tokens(content) <= settings.AI_SUMMARY_CHUNK_THRESHOLD_TOKENS:
+        return _build_summarize_prompt(content, title, max_length)[0]
+
+    async def reduce_prompt() -> str:
+        condensed = await _condense_for_summary(content, title, use_cache)
+        return _build_summarize_prompt(condensed, title, max_length)[0]
+
+    return reduce_prompt
+
+
+async def summarize_content(
+    content: str,
+    title: Optional[str] = None,
+    max_length: Optional[int] = 100,
+    use_cache: bool = True,
+) -> str:
+    """
+    Summarizes text, using title for topic focus. Notes above
+    AI_SUMMARY_CHUNK_THRESHOLD_TOKENS are summarized chunk by chunk first.
+    """
+    return await _generate_cached(
+        "summarize",
+        _summary_prompt_source(content, title, max_length, use_cache),
+        _summary_generation_config(max_length),
+        use_cache=use_cache,
+        content=content,
+        title=title,
+        max_length=max_length,
+    )
+
+
+def stream_summarize_content(
+    content: str,
+    title: Optional[str] = None,
+    max_length: Optional[int] = 100,
+    use_cache: bool = True,
+) -> AsyncIterator[str]:
+    """Streaming variant of summarize_content (only the reduce step streams)."""
+    return _stream_cached(
+        "summarize",
+        _summary_prompt_source(content, title, max_length, use_cache),
+        _summary_generation_config(max_length),
+        use_cache=use_cache,
+        content=content,
+        title=title,
+        max_length=max_length,
+    )
 
 
 async def generate_tasks_from_title(
-    title: str, language_hint: Optional[str] = None
+    title: str, language_hint: Optional[str] = None, use_cache: bool = True
 ) -> List[str]:
     """
     Generates a list of relevant task titles based on a note title.
@@ -325,6 +1343,7 @@ async def generate_tasks_from_title(
     Args:
         title: The title of the note to generate tasks for.
         language_hint: Optional hint for the language (e.g., 'Vietnamese', 'English')
+        use_cache: Serve and fill the result cache (also filled by precompute).
 
     Returns:
         A list of generated task title strings. Returns empty list on failure.
@@ -358,8 +1377,14 @@ async def generate_tasks_from_title(
     )
 
     try:
-        # Assuming _call_gemini_api handles errors and returns the raw text output
-        generated_text = await _call_gemini_api(prompt, generation_config=config)
+        generated_text = await _generate_cached(
+            "tasks",
+            prompt,
+            config,
+            use_cache=use_cache,
+            title=title,
+            language_hint=language_hint,
+        )
 
         if (
             not generated_text
@@ -412,7 +1437,9 @@ async def summarize_task_list(tasks: List[str], title: Optional[str] = None) ->
     config = GenerationConfig(temperature=0.5)
     # Limit output tokens to make it more title-like if needed
     # config.max_output_tokens = 50
-    summary_title = await _call_gemini_api(prompt, generation_config=config)
+    summary_title = await _call_gemini_api(
+        prompt, generation_config=config, operation="tasks_summary"
+    )
 
     # Ensure it starts with "Summary: " for consistency, or add if missing
     if not summary_title.lower().startswith("summary:"):
@@ -457,7 +1484,9 @@ async def generate_more_tasks(
     config = GenerationConfig(temperature=0.7)
 
     try:
-        generated_text = await _call_gemini_api(prompt, generation_config=config)
+        generated_text = await _call_gemini_api(
+            prompt, generation_config=config, operation="tasks"
+        )
         if not generated_text:
             return []
         new_task_titles = [
@@ -474,3 +1503,233 @@ async def generate_more_tasks(
             f"Error generating more tasks for title '{title}': {e}", exc_info=True
         )
         return []
+
+
+# --- Batched Task Title Transformation ---
+
+# Per-item functions used when batching is off or an item is missing from a batch
+TASK_TITLE_FUNCTIONS = {
+    "cleanup": cleanup_content,
+    "refine": refine_content,
+    "polish": polish_content,
+}
+
+_TASK_BATCH_INSTRUCTIONS = {
+    "cleanup": "Clean up each task title: correct spelling and grammar, remove redundant words, keep it concise.",
+    "refine": "Refine the wording of each task title, {style_instruction}.",
+    "polish": "Gently polish each task title for clarity and flow. Make only subtle improvements.",
+}
+
+_TASK_BATCH_TEMPERATURES = {"cleanup": 0.5, "refine": 0.7, "polish": 0.4}
+
+
+def _chunk_task_items(
+    items: List[Tuple[int, str, str]], max_tokens: int
+) -> List[List[Tuple[int, str, str]]]:
+    """Splits (task_id, title, context) items into batches under the token budget."""
+    chunks: List[List[Tuple[int, str, str]]] = []
+    current: List[Tuple[int, str, str]] = []
+    current_tokens = 0
+    for item in items:
+        # id/key overhead of the JSON object plus the two strings
+        item_tokens = _approx_tokens(item[1]) + _approx_tokens(item[2]) + 10
+        if current and current_tokens + item_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += item_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _parse_task_batch_response(text: str) -> Dict[int, str]:
+    """Maps task ids to titles from the model's JSON array, skipping bad entries."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        logger.warning("Batched task response was not valid JSON.")
+        return {}
+    if isinstance(data, dict):
+        data = data.get("tasks", [])
+    results: Dict[int, str] = {}
+    if not isinstance(data, list):
+        return results
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        task_id, new_title = entry.get("id"), entry.get("title")
+        if (
+            isinstance(task_id, int)
+            and isinstance(new_title, str)
+            and new_title.strip()
+        ):
+            results[task_id] = new_title.strip()
+    return results
+
+
+async def _transform_task_batch(
+    operation: str,
+    items: List[Tuple[int, str, str]],
+    style: Optional[str] = None,
+) -> Dict[int, str]:
+    """Sends one JSON request for a batch of task titles."""
+    style_instruction = (
+        f"aiming for a '{style}' style"
+        if style
+        else "making it more expressive and fluent"
+    )
+    instruction = _TASK_BATCH_INSTRUCTIONS[operation].format(
+        style_instruction=style_instruction
+    )
+    tasks_json = json.dumps(
+        [
+            {"id": task_id, "title": title, "context": context}
+            for task_id, title, context in items
+        ],
+        ensure_ascii=False,
+    )
+    prompt = f"""You are an AI assistant. You receive a JSON array of task titles. Each task has an "id", a "title" and a "context" (the note or parent task it belongs to). {instruction}
+
+**Constraints:**
+- Do *not* change the core meaning of any title.
+- Respond *only* in the *same language* as each input title.
+- Return *only* a JSON array of objects with the fields "id" (the unchanged input id) and "title" (the new title), one object per input task.
+- **Strictly avoid** Markdown formatting inside the titles.
+
+**Input Tasks:**
+{tasks_json}"""
+    config = GenerationConfig(
+        temperature=_TASK_BATCH_TEMPERATURES[operation],
+        response_mime_type="application/json",
+    )
+    generated_text = await _call_gemini_api(
+        prompt, generation_config=config, operation=f"tasks_{operation}"
+    )
+    return _parse_task_batch_response(generated_text)
+
+
+async def transform_task_titles(
+    operation: str,
+    items: List[Tuple[int, str, str]],
+    style: Optional[str] = None,
+    use_cache: bool = True,
+) -> Dict[int, str]:
+    """
+    Applies cleanup/refine/polish to many task titles with as few calls as possible.
+
+    Args:
+        operation: One of TASK_TITLE_FUNCTIONS.
+        items: (task_id, title, context_title) tuples.
+        style: Optional style for 'refine'.
+        use_cache: Passed on to the per-item fallback calls.
+
+    Returns:
+        Mapping of task id to transformed title for every item that succeeded.
+    """
+    results: Dict[int, str] = {}
+    chunks = _chunk_task_items(items, settings.AI_TASK_BATCH_MAX_TOKENS)
+    batch_results = await asyncio.gather(
+        *(_transform_task_batch(operation, chunk, style) for chunk in chunks),
+        return_exceptions=True,
+    )
+
+    fallback_items = []
+    for chunk, batch_result in zip(chunks, batch_results):
+        if isinstance(batch_result, Exception):
+            # The call itself failed; retrying item by item would only multiply load
+            logger.error(f"Batched '{operation}' call failed: {batch_result}")
+            continue
+        for item in chunk:
+            if item[0] in batch_result:
+                results[item[0]] = batch_result[item[0]]
+            else:
+                fallback_items.append(item)
+
+    if fallback_items:
+        logger.info(
+            f"Falling back to per-item '{operation}' for {len(fallback_items)} tasks."
+        )
+        ai_function = TASK_TITLE_FUNCTIONS[operation]
+        kwargs: Dict[str, Any] = {"use_cache": use_cache}
+        if operation == "refine":
+            kwargs["style"] = style
+        fallback_results = await asyncio.gather(
+            *(
+                ai_function(title, context, **kwargs)
+                for _, title, context in fallback_items
+            ),
+            return_exceptions=True,
+        )
+        for (task_id, _, _), fallback_result in zip(fallback_items, fallback_results):
+            if isinstance(fallback_result, Exception):
+                logger.error(
+                    f"Per-item '{operation}' failed for task {task_id}: {fallback_result}"
+                )
+            else:
+                results[task_id] = fallback_result
+
+    return results
+
+
+def _parse_digest_batch_response(text: str) -> Dict[int, str]:
+    """Maps user ids to digest texts from the model's JSON array, skipping bad entries."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        logger.warning("Batched digest response was not valid JSON.")
+        return {}
+    if isinstance(data, dict):
+        data = data.get("digests", [])
+    results: Dict[int, str] = {}
+    if not isinstance(data, list):
+        return results
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        user_id, digest = entry.get("user_id"), entry.get("digest")
+        if isinstance(user_id, int) and isinstance(digest, str) and digest.strip():
+            results[user_id] = digest.strip()
+    return results
+
+
+async def summarize_digest_batch(
+    items: List[Tuple[int, List[Tuple[str, str]]]],
+) -> Dict[int, str]:
+    """
+    Writes the digests of several users in one JSON request.
+
+    Args:
+        items: (user_id, [(note_title, note_excerpt), ...]) per user.
+
+    Returns:
+        Mapping of user id to digest text for every user the model answered.
+        Goes through the result cache, so a batch re-run after a crash is free.
+    """
+    digests_json = json.dumps(
+        [
+            {
+                "user_id": user_id,
+                "notes": [
+                    {"title": title, "excerpt": excerpt} for title, excerpt in notes
+                ],
+            }
+            for user_id, notes in items
+        ],
+        ensure_ascii=False,
+    )
+    prompt = f"""You are an AI assistant writing short email digests. You receive a JSON array of users. Each user has a "user_id" and the "notes" they changed recently, each with a "title" and an "excerpt" of its content. For each user, write a digest of 2-5 sentences that recaps what those notes are about and points out open items.
+
+**Constraints:**
+- Write each digest *only* in the language of that user's notes.
+- Never mix content between users.
+- Return *only* a JSON array of objects with the fields "user_id" (the unchanged input id) and "digest" (plain text), one object per input user.
+- **Strictly avoid** Markdown formatting inside the digests.
+
+**Input Users:**
+{digests_json}"""
+    config = GenerationConfig(temperature=0.4, response_mime_type="application/json")
+    generated_text = await _generate_cached(
+        "digest", prompt, config, digests=digests_json
+    )
+    return _parse_digest_batch_response(generated_text)
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Deletes the lock only if it still holds our token
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight AI requests.
+
+    Within a process, callers with the same key await one shared task. Across
+    workers, the first caller takes a short Redis lock and publishes its result
+    under a short-lived key; callers on other workers poll that key instead of
+    calling Gemini themselves.
+    """
+
+    def __init__(self, prefix: str = "ai:inflight:"):
+        self.prefix = prefix
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._release = redis_client.redis_client.register_script(_RELEASE_SCRIPT)
+        self.leaders = 0
+        self.local_joins = 0
+        self.remote_joins = 0
+
+    def make_key(self, **params: Any) -> str:
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        """Returns fn()'s result, sharing it with concurrent callers of the same key."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run_distributed(key, fn))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        else:
+            self.local_joins += 1
+        # Shielded so one caller disconnecting does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
+
+    def _try_lock(self, lock_key: str, token: str) -> bool:
+        return bool(
+            redis_client.redis_client.set(
+                lock_key, token, nx=True, px=settings.AI_SINGLEFLIGHT_LOCK_MS
+            )
+        )
+
+    def _publish(self, lock_key: str, result_key: str, token: str, result: str):
+        pipe = redis_client.redis_client.pipeline()
+        pipe.set(
+            result_key,
+            json.dumps({"text": result}),
+            px=settings.AI_SINGLEFLIGHT_RESULT_MS,
+        )
+        pipe.execute()
+        self._release(keys=[lock_key], args=[token])
+
+    def _poll(self, lock_key: str, result_key: str) -> tuple:
+        pipe = redis_client.redis_client.pipeline()
+        pipe.get(result_key)
+        pipe.exists(lock_key)
+        return tuple(pipe.execute())
+
+    async def _run_distributed(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        lock_key = f"{self.prefix}lock:{key}"
+        result_key = f"{self.prefix}result:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.AI_SINGLEFLIGHT_LOCK_MS / 1000
+
+        while True:
+            try:
+                is_leader = await asyncio.to_thread(self._try_lock, lock_key, token)
+            except Exception as e:
+                logger.warning(f"Single-flight Redis unavailable: {e}")
+                self.leaders += 1
+                return await fn()
+
+            if is_leader:
+                self.leaders += 1
+                try:
+                    result = await fn()
+                except BaseException:
+                    try:
+                        await asyncio.to_thread(
+                            self._release, keys=[lock_key], args=[token]
+                        )
+                    except Exception:
+                        pass  # The lock expires after AI_SINGLEFLIGHT_LOCK_MS
+                    raise
+                try:
+                    await asyncio.to_thread(
+                        self._publish, lock_key, result_key, token, result
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to publish single-flight result: {e}")
+                return result
+
+            # Another worker is generating the same prompt; wait for its result
+            while time.monotonic() < deadline:
+                await asyncio.sleep(settings.AI_SINGLEFLIGHT_POLL_MS / 1000)
+                try:
+                    raw, locked = await asyncio.to_thread(
+                        self._poll, lock_key, result_key
+                    )
+                except Exception:
+                    break
+                if raw is not None:
+                    self.remote_joins += 1
+                    return json.loads(raw)["text"]
+                if not locked:
+                    break  # Leader failed or its lock expired: try to lead
+            if time.monotonic() >= deadline:
+                self.leaders += 1
+                return await fn()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "local_joins": self.local_joins,
+            "remote_joins": self.remote_joins,
+        }
+
+
+# Create a singleton instance
+single_flight = SingleFlight()
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import List, Optional
+
+from app.core.config import settings
+from app.crud.v1 import ai_usage as ai_usage_crud
+from app.db import session
+from app.models.base import utc_now
+from app.schemas.ai_usage import AiUsageOperation, AiUsageRollup, AiUsageTotals
+from app.services.ai_limiter import current_ai_user_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TokenUsage:
+    """Token counts of the upstream requests made for one AI call."""
+
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    requests: int = 0
+
+    def add(self, prompt_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.output_tokens += output_tokens or 0
+
+
+class AiUsageLedger:
+    """
+    Write-behind ledger of AI calls per user and operation.
+
+    record() only appends to an in-memory buffer; a background task
+    (run_flusher) writes the buffer with one multi-row insert every
+    AI_USAGE_FLUSH_INTERVAL_SECONDS, or sooner once AI_USAGE_FLUSH_BATCH_SIZE
+    rows are waiting. If the database stays unavailable the buffer is capped
+    at AI_USAGE_BUFFER_MAX rows and the oldest records are dropped.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int, max_buffer: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer: List[dict] = []
+        self._flush_requested = asyncio.Event()
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_failures = 0
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        cache_status: str,
+        latency_seconds: float,
+        usage: Optional[TokenUsage] = None,
+        success: bool = True,
+    ) -> None:
+        if not settings.AI_USAGE_LEDGER_ENABLED:
+            return
+        now = utc_now()
+        self._buffer.append(
+            {
+                "user_id": current_ai_user_id.get(),
+                "operation": operation,
+                "model": model,
+                "cache_status": cache_status,
+                "success": success,
+                "prompt_tokens": usage.prompt_tokens if usage else 0,
+                "output_tokens": usage.output_tokens if usage else 0,
+                "latency_ms": round(latency_seconds * 1000, 3),
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        self.recorded += 1
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+        if len(self._buffer) >= self.batch_size:
+            self._flush_requested.set()
+
+    def _write(self, rows: List[dict]) -> None:
+        with next(session.get_session()) as db:
+            ai_usage_crud.create_usage_records(rows, db)
+
+    async def flush(self) -> int:
+        """Writes all buffered records; on failure they are put back for the next run."""
+        if not self._buffer:
+            return 0
+        rows, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self.flush_failures += 1
+            logger.error(f"Failed to flush {len(rows)} AI usage records: {e}")
+            self._buffer[:0] = rows
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            return 0
+        self.flushed += len(rows)
+        return len(rows)
+
+    async def run_flusher(self) -> None:
+        """Background loop started with the app (and the job worker)."""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self._flush_requested.wait(), self.flush_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_requested.clear()
+                await self.flush()
+        finally:
+            # Shutting down: write what is left
+            await asyncio.shield(self.flush())
+
+    def rollup(self, user_id: int, days: Optional[int], db) -> AiUsageRollup:
+        since = utc_now() - timedelta(days=days) if days else None
+        rows = ai_usage_crud.get_usage_rollup(user_id, since, db)
+        by_operation = [
+            AiUsageOperation(
+                operation=row.operation,
+                calls=row.calls,
+                cache_hits=row.cache_hits or 0,
+                coalesced=row.coalesced or 0,
+                errors=row.errors or 0,
+                prompt_tokens=row.prompt_tokens,
+                output_tokens=row.output_tokens,
+                avg_latency_ms=round(float(row.avg_latency_ms), 3),
+            )
+            for row in rows
+        ]
+        totals = AiUsageTotals()
+        for entry in by_operation:
+            totals.calls += entry.calls
+            totals.cache_hits += entry.cache_hits
+            totals.coalesced += entry.coalesced
+            totals.errors += entry.errors
+            totals.prompt_tokens += entry.prompt_tokens
+            totals.output_tokens += entry.output_tokens
+            totals.avg_latency_ms += entry.avg_latency_ms * entry.calls
+        if totals.calls:
+            totals.avg_latency_ms = round(totals.avg_latency_ms / totals.calls, 3)
+        return AiUsageRollup(
+            user_id=user_id, since=since, totals=totals, by_operation=by_operation
+        )
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flush_failures": self.flush_failures,
+        }
+
+
+# Create a singleton instance
+usage_ledger = AiUsageLedger(
+    flush_interval=settings.AI_USAGE_FLUSH_INTERVAL_SECONDS,
+    batch_size=settings.AI_USAGE_FLUSH_BATCH_SIZE,
+    max_buffer=settings.AI_USAGE_BUFFER_MAX,
+)
@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import smtplib
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.crud import v1
+from app.db import session
+from app.services import ai_service, email_service
+from app.services.ai_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Extend or release the run lock only while this run still holds it
+_EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+@dataclass
+class DigestUser:
+    user_id: int
+    email: str
+    full_name: str
+    notes: List[Tuple[str, str]] = field(default_factory=list)  # (title, excerpt)
+
+    def tokens(self) -> int:
+        # Titles and excerpts plus the JSON keys around them
+        return sum(count_tokens(t) + count_tokens(e) + 10 for t, e in self.notes)
+
+
+def _excerpt(content: Optional[str], max_tokens: int) -> str:
+    """The first words of a note's content, up to about max_tokens."""
+    words: List[str] = []
+    used = 0
+    for word in (content or "").split():
+        used += count_tokens(word)
+        if used > max_tokens:
+            words.append("…")
+            break
+        words.append(word)
+    return " ".join(words)
+
+
+class DigestPipeline:
+    """
+    Emails each user (with email notifications on) a digest of the notes they
+    changed in the last period (AI_DIGEST_PERIOD_HOURS, daily by default).
+
+    A run loads all changed notes with one range query over the
+    (updated_at, user_id) index, packs several users into each summarization
+    call (up to AI_DIGEST_USERS_PER_CALL users / AI_DIGEST_BATCH_MAX_TOKENS),
+    runs at most AI_DIGEST_CONCURRENCY of those calls at a time, and sends the
+    mails over one reused SMTP connection. Users the model did not answer for
+    get a plain list of their changed notes instead of a per-user retry.
+
+    Users are handled in id order and the last one sent is checkpointed in
+    Redis, so a run interrupted by a crash or restart continues after that
+    user. A Redis lock keeps one run going across all app workers.
+    """
+
+    def __init__(
+        self,
+        period_hours: int,
+        users_per_call: int,
+        max_batch_tokens: int,
+        concurrency: int,
+        lock_seconds: int,
+    ):
+        self.period = timedelta(hours=period_hours)
+        self.users_per_call = users_per_call
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.lock_seconds = lock_seconds
+        self.prefix = "digest:"
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._extend_lock = redis_client.redis_client.register_script(_EXTEND_SCRIPT)
+        self._release_lock = redis_client.redis_client.register_script(
+            _RELEASE_SCRIPT
+        )
+        self.runs = 0
+        self.resumed = 0
+        self.ai_calls = 0
+        self.fallbacks = 0
+        self.emails_sent = 0
+        self.emails_failed = 0
+        self.smtp_connections = 0
+
+    def _window(self, now: datetime) -> Tuple[int, datetime, datetime]:
+        """The id and [since, until) bounds of the last complete period."""
+        period_seconds = int(self.period.total_seconds())
+        run_id = int(now.timestamp()) // period_seconds
+        until = datetime.fromtimestamp(run_id * period_seconds, tz=timezone.utc)
+        return run_id, until - self.period, until
+
+    # --- Redis state ---
+
+    def _acquire(self, token: str) -> bool:
+        return bool(
+            redis_client.redis_client.set(
+                f"{self.prefix}lock", token, nx=True, ex=self.lock_seconds
+            )
+        )
+
+    def _extend(self, token: str) -> None:
+        extended = self._extend_lock(
+            keys=[f"{self.prefix}lock"], args=[token, self.lock_seconds * 1000]
+        )
+        if not extended:
+            # The lock expired and another worker may have taken over the run
+            raise RuntimeError("Lost the digest lock")
+
+    def _release(self, token: str) -> None:
+        self._release_lock(keys=[f"{self.prefix}lock"], args=[token])
+
+    def _is_done(self, run_id: int) -> bool:
+        return bool(redis_client.redis_client.exists(f"{self.prefix}{run_id}:done"))
+
+    def _mark_done(self, run_id: int) -> None:
+        ttl = int(self.period.total_seconds()) * 2
+        redis_client.redis_client.set(f"{self.prefix}{run_id}:done", 1, ex=ttl)
+        redis_client.redis_client.delete(f"{self.prefix}{run_id}:checkpoint")
+
+    def _checkpoint(self, run_id: int) -> int:
+        value = redis_client.redis_client.get(f"{self.prefix}{run_id}:checkpoint")
+        return int(value) if value is not None else 0
+
+    def _save_checkpoint(self, run_id: int, user_id: int) -> None:
+        ttl = int(self.period.total_seconds()) * 2
+        redis_client.redis_client.set(
+            f"{self.prefix}{run_id}:checkpoint", user_id, ex=ttl
+        )
+
+    # --- Steps ---
+
+    def _load_users(
+        self, since: datetime, until: datetime, after_user_id: int
+    ) -> List[DigestUser]:
+        with next(session.get_session()) as db:
+            rows = v1.note.get_changed_notes_for_digest(
+                since, until, after_user_id, db
+            )
+        users: List[DigestUser] = []
+        for row in rows:
+            if not users or users[-1].user_id != row.user_id:
+                users.append(DigestUser(row.user_id, row.email, row.full_name))
+            user = users[-1]
+            if len(user.notes) < settings.AI_DIGEST_MAX_NOTES_PER_USER:
+                excerpt = _excerpt(row.content, settings.AI_DIGEST_NOTE_EXCERPT_TOKENS)
+                user.notes.append((row.title, excerpt))
+        return users
+
+    def _pack(self, users: List[DigestUser]) -> List[List[DigestUser]]:
+        """Groups consecutive users into summarization calls under both limits."""
+        batches: List[List[DigestUser]] = []
+        current: List[DigestUser] = []
+        current_tokens = 0
+        for user in users:
+            user_tokens = user.tokens()
+            if current and (
+                len(current) >= self.users_per_call
+                or current_tokens + user_tokens > self.max_batch_tokens
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(user)
+            current_tokens += user_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _summarize(self, batch: List[DigestUser]) -> Dict[int, str]:
+        self.ai_calls += 1
+        try:
+            return await ai_service.summarize_digest_batch(
+                [(user.user_id, user.notes) for user in batch]
+            )
+        except Exception as e:
+            logger.error(f"Digest summarization failed for {len(batch)} users: {e}")
+            return {}
+
+    def _compose(self, user: DigestUser, digest: Optional[str]) -> Tuple[str, str]:
+        days = self.period.days
+        span = f"in the last {days} days" if days > 1 else "in the last day"
+        lines = [f"Hi {user.full_name},", ""]
+        if digest:
+            lines += [digest, ""]
+        lines.append(f"Notes you changed {span}:")
+        lines += [f"- {title}" for title, _ in user.notes]
+        return "Your notes digest", "\n".join(lines)
+
+    def _send(self, to_email: str, subject: str, body: str) -> None:
+        """Sends over the run's SMTP connection, reconnecting once if it dropped."""
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = email_service.open_smtp_connection()
+                self.smtp_connections += 1
+            try:
+                email_service.send_email(self._smtp, to_email, subject, body)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def _deliver(self, run_id: int, user: DigestUser, digest: Optional[str]) -> None:
+        subject, body = self._compose(user, digest)
+        try:
+            self._send(user.email, subject, body)
+            self.emails_sent += 1
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+            # A bad address should not block the run; other errors abort it
+            self.emails_failed += 1
+            logger.warning(f"Digest email to user {user.user_id} failed: {e}")
+        self._save_checkpoint(run_id, user.user_id)
+
+    def _close_smtp(self) -> None:
+        if self._smtp is not None:
+            email_service.close_smtp_connection(self._smtp)
+            self._smtp = None
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Runs (or resumes) the digest of the last complete period; returns its users."""
+        run_id, since, until = self._window(now or datetime.now(timezone.utc))
+        token = uuid.uuid4().hex
+        if await asyncio.to_thread(self._is_done, run_id):
+            return 0
+        if not await asyncio.to_thread(self._acquire, token):
+            return 0  # Another worker is running it
+        try:
+            after_user_id = await asyncio.to_thread(self._checkpoint, run_id)
+            if after_user_id:
+                self.resumed += 1
+                logger.info(f"Resuming digest run {run_id} after user {after_user_id}")
+            users = await asyncio.to_thread(
+                self._load_users, since, until, after_user_id
+            )
+            self.runs += 1
+            batches = self._pack(users)
+            for start in range(0, len(batches), self.concurrency):
+                group = batches[start : start + self.concurrency]
+                results = await asyncio.gather(*(self._summarize(b) for b in group))
+                for batch, digests in zip(group, results):
+                    for user in batch:
+                        digest = digests.get(user.user_id)
+                        if digest is None:
+                            self.fallbacks += 1
+                        await asyncio.to_thread(self._deliver, run_id, user, digest)
+                await asyncio.to_thread(self._extend, token)
+            await asyncio.to_thread(self._mark_done, run_id)
+            logger.info(
+                f"Digest run {run_id}: {len(users)} users in {len(batches)} calls"
+            )
+            return len(users)
+        finally:
+            await asyncio.to_thread(self._close_smtp)
+            await asyncio.to_thread(self._release, token)
+
+    async def run_forever(self) -> None:
+        """Background loop started with the app; checks for a due run periodically."""
+        while True:
+            if settings.AI_DIGEST_ENABLED:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    logger.error(f"Digest run failed, will resume later: {e}")
+            await asyncio.sleep(settings.AI_DIGEST_CHECK_INTERVAL_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.AI_DIGEST_ENABLED,
+            "runs": self.runs,
+            "resumed": self.resumed,
+            "ai_calls": self.ai_calls,
+            "fallbacks": self.fallbacks,
+            "emails_sent": self.emails_sent,
+            "emails_failed": self.emails_failed,
+            "smtp_connections": self.smtp_connections,
+        }
+
+
+# Create a singleton instance
+digest_pipeline = DigestPipeline(
+    period_hours=settings.AI_DIGEST_PERIOD_HOURS,
+    users_per_call=settings.AI_DIGEST_USERS_PER_CALL,
+    max_batch_tokens=settings.AI_DIGEST_BATCH_MAX_TOKENS,
+    concurrency=settings.AI_DIGEST_CONCURRENCY,
+    lock_seconds=settings.AI_DIGEST_LOCK_SECONDS,
+)
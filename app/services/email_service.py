@@ -1,17 +1,50 @@
 import smtplib
+from contextlib import contextmanager
 from email.mime.text import MIMEText
+from typing import Iterator
 from app.core.config import settings
 
-def send_otp_email(to_email: str, otp: str, subject: str = "Your OTP Code"):
-    body = f"Your OTP code is: {otp}. It will expire in 5 minutes."
-    msg = MIMEText(body)
-    msg["Subject"] = subject
-    msg["From"] = settings.EMAIL_FROM
-    msg["To"] = to_email
 
-    with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT) as server:
+def open_smtp_connection() -> smtplib.SMTP:
+    """Connects and logs in to the SMTP server; the caller closes the connection."""
+    server = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT)
+    try:
         if getattr(settings, "SMTP_USE_TLS", False):
             server.starttls()
         if getattr(settings, "SMTP_USERNAME", None):
             server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
-        server.sendmail(settings.EMAIL_FROM, [to_email], msg.as_string())
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def close_smtp_connection(server: smtplib.SMTP) -> None:
+    try:
+        server.quit()
+    except smtplib.SMTPException:
+        server.close()
+
+
+@contextmanager
+def smtp_connection() -> Iterator[smtplib.SMTP]:
+    """One SMTP connection for sending several emails."""
+    server = open_smtp_connection()
+    try:
+        yield server
+    finally:
+        close_smtp_connection(server)
+
+
+def send_email(server: smtplib.SMTP, to_email: str, subject: str, body: str):
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = settings.EMAIL_FROM
+    msg["To"] = to_email
+    server.sendmail(settings.EMAIL_FROM, [to_email], msg.as_string())
+
+
+def send_otp_email(to_email: str, otp: str, subject: str = "Your OTP Code"):
+    body = f"Your OTP code is: {otp}. It will expire in 5 minutes."
+    with smtp_connection() as server:
+        send_email(server, to_email, subject, body)
@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from google.generativeai import caching
+
+from app.core.config import settings
+from app.services.ai_cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiContextCache:
+    """
+    Registry of Gemini cached contents holding the text of long notes.
+
+    A note's text is uploaded once as a model-side cached context and reused by
+    every action on that note (cleanup, format, polish, ...) until its content
+    hash changes or the entry expires, so follow-up calls only send the short
+    instructions. Entries are keyed by model and content hash, expire a little
+    before the server-side TTL, and the least recently used one is evicted (and
+    deleted upstream) once AI_CONTEXT_CACHE_MAX_ENTRIES is reached.
+
+    A failed upload is remembered for AI_CONTEXT_CACHE_FAILURE_TTL_SECONDS, and
+    the text is sent inline meanwhile instead of retrying the upload per call.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, failure_ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.failure_ttl_seconds = failure_ttl_seconds
+        # (model, content hash) -> (cached content name, local expiry)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = (
+            OrderedDict()
+        )
+        self._creating: Dict[Tuple[str, str], asyncio.Task] = {}
+        # (model, content hash) -> local expiry of a failed upload
+        self._failed: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.hits = 0
+        self.created = 0
+        self.create_failures = 0
+        self.skipped_failed = 0
+        self.evictions = 0
+
+    def _create(self, model_name: str, text: str) -> str:
+        cached = caching.CachedContent.create(
+            model=model_name,
+            display_name=f"note-{content_hash(text)[:16]}",
+            contents=[text],
+            ttl=datetime.timedelta(seconds=self.ttl_seconds),
+        )
+        return cached.name
+
+    def _delete(self, name: str) -> None:
+        try:
+            caching.CachedContent.get(name).delete()
+        except Exception as e:
+            # Expires upstream on its own after the TTL
+            logger.warning(f"Failed to delete Gemini cached content {name}: {e}")
+
+    def _evict(self, key: Tuple[str, str]) -> None:
+        name, _ = self._entries.pop(key)
+        self.evictions += 1
+        asyncio.get_running_loop().run_in_executor(None, self._delete, name)
+
+    async def get_or_create(self, model_name: str, text: str) -> Optional[str]:
+        """
+        Name of a cached content holding `text`, or None if it cannot be cached
+        (the caller then sends the text inline).
+        """
+        key = (model_name, content_hash(text))
+        entry = self._entries.get(key)
+        if entry is not None:
+            name, expires_at = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return name
+            self._entries.pop(key)
+
+        failed_until = self._failed.get(key)
+        if failed_until is not None:
+            if failed_until > time.monotonic():
+                self.skipped_failed += 1
+                return None
+            self._failed.pop(key)
+
+        # Concurrent actions on the same note share one upload
+        task = self._creating.get(key)
+        if task is None:
+            task = asyncio.create_task(asyncio.to_thread(self._create, model_name, text))
+            self._creating[key] = task
+            task.add_done_callback(lambda _: self._creating.pop(key, None))
+        try:
+            name = await asyncio.shield(task)
+        except Exception as e:
+            if key not in self._failed:
+                self.create_failures += 1
+                logger.warning(f"Failed to create Gemini cached context: {e}")
+                self._failed[key] = time.monotonic() + self.failure_ttl_seconds
+                while len(self._failed) > self.max_entries:
+                    self._failed.popitem(last=False)
+            return None
+
+        if key not in self._entries:
+            self.created += 1
+            # Stop handing the name out shortly before the server drops it
+            expires_at = time.monotonic() + self.ttl_seconds * 0.9
+            self._entries[key] = (name, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+        return name
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.AI_CONTEXT_CACHE_ENABLED,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "created": self.created,
+            "create_failures": self.create_failures,
+            "skipped_failed": self.skipped_failed,
+            "evictions": self.evictions,
+        }
+
+
+# Create a singleton instance
+context_cache = GeminiContextCache(
+    max_entries=settings.AI_CONTEXT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AI_CONTEXT_CACHE_TTL_SECONDS,
+    failure_ttl_seconds=settings.AI_CONTEXT_CACHE_FAILURE_TTL_SECONDS,
+)
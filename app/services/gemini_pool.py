@@ -0,0 +1,132 @@
+import dataclasses
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai.types import (
+    GenerationConfig,
+    HarmCategory,
+    HarmBlockThreshold,
+)
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Built once and shared by every pooled model instead of per call
+DEFAULT_SAFETY_SETTINGS: Dict[HarmCategory, HarmBlockThreshold] = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+}
+
+
+def config_key(generation_config: Optional[Any]) -> Tuple:
+    """Turns a GenerationConfig (dataclass or dict) into a hashable pool key."""
+    if generation_config is None:
+        return ()
+    if dataclasses.is_dataclass(generation_config):
+        items = dataclasses.asdict(generation_config).items()
+    else:
+        items = dict(generation_config).items()
+    return tuple(sorted((k, repr(v)) for k, v in items if v is not None))
+
+
+class GeminiModelPool:
+    """
+    Long-lived GenerativeModel instances keyed by model name and generation config.
+
+    Models are built with the default safety settings and their generation config
+    baked in, so a request only has to look one up. All models share the SDK's
+    default async client, which keeps a single persistent gRPC channel open.
+
+    Models bound to a cached context (one per note) are kept in their own,
+    separately bounded map, so they never evict the warmed shared models.
+    """
+
+    def __init__(self, max_size: int, max_cached_content_models: int):
+        self.max_size = max_size
+        self.max_cached_content_models = max_cached_content_models
+        self._models: "OrderedDict[Tuple, genai.GenerativeModel]" = OrderedDict()
+        self._cached_content_models: "OrderedDict[Tuple, genai.GenerativeModel]" = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.build_seconds = 0.0
+
+    def get(
+        self,
+        model_name: str,
+        generation_config: Optional[GenerationConfig] = None,
+        cached_content: Optional[str] = None,
+    ) -> genai.GenerativeModel:
+        """
+        Returns a pooled model, building (and caching) it on first use. With
+        cached_content the model is bound to that Gemini cached context.
+        """
+        if cached_content is None:
+            models, max_size = self._models, self.max_size
+            key = (model_name, config_key(generation_config))
+        else:
+            models, max_size = (
+                self._cached_content_models,
+                self.max_cached_content_models,
+            )
+            key = (model_name, config_key(generation_config), cached_content)
+        model = models.get(key)
+        if model is not None:
+            self.hits += 1
+            models.move_to_end(key)
+            return model
+
+        self.misses += 1
+        started = time.perf_counter()
+        if cached_content is not None:
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content,
+                generation_config=generation_config,
+                safety_settings=DEFAULT_SAFETY_SETTINGS,
+            )
+        else:
+            model = genai.GenerativeModel(
+                model_name,
+                generation_config=generation_config,
+                safety_settings=DEFAULT_SAFETY_SETTINGS,
+            )
+        self.build_seconds += time.perf_counter() - started
+        models[key] = model
+        if len(models) > max_size:
+            models.popitem(last=False)
+            self.evictions += 1
+        return model
+
+    def warm_up(self, model_name: str, configs: list) -> None:
+        """Pre-builds models for the given configs, typically at app startup."""
+        for config in configs:
+            self.get(model_name, config)
+        logger.info(f"Gemini model pool warmed with {len(self._models)} models")
+
+    def stats(self) -> dict:
+        avg_build_ms = self.build_seconds * 1000 / self.misses if self.misses else 0.0
+        return {
+            "size": len(self._models),
+            "max_size": self.max_size,
+            "cached_content_models": len(self._cached_content_models),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "avg_build_ms": round(avg_build_ms, 3),
+            "estimated_saved_ms": round(avg_build_ms * self.hits, 3),
+        }
+
+
+# Create a singleton instance
+model_pool = GeminiModelPool(
+    max_size=settings.GEMINI_MODEL_POOL_SIZE,
+    max_cached_content_models=settings.AI_CONTEXT_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,169 @@
+import re
+from typing import List
+
+from app.core.config import settings
+
+# Bullet markers people type or paste, normalized to "- "; the indent is kept
+_BULLET = re.compile(r"^([ ]*)(?:[*+•·▪◦‣]|-(?!-))[ ]+(?=\S)")
+_NUMBERED = re.compile(r"^([ ]*)(\d+)[.)][ ]+(?=\S)")
+_INDENT = "  "  # Per nesting level of a list item
+# Accidental Markdown: headings, word-bounded emphasis, code fences, rules.
+# Inline code is kept as written, and "__" is only unwrapped around several
+# words so identifiers like __init__ survive.
+_HEADING = re.compile(r"^[ \t]*#{1,6}[ \t]+", re.MULTILINE)
+_BOLD = re.compile(r"(?<![\w*])\*\*(?=[^\s*])(.+?)(?<=[^\s*])\*\*(?![\w*])")
+_UNDERSCORE_BOLD = re.compile(
+    r"(?<!\w)__(?=[^\s_])([^_\n]*?\s[^_\n]*?)(?<=[^\s_])__(?!\w)"
+)
+# Markers left after unwrapping may be emphasis or literal text; the model decides
+_AMBIGUOUS_EMPHASIS = re.compile(r"\*\*|(?<!\w)__\w+__(?!\w)")
+_INLINE_CODE = re.compile(r"(`[^`\n]+`)")
+_FENCE = re.compile(r"^[ \t]*```[^\n]*\n?", re.MULTILINE)
+_RULE = re.compile(r"^[ \t]*(?:-{3,}|\*{3,}|_{3,})[ \t]*$\n?", re.MULTILINE)
+_SPACE_RUN = re.compile(r"(?<=\S)[ \t]{2,}(?=\S)")
+# Only "," and ".": French typography puts a space before "! ? : ;"
+_SPACE_BEFORE_PUNCT = re.compile(r"(?<=\w)[ \t]+([,.])(?=\s|$)")
+_BLANK_RUN = re.compile(r"\n{3,}")
+
+# Lowercase letter right after a sentence end, or a space missing after one
+_LOWER_SENTENCE_START = re.compile(r"[.!?][ \t]+(\w)")
+_MISSING_SPACE = re.compile(r"[a-zà-ỹ][,.;!?][A-Za-zÀ-ỹ]")
+_TERMINAL = tuple(".!?:;…)\"'”’")
+
+
+def _outside_code(text: str) -> str:
+    """The text with inline code spans blanked out, for the well-formedness checks."""
+    return _INLINE_CODE.sub(lambda m: "X" * len(m.group(1)), text)
+
+
+def _clean_inline(text: str) -> str:
+    """Unwraps emphasis and tidies spacing, leaving inline code spans untouched."""
+    parts = _INLINE_CODE.split(text)
+    for i in range(0, len(parts), 2):  # Odd parts are code spans
+        part = _BOLD.sub(r"\1", parts[i])
+        part = _UNDERSCORE_BOLD.sub(r"\1", part)
+        part = _SPACE_RUN.sub(" ", part)
+        parts[i] = _SPACE_BEFORE_PUNCT.sub(r"\1", part)
+    return "".join(parts)
+
+
+def _normalize_lists(lines: List[str]) -> List[str]:
+    """
+    Rewrites list markers to "- " / "1. " and re-indents list items by their
+    nesting depth (_INDENT per level), whatever indent width they were typed with.
+    """
+    result = []
+    levels: List[int] = []  # Indents of the enclosing list items
+    for line in lines:
+        bullet = _BULLET.match(line)
+        numbered = None if bullet else _NUMBERED.match(line)
+        match = bullet or numbered
+        if not match:
+            if line and not line.startswith(" "):
+                levels = []  # A top-level paragraph ends the list
+            result.append(line)
+            continue
+        indent = len(match.group(1))
+        while levels and levels[-1] > indent:
+            levels.pop()
+        if not levels or levels[-1] < indent:
+            levels.append(indent)
+        marker = "- " if bullet else f"{numbered.group(2)}. "
+        result.append(_INDENT * (len(levels) - 1) + marker + line[match.end() :])
+    return result
+
+
+def normalize(text: str) -> str:
+    """
+    Applies the mechanical part of /format locally: bullet and list markers
+    (keeping their nesting), stray Markdown, trailing and repeated spaces,
+    spaces before punctuation, tabs and runs of blank lines. Deterministic and
+    meaning-preserving.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\t", "    ")
+    text = _FENCE.sub("", text)
+    text = _RULE.sub("", text)
+    text = _HEADING.sub("", text)
+    lines = _normalize_lists([line.rstrip() for line in text.split("\n")])
+    text = "\n".join(_clean_inline(line) for line in lines)
+    text = _BLANK_RUN.sub("\n\n", text)
+    return text.strip("\n").rstrip()
+
+
+def _line_is_well_formed(line: str) -> bool:
+    line = line.lstrip(" ")
+    body = line
+    if line.startswith("- "):
+        body = line[2:]
+    else:
+        numbered = re.match(r"\d+\. ", line)
+        if numbered:
+            body = line[numbered.end() :]
+    if not body:
+        return False
+    first = body[0]
+    if first.isalpha() and not first.isupper():
+        return False
+    # List items may omit the final period; prose lines may not
+    if body is line and not line.endswith(_TERMINAL):
+        return False
+    return True
+
+
+def is_well_formed(text: str) -> bool:
+    """
+    Heuristic check that normalized text needs no model pass: every prose line
+    is a capitalized, punctuated sentence, list items are capitalized, no
+    sentence starts in lowercase or misses the space after punctuation, and no
+    emphasis markers are left that could also be literal text.
+    """
+    if not text:
+        return True
+    text = _outside_code(text)
+    if _AMBIGUOUS_EMPHASIS.search(text):
+        return False
+    for match in _LOWER_SENTENCE_START.finditer(text):
+        if match.group(1).islower():
+            return False
+    if _MISSING_SPACE.search(text):
+        return False
+    return all(_line_is_well_formed(line) for line in text.split("\n") if line)
+
+
+class LocalFormatter:
+    """Counts how often the local pass answers /format without the model."""
+
+    def __init__(self):
+        self.requests = 0
+        self.fast_path = 0
+        self.chars_saved = 0
+
+    def prepare(self, content: str) -> tuple[str, bool]:
+        """
+        Returns the normalized content and whether it is already well-formed
+        (so the caller can skip the model).
+        """
+        if not settings.AI_FORMAT_FAST_PATH_ENABLED:
+            return content, False
+        self.requests += 1
+        normalized = normalize(content)
+        self.chars_saved += max(len(content) - len(normalized), 0)
+        if is_well_formed(normalized):
+            self.fast_path += 1
+            return normalized, True
+        return normalized, False
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.AI_FORMAT_FAST_PATH_ENABLED,
+            "requests": self.requests,
+            "fast_path": self.fast_path,
+            "fast_path_rate": (
+                round(self.fast_path / self.requests, 4) if self.requests else 0.0
+            ),
+            "chars_saved": self.chars_saved,
+        }
+
+
+# Create a singleton instance
+local_formatter = LocalFormatter()
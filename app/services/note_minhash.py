@@ -0,0 +1,75 @@
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+_WORD = re.compile(r"\w+")
+_PRIME = 4294967291  # Largest prime below 2**32, so values fit in uint32
+_SHINGLE_WORDS = 3
+
+# Fixed seed: signatures are stored, so the permutations must never change
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2**31, size=settings.NOTE_MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2**31, size=settings.NOTE_MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _shingles(title: Optional[str], content: Optional[str]) -> List[str]:
+    """Overlapping word 3-grams of the note's text (whole words for short notes)."""
+    words = _WORD.findall(f"{title or ''} {content or ''}".lower())
+    if len(words) < _SHINGLE_WORDS:
+        return words
+    return [
+        " ".join(words[i : i + _SHINGLE_WORDS])
+        for i in range(len(words) - _SHINGLE_WORDS + 1)
+    ]
+
+
+def signature(title: Optional[str], content: Optional[str]) -> Optional[np.ndarray]:
+    """
+    MinHash signature of a note: for each of NOTE_MINHASH_PERMUTATIONS hash
+    functions (a*x + b mod p over crc32 shingle hashes), the minimum over the
+    note's shingles. The share of equal positions between two signatures
+    estimates the Jaccard similarity of the notes' shingle sets. None for a
+    note without any words, which is never related to anything.
+    """
+    shingles = set(_shingles(title, content))
+    if not shingles:
+        return None
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    values = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return values.min(axis=1).astype("<u4")
+
+
+def lsh_buckets(sig: np.ndarray) -> List[int]:
+    """
+    One bucket id per band of NOTE_LSH_BANDS rows. Notes whose signatures agree
+    on a whole band share its bucket; with b bands of r rows, pairs of Jaccard
+    similarity s become candidates with probability 1 - (1 - s**r)**b.
+    """
+    bands = settings.NOTE_LSH_BANDS
+    rows = len(sig) // bands
+    return [
+        zlib.crc32(sig[band * rows : (band + 1) * rows].tobytes(), band) & 0x7FFFFFFF
+        for band in range(bands)
+    ]
+
+
+def similarities(sig: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of sig to each row of others."""
+    if not len(others):
+        return np.zeros(0, dtype=np.float32)
+    return (others == sig).mean(axis=1)
+
+
+def to_bytes(sig: np.ndarray) -> bytes:
+    return sig.tobytes()
+
+
+def from_bytes(data: List[bytes]) -> np.ndarray:
+    """Stacks stored signatures into a (len(data), permutations) matrix."""
+    return np.frombuffer(b"".join(data), dtype="<u4").reshape(len(data), -1)
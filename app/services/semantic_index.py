@@ -0,0 +1,263 @@
+import logging
+import re
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_TITLE_WEIGHT = 2.0
+_NGRAM_WEIGHT = 0.5  # Per character n-gram, so a whole word still dominates
+_NGRAM_SIZES = (3, 4)
+
+
+def _features(text: str, weight: float) -> Iterable[Tuple[str, float]]:
+    """Words plus the character n-grams of each word (with boundary markers)."""
+    for word in _WORD.findall(text.lower()):
+        yield word, weight
+        padded = f"<{word}>"
+        for size in _NGRAM_SIZES:
+            for i in range(len(padded) - size + 1):
+                yield padded[i : i + size], weight * _NGRAM_WEIGHT
+
+
+def embed(title: Optional[str], content: Optional[str], dim: int) -> np.ndarray:
+    """
+    Local, deterministic embedding of a note: word and character n-gram features
+    hashed (crc32, with a hash-derived sign) into `dim` buckets, log-scaled and
+    L2-normalized. Needs no model or network; n-grams make inflections and typos
+    ("appointment"/"appointments") land close together.
+    """
+    buckets: List[int] = []
+    weights: List[float] = []
+    for text, weight in ((title, _TITLE_WEIGHT), (content, 1.0)):
+        for feature, feature_weight in _features(text or "", weight):
+            h = zlib.crc32(feature.encode())
+            buckets.append(h % dim)
+            weights.append(feature_weight if h & 0x80000000 else -feature_weight)
+    vector = np.zeros(dim, dtype=np.float32)
+    if buckets:
+        np.add.at(vector, np.asarray(buckets), np.asarray(weights, dtype=np.float32))
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+    return vector
+
+
+class _UserMatrix:
+    """A user's vectors stacked for scoring, with IDF weights applied."""
+
+    def __init__(self, version: int, note_ids: np.ndarray, vectors: np.ndarray):
+        self.version = version
+        self.note_ids = note_ids
+        count = len(note_ids)
+        document_frequency = np.count_nonzero(vectors, axis=0)
+        self.idf = (
+            np.log((count + 1) / (document_frequency + 1)) + 1.0
+        ).astype(np.float32)
+        self.weighted = vectors * self.idf
+        norms = np.linalg.norm(self.weighted, axis=1)
+        norms[norms == 0] = 1.0
+        self.norms = norms
+
+
+class SemanticIndex:
+    """
+    Per-user vector index of notes for semantic search.
+
+    Each note's embedding (see embed) is kept as float16 bytes in a per-user
+    Redis hash, so a note write updates only its own entry and every worker
+    sees it. A version counter per user is bumped on each write; searches reuse
+    an in-process stacked matrix while the version is unchanged and otherwise
+    reload the hash with one HGETALL. Scoring is TF-IDF style: bucket IDF
+    weights computed over the user's notes, then one matrix-vector product for
+    the cosine scores of all notes.
+
+    A user's index is built from their notes on first search; until then
+    writes skip it. Redis errors never fail a note write or a search.
+    """
+
+    def __init__(self, dim: int, max_cached_users: int):
+        self.dim = dim
+        self.max_cached_users = max_cached_users
+        self.prefix = "semantic:"
+        self._matrices: "OrderedDict[int, _UserMatrix]" = OrderedDict()
+        self.searches = 0
+        self.matrix_hits = 0
+        self.matrix_loads = 0
+        self.builds = 0
+        self.updates = 0
+        self.errors = 0
+        self.local_fallbacks = 0
+
+    def _vectors_key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def _version_key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}:version"
+
+    def _encode(self, note) -> bytes:
+        return embed(note.title, note.content, self.dim).astype(np.float16).tobytes()
+
+    def is_built(self, user_id: int) -> bool:
+        return bool(redis_client.redis_client.exists(self._version_key(user_id)))
+
+    def build(self, user_id: int, notes: List) -> None:
+        """Indexes all of a user's notes (first search, or a reindex)."""
+        pipe = redis_client.redis_client.pipeline()
+        pipe.delete(self._vectors_key(user_id))
+        if notes:
+            pipe.hset(
+                self._vectors_key(user_id),
+                mapping={str(note.id): self._encode(note) for note in notes},
+            )
+        pipe.incr(self._version_key(user_id))
+        pipe.execute()
+        self.builds += 1
+
+    def upsert(self, notes: List) -> None:
+        """Updates the entries of written notes in their users' built indexes."""
+        by_user: Dict[int, List] = {}
+        for note in notes:
+            by_user.setdefault(note.user_id, []).append(note)
+        try:
+            for user_id, user_notes in by_user.items():
+                if not self.is_built(user_id):
+                    continue
+                pipe = redis_client.redis_client.pipeline()
+                pipe.hset(
+                    self._vectors_key(user_id),
+                    mapping={str(note.id): self._encode(note) for note in user_notes},
+                )
+                pipe.incr(self._version_key(user_id))
+                pipe.execute()
+                self.updates += len(user_notes)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to update semantic index: {e}")
+
+    def remove(self, user_id: int, note_id: int) -> None:
+        try:
+            if not self.is_built(user_id):
+                return
+            pipe = redis_client.redis_client.pipeline()
+            pipe.hdel(self._vectors_key(user_id), str(note_id))
+            pipe.incr(self._version_key(user_id))
+            pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to update semantic index: {e}")
+
+    def _matrix(self, user_id: int) -> Optional[_UserMatrix]:
+        version = redis_client.redis_client.get(self._version_key(user_id))
+        if version is None:
+            return None
+        version = int(version)
+        cached = self._matrices.get(user_id)
+        if cached is not None and cached.version == version:
+            self._matrices.move_to_end(user_id)
+            self.matrix_hits += 1
+            return cached
+
+        raw = redis_client.redis_client.hgetall(self._vectors_key(user_id))
+        self.matrix_loads += 1
+        note_ids = np.fromiter((int(k) for k in raw), dtype=np.int64, count=len(raw))
+        vectors = (
+            np.frombuffer(b"".join(raw.values()), dtype=np.float16)
+            .reshape(len(raw), self.dim)
+            .astype(np.float32)
+        )
+        matrix = _UserMatrix(version, note_ids, vectors)
+        self._matrices[user_id] = matrix
+        self._matrices.move_to_end(user_id)
+        while len(self._matrices) > self.max_cached_users:
+            self._matrices.popitem(last=False)
+        return matrix
+
+    def _rank(
+        self, matrix: _UserMatrix, query: str, k: int, min_score: float
+    ) -> List[Tuple[int, float]]:
+        if not len(matrix.note_ids):
+            return []
+        query_vector = embed(None, query, self.dim) * matrix.idf
+        query_norm = np.linalg.norm(query_vector)
+        if not query_norm:
+            return []
+        scores = (matrix.weighted @ query_vector) / (matrix.norms * query_norm)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(matrix.note_ids[i]), round(float(scores[i]), 4))
+            for i in top
+            if scores[i] > min_score
+        ]
+
+    def search(
+        self, user_id: int, query: str, k: int, min_score: float = 0.0
+    ) -> Optional[List[Tuple[int, float]]]:
+        """
+        Top-k (note_id, cosine score) pairs for the query, best first, or None
+        if the user's index is not built yet.
+        """
+        self.searches += 1
+        matrix = self._matrix(user_id)
+        if matrix is None:
+            return None
+        return self._rank(matrix, query, k, min_score)
+
+    def search_notes(
+        self,
+        user_id: int,
+        query: str,
+        k: int,
+        min_score: float,
+        load_notes: Callable[[], List],
+    ) -> List[Tuple[int, float]]:
+        """
+        Like search, building the user's index from load_notes() on first use.
+        If Redis is unavailable the notes are embedded in memory for this
+        search instead, so semantic search degrades to slower, not to an error.
+        """
+        try:
+            hits = self.search(user_id, query, k, min_score)
+            if hits is None:
+                self.build(user_id, load_notes())
+                hits = self.search(user_id, query, k, min_score)
+            return hits
+        except Exception as e:
+            self.errors += 1
+            self.local_fallbacks += 1
+            logger.warning(f"Semantic index unavailable, searching in memory: {e}")
+        notes = load_notes()
+        note_ids = np.fromiter((note.id for note in notes), np.int64, len(notes))
+        vectors = np.zeros((len(notes), self.dim), dtype=np.float32)
+        for row, note in enumerate(notes):
+            vectors[row] = embed(note.title, note.content, self.dim)
+        return self._rank(_UserMatrix(0, note_ids, vectors), query, k, min_score)
+
+    def stats(self) -> dict:
+        return {
+            "cached_users": len(self._matrices),
+            "searches": self.searches,
+            "matrix_hits": self.matrix_hits,
+            "matrix_loads": self.matrix_loads,
+            "builds": self.builds,
+            "updates": self.updates,
+            "errors": self.errors,
+            "local_fallbacks": self.local_fallbacks,
+        }
+
+
+# Create a singleton instance
+semantic_index = SemanticIndex(
+    dim=settings.SEMANTIC_SEARCH_DIM,
+    max_cached_users=settings.SEMANTIC_SEARCH_CACHED_USERS,
+)
@@ -0,0 +1,11 @@
+import asyncio
+import logging
+
+from app.core.config import settings
+from app.services import ai_jobs, ai_service
+
+# Standalone AI job worker: python -m app.worker
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ai_service.warm_up_model_pool()
+    asyncio.run(ai_jobs.run_worker(settings.AI_JOB_WORKER_CONCURRENCY))
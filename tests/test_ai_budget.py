@@ -0,0 +1,21 @@
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.ai_budget import budget_request, rewrite_input_limit
+
+
+def test_input_over_the_budget_is_rejected():
+    with pytest.raises(HTTPException) as raised:
+        budget_request("cleanup", settings.AI_MAX_INPUT_TOKENS + 1, None)
+    assert raised.value.status_code == 413
+
+    # Rewrites beyond the output cap are split by the caller, not rejected
+    config = budget_request("cleanup", rewrite_input_limit() * 2, None)
+    assert config.max_output_tokens == settings.AI_MAX_OUTPUT_TOKENS
+
+
+def test_rewrite_gets_an_output_cap_above_its_input():
+    config = budget_request("format", 1000, None)
+
+    assert config.max_output_tokens >= 1000 * settings.AI_OUTPUT_TOKEN_RATIO
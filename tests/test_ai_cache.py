@@ -0,0 +1,38 @@
+import asyncio
+
+from app.services.ai_cache import AiResultCache
+
+
+def test_key_covers_operation_model_and_inputs():
+    cache = AiResultCache(max_entries=8, ttl_seconds=60)
+    key = cache.make_key("format", model="m1", temperature=0.3, content="text")
+
+    assert key == cache.make_key("format", content="text", temperature=0.3, model="m1")
+    assert key != cache.make_key("cleanup", model="m1", temperature=0.3, content="text")
+    assert key != cache.make_key("format", model="m2", temperature=0.3, content="text")
+    assert key != cache.make_key("format", model="m1", temperature=0.5, content="text")
+    assert key != cache.make_key("format", model="m1", temperature=0.3, content="Text")
+
+
+def test_evicted_entries_are_still_served_from_redis(fake_redis):
+    cache = AiResultCache(max_entries=2, ttl_seconds=60, prefix="test:result:")
+
+    async def fill():
+        for name in ("a", "b", "c"):
+            await cache.set(cache.make_key("format", content=name), f"result {name}")
+
+    asyncio.run(fill())
+    assert cache.evictions == 1  # "a" left the local LRU first
+
+    key = cache.make_key("format", content="a")
+    assert asyncio.run(cache.get(key)) == "result a"
+    assert cache.redis_hits == 1
+    assert asyncio.run(cache.get(key)) == "result a"
+    assert cache.local_hits == 1  # Back in the LRU after the Redis hit
+
+
+def test_miss_for_unknown_key(fake_redis):
+    cache = AiResultCache(max_entries=2, ttl_seconds=60, prefix="test:result:")
+
+    assert asyncio.run(cache.get(cache.make_key("format", content="new"))) is None
+    assert cache.misses == 1
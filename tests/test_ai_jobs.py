@@ -0,0 +1,51 @@
+import asyncio
+
+from app.core.config import settings
+from app.services import ai_jobs
+
+
+def test_jobs_of_dead_workers_are_requeued(fake_redis):
+    fake_redis.sadd(ai_jobs.WORKERS_KEY, "dead", "alive")
+    fake_redis.lpush(ai_jobs._processing_key("dead"), "job-1", "job-2")
+    fake_redis.lpush(ai_jobs._processing_key("alive"), "job-3")
+    fake_redis.set(ai_jobs._heartbeat_key("alive"), 1)
+
+    assert ai_jobs._recover_orphaned_jobs() == 2
+
+    # Requeued at the consuming end, oldest first
+    assert fake_redis.rpop(ai_jobs.JOB_QUEUE_KEY) == b"job-1"
+    assert fake_redis.rpop(ai_jobs.JOB_QUEUE_KEY) == b"job-2"
+    assert fake_redis.smembers(ai_jobs.WORKERS_KEY) == {b"alive"}
+    assert fake_redis.lrange(ai_jobs._processing_key("alive"), 0, -1) == [b"job-3"]
+
+
+def _stored_job(**fields) -> dict:
+    job = {
+        "id": "job-1",
+        "action": "format",
+        "note_id": 1,
+        "user_id": 1,
+        "options": {},
+        "use_cache": True,
+        "status": "queued",
+        "error": None,
+        "note": None,
+        "created_at": "2025-01-01T00:00:00+00:00",
+    }
+    job.update(fields)
+    ai_jobs._save_job(job)
+    return job
+
+
+def test_finished_job_is_not_run_again(fake_redis):
+    _stored_job(status="succeeded")
+    asyncio.run(ai_jobs.run_job("job-1"))
+    assert ai_jobs.get_job("job-1")["status"] == "succeeded"
+
+
+def test_job_is_abandoned_after_max_attempts(fake_redis):
+    _stored_job(status="running", attempts=settings.AI_JOB_MAX_ATTEMPTS)
+    asyncio.run(ai_jobs.run_job("job-1"))
+    job = ai_jobs.get_job("job-1")
+    assert job["status"] == "failed"
+    assert job["attempts"] == settings.AI_JOB_MAX_ATTEMPTS + 1
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.services.ai_limiter import GeminiConcurrencyLimiter
+
+
+def test_freed_slots_admit_several_waiters_at_once(fake_redis):
+    limiter = GeminiConcurrencyLimiter(max_in_flight=3, prefix="test:limiter:")
+    assert all(limiter._try_acquire(f"x|{i}") for i in range(3))
+    waiters = ["a|1", "a|2", "b|1"]
+    assert not any(limiter._try_acquire(waiter) for waiter in waiters)
+
+    for i in range(3):
+        limiter._forget(f"x|{i}")
+
+    # Each waiter gets one of the three free slots on its next poll
+    assert all(limiter._try_acquire(waiter) for waiter in reversed(waiters))
+
+
+def test_free_slot_goes_to_the_least_served_user(fake_redis):
+    limiter = GeminiConcurrencyLimiter(max_in_flight=2, prefix="test:limiter:")
+    assert limiter._try_acquire("a|0")
+    assert limiter._try_acquire("a|1")
+    assert not limiter._try_acquire("a|2")  # Oldest waiter, but user a has 2 calls
+    assert not limiter._try_acquire("b|1")
+
+    limiter._forget("a|0")
+
+    assert not limiter._try_acquire("a|2")
+    assert limiter._try_acquire("b|1")
+
+
+def test_waiting_too_long_is_a_429(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "AI_LIMITER_QUEUE_TIMEOUT_SECONDS", 0.1)
+    limiter = GeminiConcurrencyLimiter(max_in_flight=1, prefix="test:limiter:")
+    assert limiter._try_acquire("a|0")
+
+    async def wait_for_slot():
+        async with limiter.slot(user_id=2):
+            pass
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(wait_for_slot())
+    assert raised.value.status_code == 429
+    assert raised.value.headers == {"Retry-After": "5"}
+    assert fake_redis.zcard(limiter.waiting_key) == 0  # The waiter left the queue
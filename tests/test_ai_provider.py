@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import GenerationConfig
+
+from app.services.ai_provider import FakeProvider
+from app.services.ai_usage import TokenUsage
+
+
+def make_provider(**kwargs) -> FakeProvider:
+    kwargs.setdefault("latency_distribution", "fixed")
+    kwargs.setdefault("latency_ms", 0)
+    return FakeProvider(seed=7, **kwargs)
+
+
+def test_output_is_deterministic_per_prompt():
+    provider = make_provider()
+    first = asyncio.run(provider.generate("same prompt"))
+    again = asyncio.run(make_provider().generate("same prompt"))
+    other = asyncio.run(provider.generate("another prompt"))
+    assert first == again
+    assert first != other
+    assert len(first.split()) == provider.output_words
+
+
+def test_counts_usage_and_respects_output_cap():
+    provider = make_provider()
+    usage = TokenUsage()
+    text = asyncio.run(
+        provider.generate(
+            "prompt", GenerationConfig(max_output_tokens=10), usage=usage
+        )
+    )
+    assert len(text.split()) == 10
+    assert usage.prompt_tokens > 0 and usage.output_tokens > 0
+
+
+def test_json_mode_echoes_the_input_items():
+    provider = make_provider()
+    prompt = 'Tasks:\n[{"id": 3, "title": "buy milk"}]'
+    text = asyncio.run(
+        provider.generate(
+            prompt, GenerationConfig(response_mime_type="application/json")
+        )
+    )
+    assert json.loads(text) == [{"id": 3, "title": "buy milk (fake)"}]
+
+
+def test_injects_configured_errors():
+    provider = make_provider(error_rate=1.0, error_kind="rate_limited")
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        asyncio.run(provider.generate("prompt"))
+    assert provider.calls == 1
+    assert provider.injected_errors == 1
+
+
+def test_stream_yields_the_same_text_in_chunks():
+    provider = make_provider(stream_chunk_words=5)
+
+    async def collect():
+        return [chunk async for chunk in provider.stream("prompt")]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert "".join(chunks) == asyncio.run(provider.generate("prompt"))
+
+
+def test_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        FakeProvider(latency_distribution="bimodal")
+    with pytest.raises(ValueError):
+        FakeProvider(error_kind="teapot")
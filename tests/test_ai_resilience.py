@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+
+from app.services.ai_provider import FakeProvider
+from app.services.ai_resilience import CircuitBreaker, ResilientCaller
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_breaker(clock: FakeClock) -> CircuitBreaker:
+    return CircuitBreaker(
+        window_seconds=60, min_calls=4, error_rate=0.5, open_seconds=30, clock=clock
+    )
+
+
+def failing_provider(**kwargs) -> FakeProvider:
+    return FakeProvider(
+        latency_distribution="fixed", latency_ms=0, error_rate=1.0, seed=1, **kwargs
+    )
+
+
+def test_breaker_opens_then_half_opens_then_closes():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        assert breaker.before_call() is False
+        breaker.record(False)
+    assert breaker.state == "open"
+
+    with pytest.raises(HTTPException) as error:
+        breaker.before_call()
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "30"
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True  # The single probe
+    with pytest.raises(HTTPException):
+        breaker.before_call()  # Everyone else still fails fast
+
+    breaker.record(True, probe=True)
+    assert breaker.state == "closed"
+    assert breaker.current_error_rate() == 0.0
+    assert breaker.before_call() is False
+
+
+def test_breaker_reopens_when_probe_fails():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    probe = breaker.before_call()
+    breaker.record(False, probe)
+    assert breaker.state == "open"
+    clock.now += 29
+    assert breaker.state == "open"
+    clock.now += 1
+    assert breaker.state == "half_open"
+
+
+def make_caller(delays: list, breaker: CircuitBreaker = None) -> ResilientCaller:
+    async def sleep(seconds: float) -> None:
+        delays.append(seconds)
+
+    return ResilientCaller(
+        breaker=breaker or make_breaker(FakeClock()),
+        max_attempts=3,
+        base_delay=0.1,
+        max_delay=0.25,
+        sleep=sleep,
+        rng=lambda: 1.0,
+    )
+
+
+def test_retries_with_capped_exponential_backoff():
+    provider = failing_provider()
+    delays = []
+    caller = make_caller(delays)
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        asyncio.run(caller.call(lambda: provider.generate("prompt")))
+
+    assert provider.calls == 3
+    assert delays == [0.1, 0.2]
+    assert caller.retries == 2
+    assert caller.backoff_delay(10) == 0.25
+
+
+def test_retry_recovers_after_transient_error():
+    provider = failing_provider()
+    delays = []
+    caller = make_caller(delays)
+
+    async def sleep(seconds: float) -> None:
+        delays.append(seconds)
+        provider.error_rate = 0.0  # Upstream recovers during the backoff
+
+    caller._sleep = sleep
+    text = asyncio.run(caller.call(lambda: provider.generate("prompt")))
+
+    assert text
+    assert provider.calls == 2
+    assert delays == [0.1]
+
+
+def test_non_retryable_error_is_not_retried():
+    provider = failing_provider(error_kind="invalid")
+    delays = []
+    caller = make_caller(delays)
+
+    with pytest.raises(google_exceptions.InvalidArgument):
+        asyncio.run(caller.call(lambda: provider.generate("prompt")))
+
+    assert provider.calls == 1
+    assert delays == []
+    assert caller.breaker.current_error_rate() == 0.0
+
+
+def test_open_breaker_stops_calls_reaching_the_provider():
+    provider = failing_provider()
+    breaker = CircuitBreaker(
+        window_seconds=60, min_calls=3, error_rate=0.5, open_seconds=30
+    )
+    caller = make_caller([], breaker)
+
+    # Three failed attempts open the breaker
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        asyncio.run(caller.call(lambda: provider.generate("prompt")))
+    assert breaker.state == "open"
+    calls = provider.calls
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(caller.call(lambda: provider.generate("prompt")))
+    assert error.value.status_code == 503
+    assert provider.calls == calls
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import GenerationConfig
+
+from app.core.config import settings
+from app.services import ai_service
+from app.services.ai_router import ModelRouter
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ModelRouter(
+        primary="primary",
+        lite="lite",
+        lite_operations=["tasks"],
+        lite_max_tokens=300,
+        window_seconds=300,
+    )
+    monkeypatch.setattr(ai_service, "model_router", router)
+    monkeypatch.setattr(settings, "AI_ROUTING_ENABLED", True)
+
+    async def call_once(fn):
+        return await fn()
+
+    # One attempt per call, without touching the shared circuit breaker
+    monkeypatch.setattr(ai_service.gemini_resilience, "call", call_once)
+    return router
+
+
+def _fail_with(monkeypatch, error):
+    async def request(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(ai_service, "_request_gemini", request)
+
+
+def test_only_upstream_errors_count_against_a_model(fake_redis, monkeypatch, router):
+    blocked = HTTPException(status_code=400, detail="Prompt blocked")
+    _fail_with(monkeypatch, blocked)
+    with pytest.raises(HTTPException):
+        asyncio.run(ai_service._call_gemini_api("hi", operation="tasks"))
+    assert router._health["lite"].samples() == 0
+
+    unavailable = HTTPException(status_code=503, detail="AI service error")
+    unavailable.__cause__ = google_exceptions.ServiceUnavailable("down")
+    _fail_with(monkeypatch, unavailable)
+    with pytest.raises(HTTPException):
+        asyncio.run(ai_service._call_gemini_api("hi", operation="tasks"))
+    assert router._health["lite"].error_rate() == 1.0
+
+
+def test_cancelled_call_is_not_observed(fake_redis, monkeypatch, router):
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(ai_service, "_request_gemini", hang)
+
+    async def cancel_hedge_loser():
+        task = asyncio.create_task(ai_service._call_gemini_api("hi", operation="tasks"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_hedge_loser())
+    assert router._health["lite"].samples() == 0
+
+
+def test_cached_results_are_keyed_by_the_routed_model(fake_redis, monkeypatch, router):
+    calls = []
+
+    async def fake_call(prompt, generation_config=None, operation=None, **kwargs):
+        calls.append(kwargs["model"])
+        return f"answer from {kwargs['model']}"
+
+    monkeypatch.setattr(ai_service, "_call_gemini_api", fake_call)
+
+    def generate():
+        return asyncio.run(
+            ai_service._generate_cached(
+                "tasks",
+                "List tasks for: routed cache test",
+                GenerationConfig(temperature=0.5),
+                title="routed cache test",
+            )
+        )
+
+    assert generate() == "answer from lite"
+    assert generate() == "answer from lite"
+    monkeypatch.setattr(settings, "AI_ROUTING_ENABLED", False)
+    assert generate() == "answer from primary"
+    assert calls == ["lite", "primary"]
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from app.services import ai_service
+from app.services.ai_budget import count_tokens, rewrite_input_limit
+from app.services.gemini_pool import model_pool
+
+CALL_SECONDS = 0.3
+
+
+class SlowModel:
+    """Stands in for a pooled GenerativeModel whose async call takes a while."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate_content_async(self, contents, safety_settings=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(CALL_SECONDS)
+        finally:
+            self.in_flight -= 1
+        candidate = SimpleNamespace(
+            finish_reason=None, content=SimpleNamespace(parts=["text"])
+        )
+        return SimpleNamespace(
+            prompt_feedback=None,
+            candidates=[candidate],
+            text=f"answer to {contents}",
+            usage_metadata=None,
+        )
+
+
+def test_concurrent_calls_overlap(fake_redis, monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(model_pool, "get", lambda *args, **kwargs: model)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            ai_service._call_gemini_api("first prompt"),
+            ai_service._call_gemini_api("second prompt"),
+        )
+        return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(run())
+
+    assert results == ["answer to first prompt", "answer to second prompt"]
+    assert model.max_in_flight == 2
+    # Both calls together take about as long as one, not two
+    assert elapsed < CALL_SECONDS * 1.6
+
+
+def test_only_patches_that_apply_are_cached(fake_redis, monkeypatch):
+    content = "Teh quick brown fox jumps over the lazy dog."
+    answers = [
+        '[{"find": "missing", "replace": "x"}]',
+        '[{"find": "Teh", "replace": "The"}]',
+    ]
+    calls = []
+
+    async def fake_call(prompt, generation_config=None, operation=None, **kwargs):
+        calls.append(operation)
+        return answers[min(len(calls), len(answers)) - 1]
+
+    monkeypatch.setattr(ai_service, "_call_gemini_api", fake_call)
+
+    def patch():
+        return asyncio.run(
+            ai_service._generate_patched("cleanup", content, None, use_cache=True)
+        )
+
+    assert patch() is None  # Not applicable, so asked for again next time
+    fixed = "The quick brown fox jumps over the lazy dog."
+    assert patch() == fixed
+    assert patch() == fixed
+    assert calls == ["cleanup_patch", "cleanup_patch"]
+
+
+def test_note_too_long_for_one_response_is_rewritten_in_sections(
+    fake_redis, monkeypatch
+):
+    paragraphs = [f"Paragraph {i} " + "word " * 400 for i in range(40)]
+    content = "\n\n".join(p.strip() for p in paragraphs)
+    calls = []
+
+    async def fake_call(prompt, generation_config=None, operation=None, **kwargs):
+        section = prompt.split("**Input Text:**\n---\n")[1].split("\n---")[0]
+        calls.append((operation, count_tokens(section)))
+        return section.upper()
+
+    monkeypatch.setattr(ai_service, "_call_gemini_api", fake_call)
+
+    result = asyncio.run(ai_service.polish_content(content, use_cache=False))
+
+    assert result == content.upper()
+    assert len(calls) > 1
+    assert all(operation == "polish_section" for operation, _ in calls)
+    assert all(tokens <= rewrite_input_limit() for _, tokens in calls)
+
+
+def test_only_changed_paragraphs_are_resent(fake_redis, monkeypatch):
+    paragraphs = [f"Paragraph number {i} of the incremental note." for i in range(4)]
+    calls = []
+
+    async def fake_call(prompt, generation_config=None, operation=None, **kwargs):
+        section = prompt.split("**Input Text:**\n---\n")[1].split("\n---")[0]
+        calls.append((operation, section))
+        return section.upper()
+
+    monkeypatch.setattr(ai_service, "_call_gemini_api", fake_call)
+
+    async def run():
+        # An earlier run returned these paragraphs
+        await ai_service.paragraph_index.remember(
+            "format", ai_service.model_router.models_key(), paragraphs
+        )
+        edited = paragraphs[:2] + ["paragraph two was edited"] + paragraphs[3:]
+        return await ai_service._rewrite_changed_paragraphs(
+            "format", "\n\n".join(edited), None
+        )
+
+    result = asyncio.run(run())
+
+    assert calls == [("format_section", "paragraph two was edited")]
+    assert result.split("\n\n") == (
+        paragraphs[:2] + ["PARAGRAPH TWO WAS EDITED"] + paragraphs[3:]
+    )
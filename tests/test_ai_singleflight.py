@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from app.services.ai_singleflight import single_flight
+
+
+def test_concurrent_callers_share_one_call(fake_redis):
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "shared answer"
+
+    async def run():
+        return await asyncio.gather(
+            *(single_flight.do("same-prompt", generate) for _ in range(3))
+        )
+
+    assert asyncio.run(run()) == ["shared answer"] * 3
+    assert len(calls) == 1
+    # The lock is released once the result is published
+    assert not fake_redis.exists(f"{single_flight.prefix}lock:same-prompt")
+
+
+def test_caller_on_another_worker_gets_the_published_result(fake_redis, monkeypatch):
+    lock_key = f"{single_flight.prefix}lock:remote-prompt"
+    result_key = f"{single_flight.prefix}result:remote-prompt"
+    fake_redis.set(lock_key, "other-worker", px=60000)  # Another worker is leader
+
+    async def generate():
+        raise AssertionError("the leader's result should be reused")
+
+    async def run():
+        waiter = asyncio.create_task(single_flight.do("remote-prompt", generate))
+        await asyncio.sleep(0.05)
+        fake_redis.set(result_key, json.dumps({"text": "remote answer"}))
+        return await waiter
+
+    assert asyncio.run(run()) == "remote answer"
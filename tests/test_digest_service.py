@@ -0,0 +1,19 @@
+import pytest
+
+from app.services.digest_service import digest_pipeline
+
+
+def test_lock_is_only_extended_and_released_by_its_holder(fake_redis):
+    assert digest_pipeline._acquire("run-1")
+    fake_redis.expire("digest:lock", 5)
+
+    digest_pipeline._extend("run-1")
+    assert fake_redis.ttl("digest:lock") > 5
+
+    # Expired and taken over by another worker
+    fake_redis.set("digest:lock", "run-2", ex=5)
+    with pytest.raises(RuntimeError):
+        digest_pipeline._extend("run-1")
+    digest_pipeline._release("run-1")
+    assert fake_redis.get("digest:lock") == b"run-2"
+    assert fake_redis.ttl("digest:lock") <= 5
@@ -0,0 +1,25 @@
+import asyncio
+
+from app.services.gemini_context_cache import GeminiContextCache
+
+
+def test_failed_upload_is_not_retried_until_it_expires(monkeypatch):
+    cache = GeminiContextCache(max_entries=4, ttl_seconds=600, failure_ttl_seconds=60)
+    attempts = []
+
+    def failing_create(model_name, text):
+        attempts.append(text)
+        raise RuntimeError("content too small to cache")
+
+    monkeypatch.setattr(cache, "_create", failing_create)
+
+    async def actions():
+        return [await cache.get_or_create("model", "note text") for _ in range(3)]
+
+    assert asyncio.run(actions()) == [None, None, None]
+    assert len(attempts) == 1
+    assert cache.stats()["skipped_failed"] == 2
+
+    cache._failed[next(iter(cache._failed))] = 0.0  # Expired
+    asyncio.run(cache.get_or_create("model", "note text"))
+    assert len(attempts) == 2
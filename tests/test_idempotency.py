@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.core.idempotency import IdempotencyMiddleware
+
+
+async def _endless_stream(request):
+    payload = await request.body()
+
+    async def events():
+        while True:
+            yield b"data: " + payload + b"\n\n"
+            await asyncio.sleep(0.01)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _run_in_thread(coro_factory, timeout: float):
+    """Runs a coroutine on its own loop, so a busy-looping app cannot hang the test."""
+    result = {}
+
+    def target():
+        result["value"] = asyncio.run(coro_factory())
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "request did not finish after the client disconnected"
+    return result["value"]
+
+
+def _scope(path: str, key: bytes) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"idempotency-key", key), (b"authorization", b"Bearer t")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+
+def test_streamed_response_sees_client_disconnect(fake_redis):
+    app = IdempotencyMiddleware(
+        Starlette(routes=[Route("/api/v1/stream", _endless_stream, methods=["POST"])])
+    )
+    scope = _scope("/api/v1/stream", b"key-1")
+
+    async def request():
+        sent = []
+        disconnected = asyncio.Event()
+        requests = [{"type": "http.request", "body": b"hello", "more_body": False}]
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and message.get("body"):
+                disconnected.set()  # The client goes away after the first event
+
+        await app(scope, receive, send)
+        return sent
+
+    sent = _run_in_thread(request, timeout=5)
+
+    assert sent[0]["status"] == 200
+    assert sent[1]["body"] == b"data: hello\n\n"
+    # Streamed responses are not stored, so the key can be retried
+    assert fake_redis.keys("idem:*") == []
+
+
+def test_rate_limited_request_runs_again_on_retry(fake_redis):
+    calls = []
+
+    async def busy_then_ok(request):
+        calls.append(await request.body())
+        if len(calls) == 1:
+            return JSONResponse(
+                {"detail": "AI service is busy"},
+                status_code=429,
+                headers={"Retry-After": "5"},
+            )
+        return JSONResponse({"ok": True}, status_code=201)
+
+    app = IdempotencyMiddleware(
+        Starlette(routes=[Route("/api/v1/ai", busy_then_ok, methods=["POST"])])
+    )
+
+    async def request():
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(_scope("/api/v1/ai", b"key-2"), receive, send)
+        return sent
+
+    first = asyncio.run(request())
+    assert first[0]["status"] == 429
+    assert (b"retry-after", b"5") in first[0]["headers"]
+
+    assert asyncio.run(request())[0]["status"] == 201
+    assert len(calls) == 2
+
+    # The success is stored and replayed without reaching the endpoint
+    replayed = asyncio.run(request())
+    assert replayed[0]["status"] == 201
+    assert (b"idempotent-replayed", b"true") in replayed[0]["headers"]
+    assert len(calls) == 2
@@ -0,0 +1,31 @@
+from app.services.local_format import is_well_formed, normalize
+
+
+def test_nested_lists_keep_their_depth():
+    text = "* Fruit\n    * Apples\n        1) Green\n* Vegetables"
+
+    assert normalize(text) == "- Fruit\n  - Apples\n    1. Green\n- Vegetables"
+
+
+def test_identifiers_and_inline_code_are_kept():
+    text = "Override `__init__` and `a  **b**`, not __init__ itself."
+
+    assert normalize(text) == text
+
+
+def test_word_bounded_emphasis_is_unwrapped():
+    text = "This is **important** and __really urgent__."
+
+    assert normalize(text) == "This is important and really urgent."
+
+
+def test_leftover_markers_go_to_the_model():
+    assert is_well_formed(normalize("Call `__init__` first."))
+    assert not is_well_formed(normalize("Call __init__ first."))
+    assert not is_well_formed(normalize("Stars ** everywhere."))
+
+
+def test_space_before_high_punctuation_is_kept():
+    text = "Bonjour ! Ça va ? Note : rappel ; demain ."
+
+    assert normalize(text) == "Bonjour ! Ça va ? Note : rappel ; demain."
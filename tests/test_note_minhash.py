@@ -0,0 +1,52 @@
+import numpy as np
+
+from app.services import note_minhash
+
+_BASE = (
+    "Plan the team offsite: book the venue near the lake, confirm catering for "
+    "twenty people, send the agenda to everyone by Friday and collect dietary "
+    "requirements before the booking deadline next week"
+)
+
+
+def _jaccard(a: str, b: str) -> float:
+    first = set(note_minhash._shingles(None, a))
+    second = set(note_minhash._shingles(None, b))
+    return len(first & second) / len(first | second)
+
+
+def test_similarity_estimates_jaccard():
+    edited = _BASE.replace("Friday", "Thursday")
+    estimate = note_minhash.similarities(
+        note_minhash.signature(None, _BASE),
+        note_minhash.signature(None, edited)[None, :],
+    )[0]
+
+    assert abs(estimate - _jaccard(_BASE, edited)) < 0.15
+
+
+def test_near_duplicates_share_an_lsh_bucket():
+    words = _BASE.split()
+    base_buckets = set(note_minhash.lsh_buckets(note_minhash.signature(None, _BASE)))
+    # Every single-word edit keeps the note highly similar
+    for i in range(0, len(words), 3):
+        edited = " ".join(words[:i] + ["changed"] + words[i + 1 :])
+        buckets = note_minhash.lsh_buckets(note_minhash.signature(None, edited))
+        assert base_buckets & set(buckets), f"edit at word {i} was missed"
+
+
+def test_unrelated_notes_are_not_candidates():
+    other = "Grocery list: apples, oat milk, coffee beans, rice and two lemons"
+    signature = note_minhash.signature(None, other)
+
+    assert not set(note_minhash.lsh_buckets(signature)) & set(
+        note_minhash.lsh_buckets(note_minhash.signature(None, _BASE))
+    )
+    assert note_minhash.signature(None, "  ...  ") is None
+
+
+def test_signatures_round_trip_through_bytes():
+    signatures = [note_minhash.signature(None, text) for text in (_BASE, "a b c d")]
+    stored = [note_minhash.to_bytes(signature) for signature in signatures]
+
+    assert np.array_equal(note_minhash.from_bytes(stored), np.stack(signatures))
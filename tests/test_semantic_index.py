@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from app.services.semantic_index import SemanticIndex
+
+NOTES = [
+    SimpleNamespace(
+        id=1, user_id=7, title="Dentist", content="Book a dentist appointment"
+    ),
+    SimpleNamespace(
+        id=2, user_id=7, title="Groceries", content="Buy apples, rice and coffee"
+    ),
+    SimpleNamespace(
+        id=3, user_id=7, title="Trip", content="Pack the tent for the camping trip"
+    ),
+]
+
+
+def test_search_builds_the_index_and_ranks_related_notes_first(fake_redis):
+    index = SemanticIndex(dim=256, max_cached_users=2)
+
+    hits = index.search_notes(7, "appointments", 3, 0.0, lambda: NOTES)
+
+    assert hits[0][0] == 1  # Matches "appointment" through character n-grams
+    assert index.builds == 1
+    assert index.is_built(7)
+
+
+def test_updates_are_seen_by_the_next_search(fake_redis):
+    index = SemanticIndex(dim=256, max_cached_users=2)
+    index.build(7, NOTES)
+    assert index.search(7, "camping tent", 1)[0][0] == 3
+
+    moved = SimpleNamespace(id=2, user_id=7, title="Camping", content="Tent pegs")
+    index.upsert([moved])
+    index.remove(7, 3)
+
+    assert index.search(7, "camping tent", 1)[0][0] == 2
+    assert index.matrix_loads == 2  # Reloaded once the version changed
+
+
+def test_search_without_redis_falls_back_to_memory(monkeypatch):
+    index = SemanticIndex(dim=256, max_cached_users=2)
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(index, "search", unavailable)
+
+    hits = index.search_notes(7, "coffee", 1, 0.0, lambda: NOTES)
+
+    assert hits[0][0] == 2
+    assert index.local_fallbacks == 1